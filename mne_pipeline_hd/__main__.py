@@ -5,28 +5,42 @@ License: BSD 3-Clause
 Github: https://github.com/marsipu/mne-pipeline-hd
 """
 
-import logging
 import os
 import sys
-from importlib import resources
 
-from PyQt5.QtCore import QTimer, Qt
-from PyQt5.QtGui import QIcon, QFont
-from PyQt5.QtWidgets import QApplication
 
-import mne_pipeline_hd
-from mne_pipeline_hd.gui.gui_utils import StdoutStderrStream, UncaughtHook
-from mne_pipeline_hd.gui.welcome_window import WelcomeWindow
-from mne_pipeline_hd.pipeline.legacy import legacy_import_check
-from mne_pipeline_hd.pipeline.pipeline_utils import ismac, islin, QS
+def main_headless(argv):
+    """Run the pipeline from the command-line without importing PyQt5"""
+    os.environ["MNEPHD_HEADLESS"] = "True"
+    # Plots are only saved to files
+    os.environ.setdefault("MPLBACKEND", "agg")
 
-# Check for changes in required packages
-legacy_import_check()
+    from mne_pipeline_hd.pipeline.headless import main as headless_main
 
-import qdarktheme  # noqa: E402
+    return headless_main(argv)
 
 
-def main():
+def main_gui():
+    # The GUI-modules are imported here to allow the headless-mode without PyQt5
+    import logging
+    from importlib import resources
+
+    from PyQt5.QtCore import QTimer, Qt
+    from PyQt5.QtGui import QIcon, QFont
+    from PyQt5.QtWidgets import QApplication
+
+    import mne_pipeline_hd
+    from mne_pipeline_hd.gui.gui_utils import StdoutStderrStream, UncaughtHook
+    from mne_pipeline_hd.gui.welcome_window import WelcomeWindow
+    from mne_pipeline_hd.pipeline.legacy import legacy_import_check
+    from mne_pipeline_hd.pipeline.parallel import close_mp_pool
+    from mne_pipeline_hd.pipeline.pipeline_utils import ismac, islin, QS
+
+    # Check for changes in required packages
+    legacy_import_check()
+
+    import qdarktheme
+
     app_name = "mne-pipeline-hd"
     organization_name = "marsipu"
     domain_name = "https://github.com/marsipu/mne-pipeline-hd"
@@ -59,10 +73,6 @@ def main():
     os.environ["ETS_TOOLKIT"] = "qt4"
     os.environ["QT_API"] = "pyqt5"
 
-    # ToDo: MP
-    # # Set multiprocessing method to spawn
-    # multiprocessing.set_start_method('spawn')
-
     # Redirect stdout to capture it later in GUI
     sys.stdout = StdoutStderrStream("stdout")
     # Redirect stderr to capture it later in GUI
@@ -130,10 +140,19 @@ def main():
 
     # For Spyder to make console accessible again
     app.lastWindowClosed.connect(app.quit)
+    # Stop the worker-processes of the pipeline
+    app.aboutToQuit.connect(close_mp_pool)
 
     sys.exit(app.exec())
 
 
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "run":
+        sys.exit(main_headless(sys.argv[2:]))
+    else:
+        main_gui()
+
+
 if __name__ == "__main__":
     # Todo: Make Exception-Handling for PyQt-Start working (from event-loop?)
     main()
@@ -10,7 +10,8 @@ import pytest
 
 from mne_pipeline_hd.gui.main_window import MainWindow
 from mne_pipeline_hd.pipeline.controller import Controller
-from mne_pipeline_hd.pipeline.pipeline_utils import _set_test_run
+from mne_pipeline_hd.pipeline.data_cache import get_data_cache
+from mne_pipeline_hd.pipeline.pipeline_utils import QS, _set_test_run
 
 
 @pytest.fixture
@@ -32,3 +33,21 @@ def main_window(controller, qtbot):
     qtbot.addWidget(mw)
 
     return mw
+
+
+@pytest.fixture
+def data_cache():
+    # The size of the data-cache is a persistent setting,
+    # which is restored even if the test fails
+    old_cache_size = QS().value("data_cache_size")
+    QS().setValue("data_cache_size", 1)
+    cache = get_data_cache()
+    cache.clear()
+
+    yield cache
+
+    if old_cache_size is None:
+        QS().remove("data_cache_size")
+    else:
+        QS().setValue("data_cache_size", old_cache_size)
+    get_data_cache().clear()
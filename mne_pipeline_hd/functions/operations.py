@@ -8,14 +8,13 @@ Github: https://github.com/marsipu/mne-pipeline-hd
 from __future__ import print_function
 
 import gc
+import hashlib
 import logging
 import os
 import shutil
 import subprocess
 import sys
 import time
-from functools import reduce
-from itertools import combinations
 from os import environ
 from os.path import isdir, isfile, join
 from pathlib import Path
@@ -24,16 +23,36 @@ import autoreject as ar
 import mne
 import mne_connectivity
 import numpy as np
+from mne.io.constants import FIFF
+from mne.label import label_sign_flip
 from mne.preprocessing import ICA, find_bad_channels_maxwell
 
-from mne_pipeline_hd.pipeline.loading import MEEG
+from mne_pipeline_hd.pipeline.loading import (
+    MEEG,
+    create_memmap,
+    get_key_hash,
+    save_shared_file,
+)
 from mne_pipeline_hd.pipeline.pipeline_utils import (
     check_kwargs,
     compare_filep,
+    get_fingerprint,
     ismac,
     iswin,
     get_n_jobs,
 )
+from mne_pipeline_hd.pipeline.resources import limit_threads
+
+# The label-kernel needs the assembly of the imaging-kernel from mne,
+# without it the labels are extracted from the source-estimates
+try:
+    from mne.minimum_norm.inverse import (
+        _assemble_kernel,
+        _pick_channels_inverse_operator,
+        combine_xyz,
+    )
+except ImportError:
+    _assemble_kernel = None
 
 
 # Todo: Create docstrings for each function
@@ -48,18 +67,143 @@ def find_bads(meeg, n_jobs, **kwargs):
     else:
         coord_frame = "head"
 
-    # Set number of CPU-cores to use
-    os.environ["OMP_NUM_THREADS"] = str(get_n_jobs(n_jobs))
-
-    noisy_chs, flat_chs = find_bad_channels_maxwell(
-        raw, coord_frame=coord_frame, **kwargs
-    )
+    # Limit the threads of OpenMP (setting OMP_NUM_THREADS
+    # has no effect after numpy is imported)
+    with limit_threads(get_n_jobs(n_jobs)):
+        noisy_chs, flat_chs = find_bad_channels_maxwell(
+            raw, coord_frame=coord_frame, **kwargs
+        )
     logging.info(f"Noisy channels: {noisy_chs}\n" f"Flat channels: {flat_chs}")
     raw.info["bads"] = noisy_chs + flat_chs + raw.info["bads"]
     meeg.set_bad_channels(raw.info["bads"])
     meeg.save_raw(raw)
 
 
+def _get_filter_segments(raw, skip_by_annotation):
+    """Get the (start, stop)-samples of the segments, which are filtered
+    separately (as in mne.io.Raw.filter)."""
+    if isinstance(skip_by_annotation, str):
+        skip_by_annotation = [skip_by_annotation]
+    kinds = tuple([kind.upper() for kind in skip_by_annotation or []])
+    annotations = raw.annotations
+    skip_idxs = [
+        idx
+        for idx, desc in enumerate(annotations.description)
+        if desc.upper().startswith(kinds)
+    ]
+    onsets = annotations.onset[skip_idxs] - raw.first_time
+    starts = raw.time_as_index(onsets, use_rounding=True)
+    stops = raw.time_as_index(
+        onsets + annotations.duration[skip_idxs], use_rounding=True
+    )
+
+    # The segments between the (possibly overlapping) annotations
+    mask = np.ones(len(raw.times), int)
+    for start, stop in zip(starts, stops):
+        mask[start:stop] = 0
+    edges = np.diff(np.concatenate([[0], mask, [0]]))
+    segments = zip(np.where(edges == 1)[0], np.where(edges == -1)[0])
+    # Annotations without duration (e.g. edges of concatenated data)
+    # split the segments
+    boundaries = starts[starts == stops]
+    split_segments = list()
+    for start, stop in segments:
+        cuts = [b for b in boundaries if start < b < stop]
+        split_segments += list(zip([start] + cuts, cuts + [stop]))
+
+    return [(int(start), int(stop)) for start, stop in split_segments]
+
+
+def _filter_raw_blocks(raw, block_duration, skip_by_annotation, **filter_kwargs):
+    """Filter raw-data, which is not loaded, in overlapping blocks into
+    a memory-mapped file, so that only one block is in memory.
+
+    The blocks are padded with the samples needed by the filter, thus the
+    result matches mne.io.Raw.filter to numerical precision. The keyword
+    arguments are passed to mne.filter.filter_data.
+    """
+    sfreq = raw.info["sfreq"]
+    # Only data-channels are filtered (as in mne.io.Raw.filter)
+    picks = [
+        raw.ch_names.index(ch_name)
+        for ch_name in raw.copy().pick("data", exclude=[]).ch_names
+    ]
+    filt = mne.filter.create_filter(
+        None,
+        sfreq,
+        filter_kwargs["l_freq"],
+        filter_kwargs["h_freq"],
+        filter_length=filter_kwargs["filter_length"],
+        l_trans_bandwidth=filter_kwargs["l_trans_bandwidth"],
+        h_trans_bandwidth=filter_kwargs["h_trans_bandwidth"],
+        method=filter_kwargs["method"],
+        iir_params=filter_kwargs["iir_params"],
+        phase=filter_kwargs["phase"],
+        fir_window=filter_kwargs["fir_window"],
+        fir_design=filter_kwargs["fir_design"],
+        verbose=False,
+    )
+    # The length of the FIR-filter or the ringing of the IIR-filter
+    # (padlen only covers the ringing down to a threshold, thus it is extended
+    # until the truncated ringing is below numerical precision)
+    if isinstance(filt, dict):
+        pad = 8 * int(filt["padlen"])
+    else:
+        pad = 2 * len(filt)
+    block_size = max(int(block_duration * sfreq), 1)
+
+    data_out = create_memmap("raw_filtered", (len(raw.ch_names), raw.n_times))
+    segments = _get_filter_segments(raw, skip_by_annotation)
+    # Samples skipped by annotations are copied unfiltered
+    gaps = list()
+    cursor = 0
+    for start, stop in segments + [(raw.n_times, raw.n_times)]:
+        if start > cursor:
+            gaps.append((cursor, start))
+        cursor = stop
+    for start, stop, is_segment in sorted(
+        [(*seg, True) for seg in segments] + [(*gap, False) for gap in gaps]
+    ):
+        for block_start in range(start, stop, block_size):
+            block_stop = min(block_start + block_size, stop)
+            if is_segment:
+                pad_start = max(block_start - pad, start)
+                pad_stop = min(block_stop + pad, stop)
+                data = raw.get_data(start=pad_start, stop=pad_stop)
+                data[picks] = mne.filter.filter_data(
+                    data[picks], sfreq, verbose=False, **filter_kwargs
+                )
+                data = data[:, block_start - pad_start : block_stop - pad_start]
+            else:
+                data = raw.get_data(start=block_start, stop=block_stop)
+            data_out[:, block_start:block_stop] = data
+        data_out.flush()
+
+    # Update the filter-information like mne.io.Raw.filter
+    info = raw.info.copy()
+    l_freq, h_freq = filter_kwargs["l_freq"], filter_kwargs["h_freq"]
+    with info._unlock():
+        if (
+            h_freq is not None
+            and (l_freq is None or l_freq < h_freq)
+            and (info["lowpass"] is None or h_freq < info["lowpass"])
+        ):
+            info["lowpass"] = float(h_freq)
+        if (
+            l_freq is not None
+            and (h_freq is None or l_freq < h_freq)
+            and (info["highpass"] is None or l_freq > info["highpass"])
+        ):
+            info["highpass"] = float(l_freq)
+    raw_filtered = mne.io.RawArray(
+        data_out, info, first_samp=raw.first_samp, verbose=False
+    )
+    raw_filtered.set_annotations(raw.annotations)
+    raw_filtered.orig_format = raw.orig_format
+
+    return raw_filtered
+
+
 def filter_data(
     meeg,
     filter_target,
@@ -79,6 +223,7 @@ def filter_data(
     enable_cuda,
     erm_t_limit,
     bad_interpolation,
+    filter_block_duration,
 ):
     # Compare Parameters from last run
     filtered_path = meeg.io_dict[filter_target]["path"]
@@ -87,18 +232,54 @@ def filter_data(
     )
 
     if any([results[key] != "equal" for key in results]):
-        # Load Data
-        data = meeg.io_dict[filter_target]["load"]()
-
         # use cuda for filtering if enabled
         if enable_cuda:
             mne.cuda.init_cuda(ignore_config=True)
             n_jobs = "cuda"
 
-        # Filter Data
-        if filter_target == "evoked":
-            for evoked in data:
-                evoked.filter(
+        # Filter raw-data larger than the memory in blocks
+        if filter_target == "raw" and filter_block_duration:
+            data = _filter_raw_blocks(
+                meeg.load_raw(policy="lazy"),
+                filter_block_duration,
+                skip_by_annotation,
+                l_freq=highpass,
+                h_freq=lowpass,
+                filter_length=filter_length,
+                l_trans_bandwidth=l_trans_bandwidth,
+                h_trans_bandwidth=h_trans_bandwidth,
+                n_jobs=n_jobs,
+                method=filter_method,
+                iir_params=iir_params,
+                phase=fir_phase,
+                fir_window=fir_window,
+                fir_design=fir_design,
+                pad=fir_pad,
+            )
+        else:
+            # Load Data
+            data = meeg.io_dict[filter_target]["load"]()
+
+            # Filter Data
+            if filter_target == "evoked":
+                for evoked in data:
+                    evoked.filter(
+                        highpass,
+                        lowpass,
+                        filter_length=filter_length,
+                        l_trans_bandwidth=l_trans_bandwidth,
+                        h_trans_bandwidth=h_trans_bandwidth,
+                        n_jobs=n_jobs,
+                        method=filter_method,
+                        iir_params=iir_params,
+                        phase=fir_phase,
+                        fir_window=fir_window,
+                        fir_design=fir_design,
+                        skip_by_annotation=skip_by_annotation,
+                        pad=fir_pad,
+                    )
+            else:
+                data.filter(
                     highpass,
                     lowpass,
                     filter_length=filter_length,
@@ -113,22 +294,6 @@ def filter_data(
                     skip_by_annotation=skip_by_annotation,
                     pad=fir_pad,
                 )
-        else:
-            data.filter(
-                highpass,
-                lowpass,
-                filter_length=filter_length,
-                l_trans_bandwidth=l_trans_bandwidth,
-                h_trans_bandwidth=h_trans_bandwidth,
-                n_jobs=n_jobs,
-                method=filter_method,
-                iir_params=iir_params,
-                phase=fir_phase,
-                fir_window=fir_window,
-                fir_design=fir_design,
-                skip_by_annotation=skip_by_annotation,
-                pad=fir_pad,
-            )
 
         # Save Data
         if filter_target == "raw":
@@ -152,40 +317,81 @@ def filter_data(
             meeg, meeg.erm_processed_path, ["highpass", "lowpass", "bad_interpolation"]
         )
         if any([erm_results[key] != "equal" for key in erm_results]):
-            erm_raw = meeg.load_erm()
-
-            # Crop ERM-Measurement to limit if given
-            if erm_t_limit:
-                erm_length = erm_raw.n_times / erm_raw.info["sfreq"]  # in s
-                if erm_length > erm_t_limit:
-                    diff = erm_length - erm_t_limit
-                    tmin = diff / 2
-                    tmax = erm_length - diff / 2
-                    erm_raw.crop(tmin=tmin, tmax=tmax)
-
-            erm_raw.filter(
-                highpass,
-                lowpass,
-                filter_length=filter_length,
-                l_trans_bandwidth=l_trans_bandwidth,
-                h_trans_bandwidth=h_trans_bandwidth,
-                n_jobs=n_jobs,
-                method=filter_method,
-                iir_params=iir_params,
-                phase=fir_phase,
-                fir_window=fir_window,
-                fir_design=fir_design,
-                skip_by_annotation=skip_by_annotation,
-                pad=fir_pad,
-            )
-
+            # The processed Empty-Room-Data is shared between all MEEG-files
+            # with the same Empty-Room-Measurement and the same parameters
+            erm_info = mne.io.read_info(meeg.erm_path)
+            erm_key = {
+                "erm": meeg.erm,
+                "highpass": highpass,
+                "lowpass": lowpass,
+                "filter_length": filter_length,
+                "l_trans_bandwidth": l_trans_bandwidth,
+                "h_trans_bandwidth": h_trans_bandwidth,
+                "filter_method": filter_method,
+                "iir_params": iir_params,
+                "fir_phase": fir_phase,
+                "fir_window": fir_window,
+                "fir_design": fir_design,
+                "skip_by_annotation": skip_by_annotation,
+                "fir_pad": fir_pad,
+                "erm_t_limit": erm_t_limit,
+                "bads": sorted(erm_info["bads"]),
+                "bad_interpolation": bad_interpolation,
+            }
             if bad_interpolation == "raw":
+                # The bad channels are interpolated with the digitization
+                # of the MEEG-file
                 info = meeg.load_info()
-                erm_raw.info["dig"] = info["dig"]
-                erm_raw = erm_raw.interpolate_bads()
+                dig = np.array([d["r"] for d in info["dig"] or list()])
+                erm_key["dig"] = hashlib.sha1(dig.tobytes()).hexdigest()
+            shared_path = meeg.get_erm_shared_path(erm_key)
+
+            if isfile(shared_path):
+                print(f"{meeg.erm} already processed with the same parameters")
+            else:
+                erm_raw = meeg.load_erm(policy="lazy")
+
+                # Crop ERM-Measurement to limit if given
+                if erm_t_limit:
+                    erm_length = erm_raw.n_times / erm_raw.info["sfreq"]  # in s
+                    if erm_length > erm_t_limit:
+                        diff = erm_length - erm_t_limit
+                        tmin = diff / 2
+                        tmax = erm_length - diff / 2
+                        erm_raw.crop(tmin=tmin, tmax=tmax)
+                # Only read the cropped data
+                erm_raw.load_data()
+
+                erm_raw.filter(
+                    highpass,
+                    lowpass,
+                    filter_length=filter_length,
+                    l_trans_bandwidth=l_trans_bandwidth,
+                    h_trans_bandwidth=h_trans_bandwidth,
+                    n_jobs=n_jobs,
+                    method=filter_method,
+                    iir_params=iir_params,
+                    phase=fir_phase,
+                    fir_window=fir_window,
+                    fir_design=fir_design,
+                    skip_by_annotation=skip_by_annotation,
+                    pad=fir_pad,
+                )
+
+                if bad_interpolation == "raw":
+                    erm_raw.info["dig"] = info["dig"]
+                    erm_raw = erm_raw.interpolate_bads()
 
-            meeg.save_erm_processed(erm_raw)
-            print("ERM-Data filtered and saved")
+                save_shared_file(
+                    shared_path,
+                    lambda path: erm_raw.save(
+                        path, fmt=erm_raw.orig_format, overwrite=True
+                    ),
+                )
+                print("ERM-Data filtered and saved")
+
+            # Only link the shared file for this MEEG-file
+            meeg.save_erm_link(shared_path)
         else:
             print(
                 f"{meeg.erm} already filtered with highpass={highpass} "
@@ -260,7 +466,8 @@ def eeg_reference_raw(meeg, ref_channels):
 def find_events(
     meeg, stim_channels, min_duration, shortest_event, adjust_timeline_by_msec
 ):
-    raw = meeg.load_raw()  # No copy to consume less memory
+    # Only the stim-channels are read (by find_events)
+    raw = meeg.load_raw(policy="lazy", picks=stim_channels or "stim")
 
     events = mne.find_events(
         raw,
@@ -284,195 +491,72 @@ def find_events(
         print("No events found")
 
 
+def _decode_binary_events(channel_onsets, tolerance=1):
+    """Combine the onsets of binary-coded stim-channels to events.
+
+    Parameters
+    ----------
+    channel_onsets : list of numpy.ndarray
+        The onset-samples of each channel (the channel with index i
+        codes the bit 2**i).
+    tolerance : int
+        The onsets of different channels within +/- tolerance samples
+        belong to the same event.
+
+    Returns
+    -------
+    events : numpy.ndarray, shape (n_events, 3)
+        The events as [sample, 0, code].
+    """
+    samples = list()
+    bits = list()
+    for idx, onsets in enumerate(channel_onsets):
+        onsets = np.sort(np.asarray(onsets, dtype=np.int64))
+        # Delete the first of two events within 1 sample on one channel
+        keep = np.append(np.diff(onsets) > 1, True)[: len(onsets)]
+        if not np.all(keep):
+            print(f"Two close events (1ms) at samples {onsets[~keep]}, first deleted")
+        samples.append(onsets[keep])
+        bits.append(np.full(np.sum(keep), 2**idx, dtype=np.int64))
+    samples = np.concatenate(samples)
+    bits = np.concatenate(bits)
+    if len(samples) == 0:
+        return np.empty((0, 3), dtype=np.int64)
+    order = np.argsort(samples, kind="stable")
+    samples = samples[order]
+    bits = bits[order]
+
+    # Onsets with overlapping tolerance-windows form one event
+    starts = np.flatnonzero(np.append(True, np.diff(samples) > 2 * tolerance))
+    ends = np.append(starts[1:], len(samples)) - 1
+    codes = np.bitwise_or.reduceat(bits, starts)
+    # The event is placed in the middle of the onsets of its channels
+    event_samples = (samples[starts] + samples[ends]) // 2
+
+    return np.stack([event_samples, np.zeros_like(codes), codes], axis=1)
+
+
 def find_6ch_binary_events(meeg, min_duration, shortest_event, adjust_timeline_by_msec):
-    raw = meeg.load_raw()  # No copy to consume less memory
+    # Only the stim-channels are read (once, for all channels)
+    stim_channels = [f"STI 00{idx}" for idx in range(1, 7)]
+    raw = meeg.load_raw(picks=stim_channels)
 
     # Binary Coding of 6 Stim Channels in Biomagenetism Lab Heidelberg
-    # prepare arrays
-    events = np.ndarray(shape=(0, 3), dtype=np.int32)
-    evs = list()
-    evs_tol = list()
-
-    # Find events for each stim channel, append sample values to list
-    evs.append(
-        mne.find_events(
-            raw,
-            min_duration=min_duration,
-            shortest_event=shortest_event,
-            stim_channel=["STI 001"],
-        )[:, 0]
-    )
-    evs.append(
-        mne.find_events(
-            raw,
-            min_duration=min_duration,
-            shortest_event=shortest_event,
-            stim_channel=["STI 002"],
-        )[:, 0]
-    )
-    evs.append(
+    channel_onsets = [
         mne.find_events(
             raw,
             min_duration=min_duration,
             shortest_event=shortest_event,
-            stim_channel=["STI 003"],
+            stim_channel=[stim_channel],
         )[:, 0]
-    )
-    evs.append(
-        mne.find_events(
-            raw,
-            min_duration=min_duration,
-            shortest_event=shortest_event,
-            stim_channel=["STI 004"],
-        )[:, 0]
-    )
-    evs.append(
-        mne.find_events(
-            raw,
-            min_duration=min_duration,
-            shortest_event=shortest_event,
-            stim_channel=["STI 005"],
-        )[:, 0]
-    )
-    evs.append(
-        mne.find_events(
-            raw,
-            min_duration=min_duration,
-            shortest_event=shortest_event,
-            stim_channel=["STI 006"],
-        )[:, 0]
-    )
-
-    for i in evs:
-        # delete events in each channel,
-        # which are too close too each other (1ms)
-        too_close = np.where(np.diff(i) <= 1)
-        if np.size(too_close) >= 1:
-            print(
-                f"Two close events (1ms) at samples "
-                f"{i[too_close] + raw.first_samp}, first deleted"
-            )
-            i = np.delete(i, too_close, 0)
-            evs[evs.index(i)] = i
-
-        # add tolerance to each value
-        i_tol = np.ndarray(shape=(0, 1), dtype=np.int32)
-        for t in i:
-            i_tol = np.append(i_tol, t - 1)
-            i_tol = np.append(i_tol, t)
-            i_tol = np.append(i_tol, t + 1)
-
-        evs_tol.append(i_tol)
-
-    # Get events from combinated Stim-Channels
-    equals = reduce(
-        np.intersect1d,
-        (evs_tol[0], evs_tol[1], evs_tol[2], evs_tol[3], evs_tol[4], evs_tol[5]),
-    )
-    # elimnate duplicated events
-    too_close = np.where(np.diff(equals) <= 1)
-    if np.size(too_close) >= 1:
-        equals = np.delete(equals, too_close, 0)
-        equals -= 1  # correction, because of shift with deletion
-
-    for q in equals:
-        if (
-            q not in events[:, 0]
-            and q not in events[:, 0] + 1
-            and q not in events[:, 0] - 1
-        ):
-            events = np.append(events, [[q, 0, 63]], axis=0)
-
-    for a, b, c, d, e in combinations(range(6), 5):
-        equals = reduce(
-            np.intersect1d, (evs_tol[a], evs_tol[b], evs_tol[c], evs_tol[d], evs_tol[e])
-        )
-        too_close = np.where(np.diff(equals) <= 1)
-        if np.size(too_close) >= 1:
-            equals = np.delete(equals, too_close, 0)
-            equals -= 1
-
-        for q in equals:
-            if (
-                q not in events[:, 0]
-                and q not in events[:, 0] + 1
-                and q not in events[:, 0] - 1
-            ):
-                events = np.append(
-                    events,
-                    [[q, 0, int(2**a + 2**b + 2**c + 2**d + 2**e)]],
-                    axis=0,
-                )
-
-    for a, b, c, d in combinations(range(6), 4):
-        equals = reduce(
-            np.intersect1d, (evs_tol[a], evs_tol[b], evs_tol[c], evs_tol[d])
-        )
-        too_close = np.where(np.diff(equals) <= 1)
-        if np.size(too_close) >= 1:
-            equals = np.delete(equals, too_close, 0)
-            equals -= 1
-
-        for q in equals:
-            if (
-                q not in events[:, 0]
-                and q not in events[:, 0] + 1
-                and q not in events[:, 0] - 1
-            ):
-                events = np.append(
-                    events, [[q, 0, int(2**a + 2**b + 2**c + 2**d)]], axis=0
-                )
-
-    for a, b, c in combinations(range(6), 3):
-        equals = reduce(np.intersect1d, (evs_tol[a], evs_tol[b], evs_tol[c]))
-        too_close = np.where(np.diff(equals) <= 1)
-        if np.size(too_close) >= 1:
-            equals = np.delete(equals, too_close, 0)
-            equals -= 1
-
-        for q in equals:
-            if (
-                q not in events[:, 0]
-                and q not in events[:, 0] + 1
-                and q not in events[:, 0] - 1
-            ):
-                events = np.append(
-                    events, [[q, 0, int(2**a + 2**b + 2**c)]], axis=0
-                )
-
-    for a, b in combinations(range(6), 2):
-        equals = np.intersect1d(evs_tol[a], evs_tol[b])
-        too_close = np.where(np.diff(equals) <= 1)
-        if np.size(too_close) >= 1:
-            equals = np.delete(equals, too_close, 0)
-            equals -= 1
-
-        for q in equals:
-            if (
-                q not in events[:, 0]
-                and q not in events[:, 0] + 1
-                and q not in events[:, 0] - 1
-            ):
-                events = np.append(events, [[q, 0, int(2**a + 2**b)]], axis=0)
-
-    # Get single-channel events
-    for i in range(6):
-        for e in evs[i]:
-            if (
-                e not in events[:, 0]
-                and e not in events[:, 0] + 1
-                and e not in events[:, 0] - 1
-            ):
-                events = np.append(events, [[e, 0, 2**i]], axis=0)
-
-    # sort only along samples(column 0)
-    events = events[events[:, 0].argsort()]
+        for stim_channel in stim_channels
+    ]
+    events = _decode_binary_events(channel_onsets)
 
     # apply latency correction
-    events[:, 0] = [
-        ts + np.round(adjust_timeline_by_msec * 10**-3 * raw.info["sfreq"])
-        for ts in events[:, 0]
-    ]
+    events[:, 0] += int(
+        np.round(adjust_timeline_by_msec * 10**-3 * raw.info["sfreq"])
+    )
 
     ids = np.unique(events[:, 2])
     print("unique ID's found: ", ids)
@@ -1150,14 +1234,34 @@ def prepare_bem(fsmri, bem_spacing, bem_conductivity):
 
 def morph_fsmri(meeg, morph_to):
     if meeg.fsmri.name != morph_to:
-        forward = meeg.load_forward()
-        morph = mne.compute_source_morph(
-            forward["src"],
-            subject_from=meeg.fsmri.name,
-            subject_to=morph_to,
-            subjects_dir=meeg.subjects_dir,
+        # The source-morph is shared by all MEEG-files of the same FSMRI
+        fsmri = meeg.fsmri
+        morph_fp = get_fingerprint(fsmri.source_morph_path)
+        src_fp = get_fingerprint(fsmri.src_path)
+        is_current = (
+            not meeg.ct.get_setting("overwrite")
+            and morph_fp is not None
+            and src_fp is not None
+            and morph_fp[1] >= src_fp[1]
         )
-        meeg.save_source_morph(morph)
+        # A morph saved with other parameters is outdated as well
+        if is_current:
+            saved_morph = fsmri.load_source_morph()
+            is_current = (
+                saved_morph.subject_from == fsmri.name
+                and saved_morph.subject_to == morph_to
+            )
+        if is_current:
+            print(f"Source-morph from {fsmri.name} to {morph_to} already exists")
+        else:
+            src = fsmri.load_source_space()
+            morph = mne.compute_source_morph(
+                src,
+                subject_from=fsmri.name,
+                subject_to=morph_to,
+                subjects_dir=meeg.subjects_dir,
+            )
+            fsmri.save_source_morph(morph)
     else:
         logging.info(
             f"There is no need to morph the source-space for {meeg.name}, "
@@ -1205,20 +1309,62 @@ def morph_labels_from_fsaverage(fsmri):
         print(f"{parcellations} already exist")
 
 
+def _get_forward_key(meeg, info, trans, eeg):
+    """Get the parameters, which determine the forward-solution
+    (the sensor-geometry, the transformation, the BEM and the source-space)."""
+    picks = mne.pick_types(info, meg=True, eeg=eeg, ref_meg=True, exclude=[])
+    sensors = [
+        (
+            info["chs"][pick]["ch_name"],
+            info["chs"][pick]["coil_type"],
+            info["chs"][pick]["loc"].tolist(),
+        )
+        for pick in picks
+    ]
+    dev_head_t = info["dev_head_t"]
+    forward_key = {
+        "fsmri": meeg.fsmri.name,
+        "sensors": sensors,
+        "dev_head_t": None if dev_head_t is None else dev_head_t["trans"].tolist(),
+        "comps": len(info["comps"]),
+        "trans": trans["trans"].tolist(),
+        "eeg": eeg,
+    }
+    # The identity of the BEM-solution and the source-space
+    for data_type in ["bem_solution", "src"]:
+        path = meeg.fsmri.io_dict[data_type]["path"]
+        forward_key[data_type] = (path, get_fingerprint(path))
+
+    return forward_key
+
+
 def create_forward_solution(meeg, n_jobs, ch_types):
     info = meeg.load_info()
     trans = meeg.load_transformation()
-    bem = meeg.fsmri.load_bem_solution()
-    src = meeg.fsmri.load_source_space()
 
     if "eeg" in ch_types:
         eeg = True
     else:
         eeg = False
 
-    forward = mne.make_forward_solution(info, trans, src, bem, eeg=eeg, n_jobs=n_jobs)
+    # The forward-solution is shared between all MEEG-files
+    # with the same sensor-geometry, transformation, BEM and source-space
+    shared_path = meeg.get_forward_shared_path(_get_forward_key(meeg, info, trans, eeg))
+    if isfile(shared_path):
+        print(f"Forward-solution with the same geometry already exists for {meeg.name}")
+    else:
+        bem = meeg.fsmri.load_bem_solution()
+        src = meeg.fsmri.load_source_space()
+        forward = mne.make_forward_solution(
+            info, trans, src, bem, eeg=eeg, n_jobs=n_jobs
+        )
+        save_shared_file(
+            shared_path,
+            lambda path: mne.write_forward_solution(path, forward, overwrite=True),
+        )
 
-    meeg.save_forward(forward)
+    # Only link the shared file for this MEEG-file
+    meeg.save_forward_link(shared_path)
 
 
 def estimate_noise_covariance(
@@ -1266,27 +1412,292 @@ def create_inverse_operator(meeg):
 
 
 def source_estimate(meeg, inverse_method, pick_ori, lambda2):
-    inverse_operator = meeg.load_inverse_operator()
     evokeds = meeg.load_evokeds()
 
     stcs = {}
     for evoked in [ev for ev in evokeds if ev.comment in meeg.sel_trials]:
+        # Trials with the same number of averages share the prepared operator
+        inverse_operator = meeg.get_prepared_inverse(
+            evoked.nave, lambda2, inverse_method
+        )
         stc = mne.minimum_norm.apply_inverse(
-            evoked, inverse_operator, lambda2, method=inverse_method, pick_ori=pick_ori
+            evoked,
+            inverse_operator,
+            lambda2,
+            method=inverse_method,
+            pick_ori=pick_ori,
+            prepared=True,
         )
         stcs.update({evoked.comment: stc})
 
     meeg.save_source_estimates(stcs)
 
 
-def label_time_course(meeg, target_labels, extract_mode):
+def _pca_flip(flip, data):
+    """Get the first principal component of the data of a label,
+    with its sign aligned to the sign-flips and scaled
+    to the average power in the label."""
+    u, s, vh = np.linalg.svd(data, full_matrices=False)
+    sign = np.sign(u[:, 0] @ flip.ravel())
+    scale = np.linalg.norm(s) / np.sqrt(len(data))
+
+    return sign * scale * vh[0]
+
+
+# The extraction-modes for label-time-courses
+# (as in mne.extract_label_time_course)
+_label_funcs = {
+    "mean": lambda flip, data: np.mean(data, axis=0),
+    "mean_flip": lambda flip, data: np.mean(flip * data, axis=0),
+    "max": lambda flip, data: np.max(np.abs(data), axis=0),
+    "pca_flip": _pca_flip,
+}
+
+
+def _make_label_kernel(inverse_operator, labels, ch_names, method, pick_ori, mode):
+    """Restrict the imaging-kernel of a prepared inverse-operator
+    to the vertices of the labels.
+
+    For linear extraction-modes (mean and mean_flip of fixed or normal
+    orientations) the label-weights are folded into one projection
+    of shape (n_labels, n_channels), otherwise the restricted kernels
+    are kept for each label.
+
+    Parameters
+    ----------
+    inverse_operator : mne.minimum_norm.InverseOperator
+        The prepared inverse-operator.
+    labels : list of mne.Label
+        The labels to extract.
+    ch_names : list of str
+        The channel-names of the data the kernel will be applied to.
+    method : str
+        The inverse-method the operator was prepared with.
+    pick_ori : None | "normal"
+        The orientation to pick ("vector" is not supported).
+    mode : str
+        The extraction-mode as in mne.extract_label_time_course.
+
+    Returns
+    -------
+    label_kernel : dict
+        The channel-selection, the folded projection (or None)
+        and the kernels of each label.
+    """
+    if _assemble_kernel is None:
+        raise RuntimeError("The label-kernel is not supported by this mne-version.")
+    if pick_ori == "vector":
+        raise ValueError("The label-kernel does not support vector-orientations.")
+    if mode == "auto":
+        mode = "mean_flip"
+    if mode not in _label_funcs:
+        raise ValueError(f"The extraction-mode {mode} is not supported.")
+    is_free = (
+        inverse_operator["source_ori"] == FIFF.FIFFV_MNE_FREE_ORI
+        and pick_ori != "normal"
+    )
+    src = inverse_operator["src"]
+    sel = _pick_channels_inverse_operator(ch_names, inverse_operator)
+
+    label_kernels = list()
+    for label in labels:
+        K, noise_norm, _, _ = _assemble_kernel(
+            inverse_operator, label, method, pick_ori, verbose=False
+        )
+        if K.shape[0] == 0:
+            raise ValueError(
+                f"The source-space does not contain any vertices of {label.name}."
+            )
+        # Without combining the orientations the noise-normalization is linear
+        if not is_free and noise_norm is not None:
+            K *= noise_norm
+            noise_norm = None
+        if mode in ["mean_flip", "pca_flip"]:
+            flip = label_sign_flip(label, src)[:, np.newaxis]
+        else:
+            flip = None
+        label_kernels.append((K, noise_norm, flip))
+
+    if not is_free and mode in ["mean", "mean_flip"]:
+        kernel = np.array(
+            [
+                np.mean(K if flip is None else K * flip, axis=0)
+                for K, _, flip in label_kernels
+            ]
+        )
+    else:
+        kernel = None
+
+    return dict(
+        sel=sel, kernel=kernel, label_kernels=label_kernels, is_free=is_free, mode=mode
+    )
+
+
+def _apply_label_kernel(label_kernel, data):
+    """Apply a label-kernel to sensor-data.
+
+    Parameters
+    ----------
+    label_kernel : dict
+        The label-kernel from _make_label_kernel.
+    data : np.ndarray
+        The sensor-data with shape (n_channels, n_times)
+        or (n_epochs, n_channels, n_times).
+
+    Returns
+    -------
+    label_data : np.ndarray
+        The label-time-courses with shape (n_labels, n_times)
+        or (n_epochs, n_labels, n_times).
+    """
+    data = data[..., label_kernel["sel"], :]
+    if label_kernel["kernel"] is not None:
+        # One multiplication for all labels (and epochs)
+        return label_kernel["kernel"] @ data
+
+    if data.ndim == 3:
+        return np.array([_apply_label_kernel(label_kernel, d) for d in data])
+    label_func = _label_funcs[label_kernel["mode"]]
+    label_data = list()
+    for K, noise_norm, flip in label_kernel["label_kernels"]:
+        sol = K @ data
+        if label_kernel["is_free"]:
+            sol = combine_xyz(sol)
+        if noise_norm is not None:
+            sol *= noise_norm
+        label_data.append(label_func(flip, sol))
+
+    return np.array(label_data)
+
+
+def _extract_labels(label_index, data_list, mode):
+    """Extract the labels from the data of source-estimates
+    with the same vertices.
+
+    Parameters
+    ----------
+    label_index : dict
+        The label-index from FSMRI.get_label_index.
+    data_list : list of np.ndarray
+        The data of the source-estimates (e.g. of all trials),
+        each with shape (n_vertices, n_times).
+    mode : str
+        The extraction-mode as in mne.extract_label_time_course.
+
+    Returns
+    -------
+    label_data_list : list of np.ndarray
+        The label-time-courses with shape (n_labels, n_times)
+        for each source-estimate.
+    """
+    if mode == "auto":
+        mode = "mean_flip"
+    if mode in ["mean", "mean_flip"]:
+        # One sparse multiplication for all labels and source-estimates
+        label_data = label_index[mode] @ np.concatenate(data_list, axis=1)
+        splits = np.cumsum([data.shape[1] for data in data_list])[:-1]
+        return np.split(label_data, splits, axis=1)
+
+    label_func = _label_funcs[mode]
+    indptr = label_index["indptr"]
+    label_data_list = list()
+    for data in data_list:
+        label_data = list()
+        for start, stop in zip(indptr[:-1], indptr[1:]):
+            flip = label_index["flip"][start:stop, np.newaxis]
+            label_data.append(
+                label_func(flip, data[label_index["indices"][start:stop]])
+            )
+        label_data_list.append(np.array(label_data))
+
+    return label_data_list
+
+
+def label_kernel_time_course(
+    meeg, target_labels, extract_mode, inverse_method, pick_ori, lambda2
+):
+    evokeds = meeg.load_evokeds()
+    labels = meeg.fsmri.get_labels(target_labels)
+
+    ltc_dict = {}
+    # The label-kernel is computed once for each number of averages
+    label_kernels = {}
+
+    for evoked in [ev for ev in evokeds if ev.comment in meeg.sel_trials]:
+        if evoked.nave not in label_kernels:
+            inverse_operator = meeg.get_prepared_inverse(
+                evoked.nave, lambda2, inverse_method
+            )
+            label_kernels[evoked.nave] = _make_label_kernel(
+                inverse_operator,
+                labels,
+                evoked.ch_names,
+                inverse_method,
+                pick_ori,
+                extract_mode,
+            )
+        ltcs = _apply_label_kernel(label_kernels[evoked.nave], evoked.data)
+        ltc_dict[evoked.comment] = {
+            label.name: np.vstack((ltc, evoked.times))
+            for label, ltc in zip(labels, ltcs)
+        }
+
+    meeg.save_ltc(ltc_dict)
+
+
+def label_time_course(
+    meeg,
+    target_labels,
+    extract_mode,
+    label_backend,
+    inverse_method,
+    pick_ori,
+    lambda2,
+):
+    if label_backend == "kernel" and _assemble_kernel is None:
+        logging.warning("The label-kernel is not supported, using the stc-backend")
+    elif label_backend == "kernel":
+        label_kernel_time_course(
+            meeg, target_labels, extract_mode, inverse_method, pick_ori, lambda2
+        )
+        return
+
     stcs = meeg.load_source_estimates()
-    src = meeg.fsmri.load_source_space()
     labels = meeg.fsmri.get_labels(target_labels)
 
     ltc_dict = {}
 
-    for trial in stcs:
+    # Surface source-estimates with the same vertices are extracted
+    # with one label-index for all labels and trials
+    index_trials = [t for t in stcs if isinstance(stcs[t], mne.SourceEstimate)]
+    index_trials = [
+        t
+        for t in index_trials
+        if all(
+            [
+                np.array_equal(vn, index_vn)
+                for vn, index_vn in zip(
+                    stcs[t].vertices, stcs[index_trials[0]].vertices
+                )
+            ]
+        )
+    ]
+    if len(labels) > 0 and len(index_trials) > 0:
+        label_index = meeg.fsmri.get_label_index(labels, stcs[index_trials[0]].vertices)
+        ltcs = _extract_labels(
+            label_index, [stcs[t].data for t in index_trials], extract_mode
+        )
+        for trial, trial_ltcs in zip(index_trials, ltcs):
+            ltc_dict[trial] = {
+                label.name: np.vstack((ltc, stcs[trial].times))
+                for label, ltc in zip(labels, trial_ltcs)
+            }
+
+    # Other source-estimates (e.g. volume or vector) are extracted by mne
+    other_trials = [t for t in stcs if t not in ltc_dict]
+    if len(other_trials) > 0:
+        src = meeg.fsmri.load_source_space()
+    for trial in other_trials:
         ltc_dict[trial] = {}
         times = stcs[trial].times
         for label in labels:
@@ -1305,7 +1716,6 @@ def mixed_norm_estimate(meeg, pick_ori, inverse_method):
     evokeds = meeg.load_evokeds()
     forward = meeg.load_forward()
     noise_cov = meeg.load_noise_covariance()
-    inv_op = meeg.load_inverse_operator()
     if inverse_method == "dSPM":
         print("dSPM-Inverse-Solution existent, loading...")
         stcs = meeg.load_source_estimates()
@@ -1316,8 +1726,9 @@ def mixed_norm_estimate(meeg, pick_ori, inverse_method):
         lambda2 = 1.0 / snr**2
         for evoked in evokeds:
             trial = evoked.comment
+            inv_op = meeg.get_prepared_inverse(evoked.nave, lambda2, "dSPM")
             stcs[trial] = mne.minimum_norm.apply_inverse(
-                evoked, inv_op, lambda2, method="dSPM"
+                evoked, inv_op, lambda2, method="dSPM", prepared=True
             )
 
     mixn_dips = {}
@@ -1431,14 +1842,69 @@ def ecd_fit(meeg, ecd_times, ecd_positions, ecd_orientations, t_epoch):
     meeg.save_ecd(ecd_dips)
 
 
+def _morph_stcs(morph, stcs):
+    """Morph source-estimates (e.g. all trials of one or more runs
+    of the same subject) with one multiplication of the sparse morph-matrix.
+
+    Parameters
+    ----------
+    morph : mne.SourceMorph
+        The source-morph.
+    stcs : dict
+        The source-estimates with e.g. the trials as keys.
+
+    Returns
+    -------
+    morphed_stcs : dict
+        The morphed source-estimates with the same keys.
+    """
+    morphed_stcs = dict()
+    batch_keys = list()
+    for key, stc in stcs.items():
+        if (
+            morph.kind == "surface"
+            and isinstance(stc, (mne.SourceEstimate, mne.VectorSourceEstimate))
+            and stc.subject in [None, morph.subject_from]
+            and all(
+                [
+                    np.array_equal(v_morph, v_stc)
+                    for v_morph, v_stc in zip(
+                        morph.src_data["vertices_from"], stc.vertices
+                    )
+                ]
+            )
+        ):
+            batch_keys.append(key)
+        else:
+            # Other source-estimates are morphed (or rejected) by mne
+            morphed_stcs[key] = morph.apply(stc)
+
+    if len(batch_keys) > 0:
+        # Stack the times (and orientations) of all source-estimates
+        data = np.concatenate(
+            [stcs[key].data.reshape(stcs[key].data.shape[0], -1) for key in batch_keys],
+            axis=1,
+        )
+        data = morph.morph_mat @ data
+        start = 0
+        for key in batch_keys:
+            stc = stcs[key]
+            stop = start + stc.data[0].size
+            stc_data = data[:, start:stop].reshape((data.shape[0],) + stc.shape[1:])
+            morphed_stcs[key] = stc.__class__(
+                stc_data, morph.vertices_to, stc.tmin, stc.tstep, morph.subject_to
+            )
+            start = stop
+
+    return {key: morphed_stcs[key] for key in stcs}
+
+
 def apply_morph(meeg, morph_to):
     if meeg.fsmri.name != morph_to:
         stcs = meeg.load_source_estimates()
-        morph = meeg.load_source_morph()
+        morph = meeg.fsmri.get_source_morph()
 
-        morphed_stcs = {}
-        for trial in stcs:
-            morphed_stcs[trial] = morph.apply(stcs[trial])
+        morphed_stcs = _morph_stcs(morph, stcs)
         meeg.save_morphed_source_estimates(morphed_stcs)
     else:
         logging.info(
@@ -1447,6 +1913,122 @@ def apply_morph(meeg, morph_to):
         )
 
 
+def _get_epochs_label_ts(meeg, epochs, labels, inverse_method, lambda2, label_backend):
+    """Get the label-time-courses of all epochs, which are projected
+    to the labels once and cached in a file next to the epochs.
+
+    Parameters
+    ----------
+    meeg : MEEG
+        The MEEG-object the epochs belong to.
+    epochs : mne.Epochs
+        All epochs of the MEEG-object.
+    labels : list of mne.Label
+        The labels to extract (with mean_flip).
+    inverse_method : str
+        The inverse-method.
+    lambda2 : float
+        The regularization parameter.
+    label_backend : str
+        Extract the labels from the source-estimates (stc)
+        or with the label-kernel (kernel).
+
+    Returns
+    -------
+    label_ts : np.memmap
+        The label-time-courses with shape (n_epochs, n_labels, n_times).
+    """
+    label_ts_key = {
+        "epochs": (meeg.epochs_path, get_fingerprint(meeg.epochs_path)),
+        "inverse": (meeg.inverse_path, get_fingerprint(meeg.inverse_path)),
+        "labels": [
+            (label.name, hashlib.sha1(label.vertices.tobytes()).hexdigest())
+            for label in labels
+        ],
+        "lambda2": float(lambda2),
+        "method": inverse_method,
+        "label_backend": label_backend,
+    }
+    label_ts_path = join(
+        meeg.save_dir,
+        f"{meeg.name}_{meeg.p_preset}-{get_key_hash(label_ts_key)}-label-ts.npy",
+    )
+    if not isfile(label_ts_path):
+        inverse_operator = meeg.get_prepared_inverse(1, lambda2, inverse_method)
+        if label_backend == "kernel" and _assemble_kernel is not None:
+            label_kernel = _make_label_kernel(
+                inverse_operator,
+                labels,
+                epochs.ch_names,
+                inverse_method,
+                "normal",
+                "mean_flip",
+            )
+            # The label-time-courses of all epochs with one multiplication
+            label_ts = _apply_label_kernel(label_kernel, epochs.get_data())
+        else:
+            # By using "return_generator=True" only the source-estimate
+            # of one epoch is kept in memory
+            stcs = mne.minimum_norm.apply_inverse_epochs(
+                epochs,
+                inverse_operator,
+                lambda2,
+                inverse_method,
+                pick_ori="normal",
+                prepared=True,
+                return_generator=True,
+            )
+            # Average the source estimates within each label using
+            # sign-flips to reduce signal cancellations
+            label_index = None
+            label_ts = list()
+            for stc in stcs:
+                if label_index is None:
+                    label_index = meeg.fsmri.get_label_index(labels, stc.vertices)
+                label_ts += _extract_labels(label_index, [stc.data], "mean_flip")
+            label_ts = np.array(label_ts)
+        # Remove the label-time-courses of previous parameters
+        for old_path in Path(meeg.save_dir).glob(
+            f"{meeg.name}_{meeg.p_preset}-*-label-ts.npy"
+        ):
+            os.remove(old_path)
+        save_shared_file(label_ts_path, lambda path: np.save(path, label_ts))
+
+    return np.load(label_ts_path, mmap_mode="r")
+
+
+def _get_condition_selection(epochs, condition):
+    """Get the indices of the epochs of a condition, which can be
+    on any level of the "/"-hierarchy of the event-ids (like epochs[condition])."""
+    tags = set(condition.split("/"))
+    event_codes = [
+        code for key, code in epochs.event_id.items() if tags <= set(key.split("/"))
+    ]
+
+    return np.where(np.isin(epochs.events[:, 2], event_codes))[0]
+
+
+def _condition_connectivity(label_ts, selection, con_methods, sfreq, fmin, fmax):
+    con = mne_connectivity.spectral_connectivity_epochs(
+        label_ts[selection],
+        method=con_methods,
+        mode="multitaper",
+        sfreq=sfreq,
+        fmin=fmin,
+        fmax=fmax,
+        faverage=True,
+        mt_adaptive=True,
+        n_jobs=1,
+        verbose=False,
+    )
+    if not isinstance(con, list):
+        con = [con]
+
+    # con is a 3D array, get the connectivity for the first (and only)
+    # freq. band for each con_method
+    return [c.get_data(output="dense")[:, :, 0] for c in con]
+
+
 def src_connectivity(
     meeg,
     target_labels,
@@ -1456,101 +2038,53 @@ def src_connectivity(
     con_fmin,
     con_fmax,
     n_jobs,
+    label_backend,
 ):
-    info = meeg.load_info()
     all_epochs = meeg.load_epochs()
-    inverse_operator = meeg.load_inverse_operator()
-    src = inverse_operator["src"]
     labels = meeg.fsmri.get_labels(target_labels)
+    # Every epoch is projected to the labels only once for all conditions
+    label_ts = _get_epochs_label_ts(
+        meeg, all_epochs, labels, inverse_method, lambda2, label_backend
+    )
 
-    con_dict = {}
-
-    for trial in [t for t in all_epochs.event_id if t]:
-        con_dict[trial.split("/")[0]] = {}
-        epochs = all_epochs[trial.split("/")[0]]
-        # Compute inverse solution and for each epoch.
-        # By using "return_generator=True" stcs will be a generator object
-        # instead of a list.
-        stcs = mne.minimum_norm.apply_inverse_epochs(
-            epochs,
-            inverse_operator,
-            lambda2,
-            inverse_method,
-            pick_ori="normal",
-            return_generator=True,
-        )
-
-        label_ts = mne.extract_label_time_course(
-            stcs, labels, src, mode="mean_flip", return_generator=True
-        )
-
-        sfreq = info["sfreq"]  # the sampling frequency
-        con = mne_connectivity.spectral_connectivity_epochs(
-            label_ts,
-            method=con_methods,
-            mode="multitaper",
-            sfreq=sfreq,
-            fmin=con_fmin,
-            fmax=con_fmax,
-            faverage=True,
-            mt_adaptive=True,
-            n_jobs=n_jobs,
-        )
-
-        if not isinstance(con, list):
-            con = [con]
-
-        # con is a 3D array, get the connectivity for the first (and only)
-        # freq. band for each con_method
-        for method, c in zip(con_methods, con):
-            con_dict[trial.split("/")[0]][method] = c.get_data(output="dense")[:, :, 0]
-
-    meeg.save_connectivity(con_dict)
-
-    for trial in all_epochs.event_id:
-        con_dict[trial.split("/")[1]] = {}
-        # epochs = all_epochs[trial.split('/')[1]][:2]
-        epochs = all_epochs[trial.split("/")[1]]
-        # Compute inverse solution and for each epoch.
-        # By using "return_generator=True" stcs will be a generator object
-        # instead of a list.
-        stcs = mne.minimum_norm.apply_inverse_epochs(
-            epochs,
-            inverse_operator,
-            lambda2,
-            inverse_method,
-            pick_ori="normal",
-            return_generator=True,
-        )
-
-        # Average the source estimates within each label using
-        # sign-flips to reduce signal cancellations, also here we return a
-        # generator
-
-        label_ts = mne.extract_label_time_course(
-            stcs, labels, src, mode="mean_flip", return_generator=True
-        )
-
-        sfreq = info["sfreq"]  # the sampling frequency
-        con = mne_connectivity.spectral_connectivity(
+    selections = dict()
+    for trial in meeg.sel_trials:
+        selection = _get_condition_selection(all_epochs, trial)
+        if len(selection) == 0:
+            logging.warning(f"No epochs for {trial} in {meeg.name}")
+        else:
+            selections[trial] = selection
+    # Each condition and frequency-band is computed in parallel
+    bands = list(zip(np.atleast_1d(con_fmin), np.atleast_1d(con_fmax)))
+    jobs = [(trial, band) for trial in selections for band in bands]
+    parallel, p_fun, _ = mne.parallel.parallel_func(
+        _condition_connectivity, get_n_jobs(n_jobs)
+    )
+    results = parallel(
+        p_fun(
             label_ts,
-            method=con_methods,
-            mode="multitaper",
-            sfreq=sfreq,
-            fmin=con_fmin,
-            fmax=con_fmax,
-            faverage=True,
-            mt_adaptive=True,
-            n_jobs=n_jobs,
+            selections[trial],
+            con_methods,
+            all_epochs.info["sfreq"],
+            fmin,
+            fmax,
         )
+        for trial, (fmin, fmax) in jobs
+    )
 
-        if not isinstance(con, list):
-            con = [con]
-
-        # con is a 3D array, get the connectivity for the first
-        # (and only) freq. band for each con_method
-        for method, c in zip(con_methods, con):
-            con_dict[trial.split("/")[1]][method] = c.get_data(output="dense")[:, :, 0]
+    con_dict = {trial: dict() for trial in selections}
+    for method_idx, method in enumerate(con_methods):
+        for trial in selections:
+            band_cons = [
+                con[method_idx]
+                for (job_trial, _), con in zip(jobs, results)
+                if job_trial == trial
+            ]
+            # Several frequency-bands are stacked in the last dimension
+            if len(band_cons) == 1:
+                con_dict[trial][method] = band_cons[0]
+            else:
+                con_dict[trial][method] = np.stack(band_cons, axis=-1)
 
     meeg.save_connectivity(con_dict)
 
@@ -1565,13 +2099,23 @@ def grand_avg_morphed(group, morph_to):
         sub_trial_dict = {}
         ga_chunk = group.group_list[i : i + n_chunks]
         print(ga_chunk)
+        # The source-estimates, which still have to be morphed, by FSMRI
+        fsmri_stcs = {}
         for name in ga_chunk:
             meeg = MEEG(name, group.ct)
             print(f"Add {name} to grand_average")
             if morph_to == meeg.fsmri.name:
                 stcs = meeg.load_source_estimates()
             else:
-                stcs = meeg.load_morphed_source_estimates()
+                try:
+                    stcs = meeg.load_morphed_source_estimates()
+                except OSError:
+                    # Morphed together with the other runs of the same FSMRI
+                    if meeg.fsmri not in fsmri_stcs:
+                        fsmri_stcs[meeg.fsmri] = {}
+                    for trial, stc in meeg.load_source_estimates().items():
+                        fsmri_stcs[meeg.fsmri][(name, trial)] = stc
+                    continue
 
             for trial in stcs:
                 if trial in sub_trial_dict:
@@ -1579,6 +2123,15 @@ def grand_avg_morphed(group, morph_to):
                 else:
                     sub_trial_dict.update({trial: [stcs[trial]]})
 
+        # Morph with the source-morph shared by the FSMRI
+        for fsmri, stcs in fsmri_stcs.items():
+            morphed_stcs = _morph_stcs(fsmri.get_source_morph(), stcs)
+            for (_, trial), stc in morphed_stcs.items():
+                if trial in sub_trial_dict:
+                    sub_trial_dict[trial].append(stc)
+                else:
+                    sub_trial_dict.update({trial: [stc]})
+
         # Average chunks
         for trial in sub_trial_dict:
             if len(sub_trial_dict[trial]) != 0:
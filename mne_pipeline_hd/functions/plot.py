@@ -18,7 +18,7 @@ import mne_connectivity
 import numpy as np
 
 # Make use of program also possible with sensor-space installation of mne
-from mne_pipeline_hd.pipeline.loading import FSMRI
+from mne_pipeline_hd.pipeline.loading import get_fsmri
 from mne_pipeline_hd.pipeline.plot_utils import pipeline_plot
 
 try:
@@ -1071,7 +1071,7 @@ def plot_grand_avg_connect(
 
     # Get labels for FreeSurfer 'aparc' cortical parcellation
     # with 34 labels/hemi
-    fsmri = FSMRI(morph_to, group.ct)
+    fsmri = get_fsmri(morph_to, group.ct)
     labels = fsmri.get_labels(target_labels)
     if "unknown-lh" in labels:
         labels.remove("unknown-lh")
@@ -6,18 +6,28 @@ Github: https://github.com/marsipu/mne-pipeline-hd
 """
 
 import inspect
+import logging
 import os
 import shutil
 from ast import literal_eval
 from functools import partial
 from importlib import util
+from multiprocessing import Pipe
 from os import mkdir
 from os.path import isdir, isfile, join
 from pathlib import Path
 from types import FunctionType
 
 import pandas as pd
-from PyQt5.QtCore import QSize, Qt
+from PyQt5.QtCore import (
+    QObject,
+    QRunnable,
+    QSize,
+    Qt,
+    QThreadPool,
+    pyqtSignal,
+    pyqtSlot,
+)
 from PyQt5.QtGui import QFont
 from PyQt5.QtWidgets import (
     QButtonGroup,
@@ -41,6 +51,7 @@ from PyQt5.QtWidgets import (
     QGridLayout,
     QProgressBar,
     QCheckBox,
+    QAbstractItemView,
 )
 
 from mne_pipeline_hd.gui import parameter_widgets
@@ -51,27 +62,228 @@ from mne_pipeline_hd.gui.base_widgets import (
     EditList,
     SimpleDialog,
     SimpleList,
+    SimplePandasTable,
 )
 from mne_pipeline_hd.gui.gui_utils import (
     CodeEditor,
     ErrorDialog,
+    ExceptionTuple,
     center,
     get_exception_tuple,
     set_ratio_geometry,
     get_std_icon,
     MainConsoleWidget,
+    Worker,
 )
 from mne_pipeline_hd.gui.models import CustomFunctionModel, RunModel
-from mne_pipeline_hd.pipeline.function_utils import QRunController
-from mne_pipeline_hd.pipeline.pipeline_utils import QS
+from mne_pipeline_hd.pipeline import parallel
+from mne_pipeline_hd.pipeline.function_utils import (
+    RunController,
+    receive_stream,
+    run_func,
+    run_step_spec,
+)
+from mne_pipeline_hd.pipeline.parallel import get_error_result
+from mne_pipeline_hd.pipeline.pipeline_utils import QS, ismac, shutdown
+
+
+class StreamRcvSignals(QObject):
+    stdout_received = pyqtSignal(str)
+    stderr_received = pyqtSignal(str)
+    progress_received = pyqtSignal(str)
+
+
+class StreamReceiver(QRunnable):
+    def __init__(self, pipe):
+        super().__init__()
+        self.pipe = pipe
+        self.signals = StreamRcvSignals()
+
+    @pyqtSlot()
+    def run(self):
+        for kind, text in receive_stream(self.pipe):
+            if kind == "stdout":
+                self.signals.stdout_received.emit(text)
+            elif kind == "stderr":
+                self.signals.stderr_received.emit(text)
+            else:
+                self.signals.progress_received.emit(text)
+
+
+class RunSignals(QObject):
+    """Signals to send the results from the callback-thread of the pool
+    to the main-thread"""
+
+    step_finished = pyqtSignal(object, object)
+
+
+class QRunController(RunController):
+    def __init__(self, run_dialog, controller, pool=None, resume=False):
+        super().__init__(controller, pool=pool, resume=resume)
+        self.rd = run_dialog
+        self.errors = dict()
+        self.error_count = 0
+        self.is_prog_text = False
+
+        self.run_signals = RunSignals()
+        self.run_signals.step_finished.connect(self.process_step_result)
+
+    def mark_items(self, obj_name, func_name, status):
+        super().mark_items(obj_name, func_name, status)
+        obj_idx = list(self.all_objects.keys()).index(obj_name)
+        func_idx = list(self.all_objects[obj_name]["functions"].keys()).index(func_name)
+        # Notify Object-Model of change
+        self.rd.object_model.layoutChanged.emit()
+        # Scroll to current object
+        self.rd.object_view.scrollTo(
+            self.rd.object_model.createIndex(obj_idx, 0),
+            QAbstractItemView.PositionAtCenter,
+        )
+        # Notify Function-Model of change
+        self.rd.func_model.layoutChanged.emit()
+        # Scroll to current function
+        if self.current_obj_name == obj_name:
+            self.rd.func_view.scrollTo(
+                self.rd.func_model.createIndex(func_idx, 0),
+                QAbstractItemView.PositionAtCenter,
+            )
+
+    def get_object(self):
+        old_obj_name = getattr(self.current_object, "name", None)
+        super().get_object()
+        # Print Headline for object if new
+        if old_obj_name != self.current_obj_name:
+            self.rd.console_widget.write_html(
+                f"<br><h1>{self.current_obj_name}</h1><br>"
+            )
+        # Load functions for object into func_model
+        # (which displays functions in func_view)
+        self.current_all_funcs = self.all_objects[self.current_obj_name]["functions"]
+        self.rd.func_model._data = self.current_all_funcs
+        self.rd.func_model.layoutChanged.emit()
+
+        # Print Headline for function
+        self.rd.console_widget.write_html(f"<h2>{self.current_func}</h2><br>")
+
+    def skip_step(self, step):
+        self.rd.console_widget.write_html("<i>Skipped (up to date)</i><br>")
+        super().skip_step(step)
+
+    def process_finished(self, step, result):
+        with self.lock:
+            self.finish_step(step, result)
+        self.rd.pgbar.setValue(self.prog_count)
+        if isinstance(result, ExceptionTuple):
+            obj_name, func_name = step
+            error_cause = f"{self.error_count}: {obj_name} <- {func_name}"
+            self.errors[error_cause] = (result, self.error_count)
+            # Update Error-Widget
+            self.rd.error_widget.replace_data(list(self.errors.keys()))
+
+            # Insert Error-Number into console-widget as an anchor
+            # for later inspection
+            self.rd.console_widget.write_html(
+                f'<a name="{self.error_count}" href={self.error_count}>'
+                f"<i>Error No.{self.error_count}</i><br></a>"
+            )
+            # Increase Error-Count by one
+            self.error_count += 1
+
+        # Process
+        if self.paused:
+            if len(self.graph.running_steps()) == 0:
+                self.rd.console_widget.write_html("<b><big>Paused</big></b><br>")
+                # Enable/Disable Buttons
+                self.rd.continue_bt.setEnabled(True)
+                self.rd.pause_bt.setEnabled(False)
+                self.rd.restart_bt.setEnabled(True)
+                self.rd.close_bt.setEnabled(True)
+        else:
+            # Continue with next steps
+            self.start()
+
+    def finished(self):
+        self.journal.write("end")
+        self.rd.console_widget.write_html("<b><big>Finished</big></b><br>")
+        # Enable/Disable Buttons
+        self.rd.continue_bt.setEnabled(False)
+        self.rd.pause_bt.setEnabled(False)
+        self.rd.restart_bt.setEnabled(True)
+        self.rd.close_bt.setEnabled(True)
+
+        if self.ct.get_setting("shutdown"):
+            self.ct.save()
+            shutdown()
+
+    def run_step(self, step, kwds):
+        func_name = step[1]
+        # Plot functions with interactive plots currently can't
+        # run in a separate thread, so they
+        #  excuted in the main thread
+        ismayavi = self.ct.pd_funcs.loc[func_name, "mayavi"]
+        ismpl = self.ct.pd_funcs.loc[func_name, "matplotlib"]
+        show_plots = self.ct.get_setting("show_plots")
+        use_qthread = QS().value("use_qthread")
+        if (
+            ismayavi
+            or (ismpl and show_plots and use_qthread)
+            or (ismpl and not show_plots and use_qthread and ismac)
+        ):
+            logging.info("Starting in Main-Thread.")
+            result = run_func(**kwds)
+            self.process_finished(step, result)
+
+        elif use_qthread or self.pool is None:
+            logging.info("Starting in separate Thread.")
+            worker = Worker(function=run_func, **kwds)
+            worker.signals.error.connect(partial(self.process_finished, step))
+            worker.signals.finished.connect(partial(self.process_finished, step))
+            QThreadPool.globalInstance().start(worker)
+
+        else:
+            logging.info("Starting in process from multiprocessing.")
+            recv_pipe, send_pipe = Pipe(False)
+            stream_rcv = StreamReceiver(recv_pipe)
+            stream_rcv.signals.stdout_received.connect(
+                self.rd.console_widget.write_stdout
+            )
+            stream_rcv.signals.stderr_received.connect(
+                self.rd.console_widget.write_stderr
+            )
+            stream_rcv.signals.progress_received.connect(
+                self.rd.console_widget.write_progress
+            )
+            QThreadPool.globalInstance().start(stream_rcv)
+            self.pool.apply_async(
+                func=run_step_spec,
+                args=(self.get_step_spec(step, kwds), send_pipe),
+                callback=partial(self.emit_step_finished, step, send_pipe),
+                error_callback=lambda err: self.emit_step_finished(
+                    step, send_pipe, get_error_result(err)
+                ),
+            )
+
+    def emit_step_finished(self, step, send_pipe, step_result):
+        # Closing the pipe ends the StreamReceiver
+        send_pipe.close()
+        # Callbacks of the pool are called in a separate thread
+        self.run_signals.step_finished.emit(step, step_result)
+
+    def n_slots(self):
+        # QThreads share the memory of the main-process,
+        # thus only one step is run at a time
+        if QS().value("use_qthread"):
+            return 1
+
+        return super().n_slots()
 
 
 class RunDialog(QDialog):
-    def __init__(self, main_win):
+    def __init__(self, main_win, resume=False):
         super().__init__(main_win)
         self.mw = main_win
 
-        self.init_controller()
+        self.init_controller(resume=resume)
         self.init_ui()
 
         set_ratio_geometry(0.6, self)
@@ -79,8 +291,14 @@ class RunDialog(QDialog):
 
         self.start()
 
-    def init_controller(self):
-        self.rc = QRunController(run_dialog=self, controller=self.mw.ct)
+    def init_controller(self, resume=False):
+        if QS().value("use_qthread"):
+            pool = None
+        else:
+            pool = parallel.get_mp_pool(self.mw.ct)
+        self.rc = QRunController(
+            run_dialog=self, controller=self.mw.ct, pool=pool, resume=resume
+        )
 
     def init_ui(self):
         layout = QVBoxLayout()
@@ -114,8 +332,8 @@ class RunDialog(QDialog):
         layout.addWidget(self.console_widget)
 
         self.pgbar = QProgressBar()
-        self.pgbar.setValue(0)
         self.pgbar.setMaximum(len(self.rc.all_steps))
+        self.pgbar.setValue(self.rc.prog_count)
         layout.addWidget(self.pgbar)
 
         bt_layout = QHBoxLayout()
@@ -151,6 +369,11 @@ class RunDialog(QDialog):
         self.autoscroll_bt.clicked.connect(self.toggle_autoscroll)
         bt_layout.addWidget(self.autoscroll_bt)
 
+        runtimes_bt = QPushButton("Runtimes")
+        runtimes_bt.setIcon(get_std_icon("SP_FileDialogDetailedView"))
+        runtimes_bt.clicked.connect(self.show_runtimes)
+        bt_layout.addWidget(runtimes_bt)
+
         self.close_bt = QPushButton("Close")
         self.close_bt.setFont(QFont("AnyStyle", 14))
         self.close_bt.setIcon(get_std_icon("SP_MediaStop"))
@@ -176,13 +399,13 @@ class RunDialog(QDialog):
         self.console_widget.write_html("<br><b>Finishing last function...</b><br>")
 
     def restart(self):
+        # Restart the worker-processes to reload the modules
+        if self.reload_chbx and self.reload_chbx.isChecked():
+            parallel.init_mp_pool(controller=self.mw.ct)
+
         # Reinitialize controller
         self.init_controller()
 
-        # ToDo: MP
-        # if self.reload_chbx and self.reload_chbx.isChecked():
-        #     init_mp_pool()
-
         # Clear Console-Widget
         self.console_widget.clear()
 
@@ -205,6 +428,20 @@ class RunDialog(QDialog):
         else:
             self.console_widget.set_autoscroll(False)
 
+    def show_runtimes(self):
+        runtimes_table = SimplePandasTable(
+            self.rc.get_runtime_summary(), resize_columns=True
+        )
+        runtimes_dialog = SimpleDialog(
+            runtimes_table,
+            parent=self,
+            modal=False,
+            title="Runtimes of previous runs (in seconds) "
+            "and the predicted runtime of this run:",
+            window_title="Runtimes",
+        )
+        set_ratio_geometry(0.4, runtimes_dialog)
+
     def show_error(self, current, _):
         self.console_widget.set_autoscroll(False)
         self.autoscroll_bt.setChecked(False)
@@ -1641,8 +1878,9 @@ class SavePkgDialog(QDialog):
 
             self.cf_dialog.ct.import_custom_modules()
             self.cf_dialog.mw.redraw_func_and_param()
-            # ToDo: MP
-            # init_mp_pool()
+            # Restart the worker-processes to import the new module
+            if parallel.mp_pool is not None:
+                parallel.init_mp_pool(controller=self.cf_dialog.ct)
             self.close()
 
         else:
@@ -7,7 +7,6 @@ Github: https://github.com/marsipu/mne-pipeline-hd
 
 import io
 import logging
-import multiprocessing
 import sys
 import traceback
 from contextlib import contextmanager
@@ -40,7 +39,11 @@ from PyQt5.QtWidgets import (
 )
 
 from mne_pipeline_hd import _object_refs
-from mne_pipeline_hd.pipeline.pipeline_utils import QS
+from mne_pipeline_hd.pipeline.pipeline_utils import (  # noqa: F401
+    ExceptionTuple,
+    QS,
+    get_exception_tuple,
+)
 
 
 def center(widget):
@@ -67,35 +70,6 @@ def get_std_icon(icon_name):
     return QApplication.instance().style().standardIcon(getattr(QStyle, icon_name))
 
 
-class ExceptionTuple(object):
-    def __init__(self, *args):
-        self._data = [*args]
-
-    def __getitem__(self, idx):
-        return self._data[idx]
-
-    def __setitem__(self, idx, value):
-        self._data[idx] = value
-
-    def __str__(self):
-        return self._data[2]
-
-
-def get_exception_tuple(is_mp=False):
-    traceback.print_exc()
-    exctype, value = sys.exc_info()[:2]
-    traceback_str = traceback.format_exc(limit=-10)
-    # ToDo: Is this doing what it's supposed to do?
-    if is_mp:
-        logger = multiprocessing.get_logger()
-    else:
-        logger = logging.getLogger()
-    logger.error(f"{exctype}: {value}")
-    exc_tuple = ExceptionTuple(exctype, value, traceback_str)
-
-    return exc_tuple
-
-
 class ErrorDialog(QDialog):
     def __init__(self, exception_tuple, parent=None, title=None):
         if parent:
@@ -294,7 +268,11 @@ class ConsoleWidget(QTextEdit):
         self.buffer.append((text, "stderr"))
 
     def write_progress(self, text):
-        self.buffer.append((text, "progress"))
+        # Replace a progress, which was not written yet
+        if len(self.buffer) > 0 and self.buffer[-1][1] == "progress":
+            self.buffer[-1] = (text, "progress")
+        else:
+            self.buffer.append((text, "progress"))
 
     # Make sure cursor is not moved
     def mousePressEvent(self, event):
@@ -79,6 +79,7 @@ from mne_pipeline_hd.gui.parameter_widgets import (
 from mne_pipeline_hd.gui.plot_widgets import PlotViewSelection
 from mne_pipeline_hd.gui.tools import DataTerminal
 from mne_pipeline_hd.pipeline.controller import Controller
+from mne_pipeline_hd.pipeline.journal import get_resumable_journal
 from mne_pipeline_hd.pipeline.pipeline_utils import (
     restart_program,
     ismac,
@@ -99,9 +100,6 @@ class MainWindow(QMainWindow):
         _object_refs["main_window"] = self
         self.setWindowTitle("MNE-Pipeline HD")
 
-        # Set QThread as default (ToDo: MP)
-        QS().setValue("use_qthread", True)
-
         # Initiate attributes for Main-Window
         self.ct = controller
         self.pr = controller.pr
@@ -397,25 +395,57 @@ class MainWindow(QMainWindow):
                 groupbox_layout=False,
             )
         )
-        # self.toolbar.addWidget(
-        #     IntGui(data=QS(), name='n_parallel', min_val=1,
-        #            description='Set to the amount of threads you want '
-        #                        'to run simultaneously in the pipeline',
-        #            default=1, groupbox_layout=False))
-        # self.toolbar.addWidget(
-        #     BoolGui(data=QS(), name='use_qthread', alias='Use QThreads',
-        #             description='Check to use QThreads for running '
-        #                         'the pipeline.\n'
-        #                         'This is faster than the default'
-        #                         ' with separate processes, '
-        #                         'but has a few limitations',
-        #             default=0, return_integer=True))
-        # self.toolbar.addWidget(BoolGui(data=self.ct.settings, name='overwrite',
-        #                                alias='Overwrite',
-        #                                description='Check to overwrite files'
-        #                                            ' even if their parameters '
-        #                                            'where unchanged.',
-        #                                groupbox_layout=False))
+        self.toolbar.addWidget(
+            IntGui(
+                data=QS(),
+                name="n_parallel",
+                min_val=1,
+                description="Set to the amount of processes you want "
+                "to run simultaneously in the pipeline "
+                "(only without QThreads).",
+                default=1,
+                groupbox_layout=False,
+            )
+        )
+        self.toolbar.addWidget(
+            IntGui(
+                data=QS(),
+                name="ram_budget",
+                alias="RAM-Budget",
+                min_val=0,
+                param_unit="GB",
+                description="Set the memory (in GB) available for the "
+                "processes running simultaneously "
+                "(0 for 80% of the available memory).",
+                default=0,
+                groupbox_layout=False,
+            )
+        )
+        self.toolbar.addWidget(
+            BoolGui(
+                data=QS(),
+                name="use_qthread",
+                alias="Use QThreads",
+                description="Check to use QThreads for running "
+                "the pipeline.\n"
+                "Uncheck to run the pipeline in separate processes, "
+                "which allows to process multiple files simultaneously.",
+                default=1,
+                return_integer=True,
+                groupbox_layout=False,
+            )
+        )
+        self.toolbar.addWidget(
+            BoolGui(
+                data=self.ct.settings,
+                name="overwrite",
+                alias="Overwrite",
+                description="Check to overwrite files"
+                " even if their parameters and inputs "
+                "where unchanged.",
+                groupbox_layout=False,
+            )
+        )
         self.toolbar.addWidget(
             BoolGui(
                 data=self.ct.settings,
@@ -665,6 +695,20 @@ class MainWindow(QMainWindow):
                 self, "Already running!", "The Pipeline is already running!"
             )
         else:
+            # Offer to resume the last run if it was interrupted
+            resume = False
+            journal = get_resumable_journal(self.ct.pr)
+            if journal is not None:
+                n_completed = len(journal.steps) - len(journal.remaining_steps())
+                answer = QMessageBox.question(
+                    self,
+                    "Resume run?",
+                    f"The last run was interrupted after {n_completed} "
+                    f"of {len(journal.steps)} steps.\n"
+                    f"Do you want to resume it (otherwise a new run "
+                    f"with the current selection is started)?",
+                )
+                resume = answer == QMessageBox.Yes
             WorkerDialog(
                 self,
                 self.ct.save,
@@ -672,7 +716,7 @@ class MainWindow(QMainWindow):
                 show_console=False,
                 blocking=True,
             )
-            self.run_dialog = RunDialog(self)
+            self.run_dialog = RunDialog(self, resume=resume)
 
     def restart(self):
         self.restarting = True
@@ -56,7 +56,7 @@ from mne_pipeline_hd.gui.gui_utils import (
     center,
 )
 from mne_pipeline_hd.pipeline.controller import Controller
-from mne_pipeline_hd.pipeline.loading import FSMRI
+from mne_pipeline_hd.pipeline.loading import clear_fsmri_registry, get_fsmri
 from mne_pipeline_hd.pipeline.pipeline_utils import QS, iswin
 
 
@@ -260,6 +260,7 @@ class Param(QWidget):
             self.data[name] = value
         elif isinstance(self.data, Controller):
             self.data.pr.parameters[self.data.pr.p_preset][name] = value
+            clear_fsmri_registry()
         elif isinstance(self.data, QS):
             self.data.setValue(name, value)
 
@@ -1368,7 +1369,9 @@ class LabelDialog(SimpleDialog):
         self._parc_changed()
 
     def _subject_changed(self):
-        self._fsmri = FSMRI(self.fsmri_cmbx.currentText(), self.ct, load_labels=True)
+        self._fsmri = get_fsmri(
+            self.fsmri_cmbx.currentText(), self.ct, load_labels=True
+        )
 
         self.parcellation_cmbx.clear()
         self.parcellation_cmbx.addItems(self._fsmri.parcellations)
@@ -1717,6 +1720,7 @@ class RemovePPresetDlg(CheckListDlg):
         # If current Parameter-Preset was deleted
         if self.parent.ct.pr.p_preset not in self.parent.ct.pr.parameters:
             self.parent.ct.pr.p_preset = list(self.parent.ct.pr.parameters.keys())[0]
+            clear_fsmri_registry()
             self.parent.update_all_param_guis()
 
         self.close()
@@ -1889,6 +1893,7 @@ class ParametersDock(QDockWidget):
 
     def p_preset_changed(self, idx):
         self.ct.pr.p_preset = self.p_preset_cmbx.itemText(idx)
+        clear_fsmri_registry()
         self.update_all_param_guis()
 
     def add_p_preset(self):
@@ -1898,6 +1903,7 @@ class ParametersDock(QDockWidget):
         if preset_name is not None:
             self.ct.pr.p_preset = preset_name
             self.ct.pr.load_default_parameters()
+            clear_fsmri_registry()
             self.p_preset_cmbx.addItem(preset_name)
             self.p_preset_cmbx.setCurrentText(preset_name)
 
@@ -1996,17 +2002,66 @@ class SettingsDlg(QDialog):
                     "return_integer": True,
                 },
             },
-            "save_ram": {
-                "gui_type": "BoolGui",
+            "data_cache_size": {
+                "gui_type": "FloatGui",
                 "data_type": "QSettings",
                 "gui_kwargs": {
-                    "alias": "Save RAM",
-                    "description": "Set to True on low RAM-Machines to avoid"
-                    " the process to be killed by the OS due "
-                    "to low Memory (with leaving it off, "
-                    "the pipeline goes a bit faster, because "
-                    "the data can be saved in memory).",
-                    "return_integer": True,
+                    "alias": "Data-Cache",
+                    "description": "Set the memory (in GB) for keeping loaded "
+                    "data in memory for the next functions (set to 0 on "
+                    "low RAM-Machines to avoid the process to be killed by "
+                    "the OS due to low Memory).",
+                    "min_val": 0,
+                    "max_val": 1000,
+                    "param_unit": "GB",
+                },
+            },
+            "raw_load_policy": {
+                "gui_type": "ComboGui",
+                "data_type": "QSettings",
+                "gui_kwargs": {
+                    "alias": "Raw-Loading",
+                    "description": "Choose how raw-data is loaded: into memory "
+                    "(ram), into a memory-mapped file in the Scratch-Path "
+                    "(memmap, for recordings larger than the memory) "
+                    "or read from disk when needed (lazy).",
+                    "options": ["ram", "memmap", "lazy"],
+                },
+            },
+            "scratch_path": {
+                "gui_type": "StringGui",
+                "data_type": "QSettings",
+                "gui_kwargs": {
+                    "alias": "Scratch-Path",
+                    "description": "Set the directory for memory-mapped "
+                    "raw-data (a fast disk with enough space, defaults to "
+                    "the temporary directory).",
+                    "none_select": True,
+                },
+            },
+            "worker_max_tasks": {
+                "gui_type": "IntGui",
+                "data_type": "QSettings",
+                "gui_kwargs": {
+                    "alias": "Tasks per Process",
+                    "description": "Set the number of steps after which a "
+                    "process for parallel steps is replaced by a new one "
+                    "(0 to keep the processes).",
+                    "min_val": 0,
+                    "max_val": 10000,
+                },
+            },
+            "worker_max_memory": {
+                "gui_type": "FloatGui",
+                "data_type": "QSettings",
+                "gui_kwargs": {
+                    "alias": "Memory-Growth per Process",
+                    "description": "Set the growth of memory (in GB) after "
+                    "which a process for parallel steps is replaced by a new "
+                    "one (0 to keep the processes).",
+                    "min_val": 0,
+                    "max_val": 1000,
+                    "param_unit": "GB",
                 },
             },
             "fs_path": {
@@ -21,8 +21,8 @@ import mne
 import pandas as pd
 
 from mne_pipeline_hd import functions, extra
-from mne_pipeline_hd.gui.gui_utils import get_user_input_string
 from mne_pipeline_hd.pipeline.legacy import transfer_file_params_to_single_subject
+from mne_pipeline_hd.pipeline.loading import clear_fsmri_registry
 from mne_pipeline_hd.pipeline.pipeline_utils import QS
 from mne_pipeline_hd.pipeline.project import Project
 
@@ -184,6 +184,8 @@ class Controller:
 
     def change_project(self, new_project):
         self.pr = Project(self, new_project)
+        # The shared FSMRI-objects refer to the previous project
+        clear_fsmri_registry()
         self.settings["selected_project"] = new_project
         if new_project not in self.projects:
             self.projects.append(new_project)
@@ -199,6 +201,9 @@ class Controller:
             if len(self.projects) > 0:
                 new_project = self.projects[0]
             else:
+                # Imported here to keep the Controller independent from PyQt5
+                from mne_pipeline_hd.gui.gui_utils import get_user_input_string
+
                 new_project = get_user_input_string(
                     "Please enter the name of a new project!", "Add Project", force=True
                 )
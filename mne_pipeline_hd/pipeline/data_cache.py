@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Authors: Martin Schulz <dev@mgschulz.de>
+License: BSD 3-Clause
+Github: https://github.com/marsipu/mne-pipeline-hd
+"""
+
+import logging
+import sys
+import threading
+from collections import OrderedDict
+from copy import deepcopy
+
+import numpy as np
+from scipy import sparse
+
+from mne_pipeline_hd.pipeline.pipeline_utils import QS
+
+
+def get_nbytes(data, _depth=0, _seen=None):
+    """Estimate the memory (in bytes) of data by the size of its arrays.
+
+    Parameters
+    ----------
+    data : object
+        The data, e.g. an MNE-object or a list/dict of MNE-objects.
+
+    Returns
+    -------
+    nbytes : int
+        The estimated size in bytes.
+    """
+    if _seen is None:
+        _seen = set()
+    if id(data) in _seen:
+        return 0
+    _seen.add(id(data))
+
+    if isinstance(data, np.ndarray):
+        # Views share the memory of their base
+        return data.nbytes if data.base is None else 0
+    if sparse.issparse(data):
+        array_names = ["data", "indices", "indptr", "row", "col", "offsets"]
+        return sum(
+            [getattr(data, name).nbytes for name in array_names if hasattr(data, name)]
+        )
+    # Limit the recursion, the arrays of MNE-objects are on the first levels
+    if _depth > 4:
+        return sys.getsizeof(data)
+    if isinstance(data, dict):
+        values = data.values()
+    elif isinstance(data, (list, tuple, set)):
+        values = data
+    elif hasattr(data, "__dict__"):
+        values = vars(data).values()
+    else:
+        return sys.getsizeof(data)
+
+    return sys.getsizeof(data) + sum([get_nbytes(v, _depth + 1, _seen) for v in values])
+
+
+def is_in_memory(data):
+    """Check if data is completely in memory (False e.g. for raw-data,
+    which is not preloaded or memory-mapped)."""
+    if isinstance(data, (list, tuple)):
+        return all([is_in_memory(d) for d in data])
+    if isinstance(data, dict):
+        return all([is_in_memory(d) for d in data.values()])
+    if getattr(data, "preload", True) is False:
+        return False
+
+    return not isinstance(getattr(data, "_data", None), np.memmap)
+
+
+def copy_data(data):
+    """Copy data, so that changes don't affect the cached version."""
+    if type(data) in [list, tuple]:
+        return type(data)([copy_data(d) for d in data])
+    if type(data) is dict:
+        return {key: copy_data(value) for key, value in data.items()}
+    # Subclasses of list/dict (e.g. SourceSpaces or ConductorModel)
+    # would lose their attributes with copy()
+    if hasattr(data, "copy") and not isinstance(data, (list, dict)):
+        return data.copy()
+
+    return deepcopy(data)
+
+
+class DataCache:
+    """A cache for loaded data with a limit for its memory, which removes
+    the least recently used data first.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The maximum size of the cached data in bytes (0 disables the cache).
+
+    Notes
+    -----
+    The data is copied when it is taken from the cache, so changes made
+    in place by a function (e.g. raw.filter()) don't affect the cached data.
+    Data, which is still used elsewhere, is copied when it is put into the
+    cache too, while saved data is handed over to the cache without a copy.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self.lock = threading.Lock()
+        # The keys with (data, nbytes) in the order of their usage
+        self.entries = OrderedDict()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, copy=True):
+        """Get the data cached for key (None if not cached).
+
+        Parameters
+        ----------
+        key : tuple
+            The key of the data.
+        copy : bool
+            If a copy of the data is returned (False for data,
+            which is never changed in place).
+
+        Returns
+        -------
+        data : object | None
+            The cached data.
+        """
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            data = self.entries[key][0]
+
+        return copy_data(data) if copy else data
+
+    def put(self, key, data, copy=True):
+        """Put data into the cache.
+
+        Parameters
+        ----------
+        key : tuple
+            The key of the data.
+        data : object
+            The data to cache.
+        copy : bool
+            If the data has to be copied, because it is still used elsewhere
+            (False hands the data over to the cache, it must not be changed
+            afterwards).
+        """
+        # Copying data from disk would load it into memory
+        if not is_in_memory(data):
+            self.remove(key)
+            return
+        nbytes = get_nbytes(data)
+        # Data larger than the limit would remove everything else
+        if nbytes > self.max_bytes:
+            self.remove(key)
+            return
+        with self.lock:
+            if key in self.entries:
+                self.n_bytes -= self.entries.pop(key)[1]
+            # Make room before copying to stay within the limit
+            self._evict(self.max_bytes - nbytes)
+        if copy:
+            data = copy_data(data)
+        with self.lock:
+            if key in self.entries:
+                self.n_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (data, nbytes)
+            self.n_bytes += nbytes
+            self._evict(self.max_bytes)
+
+    def remove(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.n_bytes -= self.entries.pop(key)[1]
+
+    def _evict(self, max_bytes):
+        while self.n_bytes > max_bytes and len(self.entries) > 0:
+            key, (_, nbytes) = self.entries.popitem(last=False)
+            self.n_bytes -= nbytes
+            logging.debug(f"Removed {key[0]} from the data-cache")
+
+    def set_max_bytes(self, max_bytes):
+        with self.lock:
+            self.max_bytes = int(max_bytes)
+            self._evict(self.max_bytes)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.n_bytes = 0
+
+
+_data_cache = None
+
+
+def get_data_cache():
+    """Get the data-cache of this process with the size from the settings
+    (data_cache_size in GB)."""
+    global _data_cache
+    max_bytes = float(QS().value("data_cache_size", defaultValue=0) or 0) * 1024**3
+    if _data_cache is None:
+        _data_cache = DataCache(max_bytes)
+    elif _data_cache.max_bytes != int(max_bytes):
+        _data_cache.set_max_bytes(max_bytes)
+
+    return _data_cache
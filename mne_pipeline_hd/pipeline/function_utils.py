@@ -8,17 +8,55 @@ Github: https://github.com/marsipu/mne-pipeline-hd
 import inspect
 import io
 import logging
+import pickle
 import sys
+import threading
+import time
 from collections import OrderedDict
+from functools import partial
 from importlib import import_module
-from multiprocessing import Pipe
-
-from PyQt5.QtCore import QThreadPool, QRunnable, pyqtSlot, QObject, pyqtSignal
-from PyQt5.QtWidgets import QAbstractItemView
-
-from mne_pipeline_hd.gui.gui_utils import get_exception_tuple, ExceptionTuple, Worker
-from mne_pipeline_hd.pipeline.loading import BaseLoading, FSMRI, Group, MEEG
-from mne_pipeline_hd.pipeline.pipeline_utils import shutdown, ismac, QS
+from os.path import join
+
+from tqdm import tqdm
+
+from mne_pipeline_hd.pipeline.journal import get_resumable_journal, new_journal
+from mne_pipeline_hd.pipeline.loading import (
+    BaseLoading,
+    FSMRI,
+    Group,
+    MEEG,
+    clear_fsmri_registry,
+    get_fsmri,
+    record_inputs,
+)
+from mne_pipeline_hd.pipeline.parallel import (
+    StepSpec,
+    StepResult,
+    apply_project_changes,
+    get_error_result,
+    get_project_changes,
+    get_project_state,
+)
+from mne_pipeline_hd.pipeline.pipeline_utils import (
+    ExceptionTuple,
+    QS,
+    check_up_to_date,
+    get_exception_tuple,
+)
+from mne_pipeline_hd.pipeline.resources import (
+    CPUBudget,
+    MemoryBudget,
+    get_current_memory,
+    get_peak_memory,
+    limit_threads,
+    reset_peak_memory,
+)
+from mne_pipeline_hd.pipeline.runtime_history import (
+    MemoryHistory,
+    RuntimeHistory,
+    get_object_size,
+)
+from mne_pipeline_hd.pipeline.scheduling import build_step_graph
 
 
 def get_func(func_name, obj):
@@ -31,6 +69,22 @@ def get_func(func_name, obj):
     return func
 
 
+def set_data_objects(arguments, obj):
+    """Set the data-objects in the arguments of a function
+    (CAVE: arguments are changed in place)"""
+    for obj_name, data_obj in [
+        ("ct", obj.ct),
+        ("controller", obj.ct),
+        ("pr", obj.pr),
+        ("project", obj.pr),
+        ("meeg", obj),
+        ("fsmri", obj),
+        ("group", obj),
+    ]:
+        if obj_name in arguments:
+            arguments[obj_name] = data_obj
+
+
 def get_arguments(func, obj):
     # Get arguments from function signature
     arguments = {
@@ -43,17 +97,7 @@ def get_arguments(func, obj):
         arguments.pop(pop_item, None)
 
     # Set data-objects
-    for obj_name, obj in [
-        ("ct", obj.ct),
-        ("controller", obj.ct),
-        ("pr", obj.pr),
-        ("project", obj.pr),
-        ("meeg", obj),
-        ("fsmri", obj),
-        ("group", obj),
-    ]:
-        if obj_name in arguments:
-            arguments[obj_name] = obj
+    set_data_objects(arguments, obj)
 
     # Get the values for parameter-names
     for arg_name in arguments:
@@ -73,14 +117,82 @@ def get_arguments(func, obj):
 
 
 class StreamManager:
-    def __init__(self, pipe):
-        self.pipe_busy = False
-        self.stdout_sender = StreamSender(self, "stdout", pipe)
-        self.stderr_sender = StreamSender(self, "stderr", pipe)
+    """Collects the output of stdout/stderr in a worker-process and sends
+    it in batches of records (kind, text) through a pipe.
+
+    Parameters
+    ----------
+    pipe : multiprocessing.connection.Connection
+        The sending end of a pipe to the main-process.
+    max_size : int
+        The number of characters after which the buffer is sent.
+    max_delay : float
+        The time (in seconds) after which the buffer is sent.
+
+    Notes
+    -----
+    Consecutive progress-updates (text starting with "\\r") are collapsed
+    to the latest one and consecutive text of the same kind is joined.
+    """
+
+    def __init__(self, pipe, max_size=8192, max_delay=0.1):
+        self.pipe = pipe
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.records = list()
+        self.size = 0
+        self.stdout_sender = StreamSender(self, "stdout")
+        self.stderr_sender = StreamSender(self, "stderr")
+        # Send the buffer regularly, even if nothing new is written
+        self.stop_event = threading.Event()
+        self.flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flush_thread.start()
+
+    def add(self, text, kind):
+        if text[:1] == "\r":
+            kind = "progress"
+        with self.lock:
+            last_kind = self.records[-1][0] if len(self.records) > 0 else None
+            if kind == "progress" and last_kind == "progress":
+                # Only the latest progress is shown anyway
+                self.size -= len(self.records[-1][1])
+                self.records[-1][1] = text
+            elif kind == last_kind:
+                self.records[-1][1] += text
+            else:
+                self.records.append([kind, text])
+            self.size += len(text)
+            if self.size >= self.max_size:
+                self._send()
+
+    def _send(self):
+        if len(self.records) > 0:
+            try:
+                self.pipe.send([tuple(r) for r in self.records])
+            except (OSError, ValueError):
+                # The receiving end was closed
+                pass
+            self.records = list()
+            self.size = 0
+
+    def flush(self):
+        with self.lock:
+            self._send()
+
+    def _flush_loop(self):
+        while not self.stop_event.wait(self.max_delay):
+            self.flush()
+
+    def close(self):
+        """Send the remaining output and stop the flush-thread."""
+        self.stop_event.set()
+        self.flush_thread.join()
+        self.flush()
 
 
 class StreamSender(io.TextIOBase):
-    def __init__(self, manager, kind, pipe):
+    def __init__(self, manager, kind):
         super().__init__()
         self.manager = manager
         self.kind = kind
@@ -88,77 +200,176 @@ class StreamSender(io.TextIOBase):
             self.original_stream = sys.__stdout__
         else:
             self.original_stream = sys.__stderr__
-        self.pipe = pipe
 
     def write(self, text):
         # Still send output to the command-line
         self.original_stream.write(text)
-        # Wait until pipe is free
-        while self.manager.pipe_busy:
-            pass
-        self.manager.pipe_busy = True
-        if text[:1] == "\r":
-            kind = "progress"
-        else:
-            kind = self.kind
-        self.pipe.send((text, kind))
-        self.manager.pipe_busy = False
+        self.manager.add(text, self.kind)
 
+        return len(text)
 
-class StreamRcvSignals(QObject):
-    stdout_received = pyqtSignal(str)
-    stderr_received = pyqtSignal(str)
-    progress_received = pyqtSignal(str)
+    def flush(self):
+        self.original_stream.flush()
 
 
-class StreamReceiver(QRunnable):
-    def __init__(self, pipe):
-        super().__init__()
-        self.pipe = pipe
-        self.signals = StreamRcvSignals()
+def receive_stream(pipe):
+    """Receive the output sent by a StreamManager until the pipe is closed.
 
-    @pyqtSlot()
-    def run(self):
-        while True:
-            try:
-                text, kind = self.pipe.recv()
-            except EOFError:
-                break
-            else:
-                if kind == "stdout":
-                    self.signals.stdout_received.emit(text)
-                elif kind == "stderr":
-                    self.signals.stderr_received.emit(text)
-                else:
-                    self.signals.progress_received.emit(text)
+    Parameters
+    ----------
+    pipe : multiprocessing.connection.Connection
+        The receiving end of the pipe.
+
+    Yields
+    ------
+    kind : str
+        The kind of output (stdout, stderr or progress).
+    text : str
+        The text of the output.
+    """
+    while True:
+        try:
+            records = pipe.recv()
+        except (EOFError, OSError):
+            break
+        yield from records
 
 
-def run_func(func, keywargs, pipe=None):
+def run_func(func, keywargs, pipe=None, n_threads=None):
     if pipe is not None:
         stream_manager = StreamManager(pipe)
         sys.stdout = stream_manager.stdout_sender
         sys.stderr = stream_manager.stderr_sender
     try:
-        return func(**keywargs)
+        # Limit the threads of BLAS/OpenMP to the share of this step
+        # and record the loaded files for the up-to-date-check
+        with limit_threads(n_threads), record_inputs():
+            return func(**keywargs)
     except Exception:
         return get_exception_tuple(is_mp=pipe is not None)
+    finally:
+        if pipe is not None:
+            stream_manager.close()
+            # The worker-process is reused for the next steps
+            sys.stdout = sys.__stdout__
+            sys.stderr = sys.__stderr__
+
+
+def _ensure_picklable(result):
+    try:
+        pickle.dumps(result)
+    except Exception:
+        if isinstance(result, ExceptionTuple):
+            result[1] = str(result[1])
+        else:
+            logging.warning(
+                f"The return-value of type {type(result)} "
+                f"can't be transferred from the worker-process."
+            )
+            result = None
+
+    return result
+
+
+def run_step_spec(spec, pipe=None):
+    """Run a step from a StepSpec in a worker-process.
+
+    Parameters
+    ----------
+    spec : StepSpec
+        The specification of the step.
+    pipe : multiprocessing.connection.Connection | None
+        A pipe to send stdout/stderr to the main-process.
+
+    Returns
+    -------
+    step_result : StepResult
+        The result of the function and the changes to the project.
+    """
+    # Make custom-packages importable in the worker-process
+    for pkg_name in [p for p in spec.ct.all_modules if p != "basic"]:
+        pkg_path = join(spec.ct.custom_pkg_path, pkg_name)
+        if pkg_path not in sys.path:
+            sys.path.insert(0, pkg_path)
+    before = get_project_state(spec.ct.pr)
+    peak_memory = None
+    try:
+        obj = spec.load_object()
+        func = get_func(spec.func_name, obj)
+        keywargs = spec.keywargs.copy()
+        set_data_objects(keywargs, obj)
+    except Exception:
+        result = get_exception_tuple(is_mp=True)
+    else:
+        memory_before = get_current_memory()
+        is_reset = reset_peak_memory()
+        result = run_func(func, keywargs, pipe, spec.n_threads)
+        if is_reset:
+            peak_memory = max(get_peak_memory() - memory_before, 0)
+    project_changes = get_project_changes(before, spec.ct.pr)
+
+    return StepResult(_ensure_picklable(result), project_changes, peak_memory)
 
 
 class RunController:
-    def __init__(self, controller):
+    def __init__(
+        self, controller, pool=None, n_jobs=None, resume=False, ram_budget=None
+    ):
         self.ct = controller
+        # The shared FSMRI-objects are rebuilt from the current settings
+        clear_fsmri_registry()
+        # A multiprocessing-pool to run steps concurrently (None for serial)
+        self.pool = pool
+        # The total number of cores to use (None for the QSetting n_jobs)
+        self.n_jobs = n_jobs
 
         self.all_steps = list()
-        self.thread_idx_count = 0
         self.all_objects = OrderedDict()
         self.current_all_funcs = dict()
         self.current_obj_name = None
         self.current_object = None
-        self.loaded_fsmri = None
         self.current_func = None
         self.prog_count = 0
-
-        self.init_lists()
+        self.paused = False
+        self.graph = None
+        self.errors = dict()
+        # Steps skipped, because their outputs were up to date
+        self.skipped = list()
+        # The start-times of the running steps to measure their runtime
+        self.start_times = dict()
+        # The size of the inputs of steps to estimate their memory
+        self.input_sizes = dict()
+        # Progress-Bar for the command-line (initialized with init_pgbar)
+        self.pgbar = None
+        self.finished_event = threading.Event()
+
+        # Lock for the scheduling-state, because callbacks
+        # of the pool may arrive from other threads
+        self.lock = threading.RLock()
+        self._dispatching = False
+        self._is_finished = False
+
+        # Resume the last run if it was interrupted
+        if resume:
+            self.journal = get_resumable_journal(self.ct.pr)
+            if self.journal is None:
+                raise RuntimeError("There is no interrupted run to resume!")
+            self.ct.pr.p_preset = self.journal.p_preset
+            self.init_lists_from_journal()
+        else:
+            self.journal = None
+            self.init_lists()
+        self.init_graph()
+        self.init_priorities()
+        if self.journal is None:
+            self.journal = new_journal(self.ct.pr, self.all_steps, self.all_objects)
+        else:
+            self.mark_completed()
+        # Split the cores among the steps running at the same time
+        self.cpu_budget = CPUBudget(self.n_slots(), n_jobs=self.n_jobs)
+        # Only start steps at the same time, which fit into the memory
+        self.memory_budget = MemoryBudget(ram_budget)
+        self.memory_history = MemoryHistory(self.ct.pr)
 
     def init_lists(self):
         # Lists dividing the
@@ -225,223 +436,336 @@ class RunController:
             for other_func in self.sel_other_funcs:
                 self.all_steps.append(("", other_func))
 
-    def mark_current_items(self, status):
-        # Mark current object with status
-        self.all_objects[self.current_object.name]["status"] = status
-        # Mark current function with status
-        self.all_objects[self.current_object.name]["functions"][
-            self.current_func
-        ] = status
-
-    def get_object(self):
-        self.current_type = self.all_objects[self.current_obj_name]["type"]
+    def init_lists_from_journal(self):
+        """Restore the steps of the run from the journal."""
+        for obj_name, func_name in self.journal.steps:
+            if obj_name not in self.all_objects:
+                self.all_objects[obj_name] = {
+                    "type": self.journal.obj_types[obj_name],
+                    "functions": dict(),
+                    "status": 1,
+                }
+            self.all_objects[obj_name]["functions"][func_name] = 1
+            self.all_steps.append((obj_name, func_name))
+
+    def init_priorities(self):
+        """Start the steps with the longest predicted chain
+        of dependent steps first (from the runtimes of previous runs)."""
+        self.runtime_history = RuntimeHistory(self.ct.pr)
+        self.default_runtime = self.runtime_history.default_runtime()
+        self.obj_sizes = {
+            obj_name: get_object_size(self.ct.pr, obj_name, obj_info["type"])
+            for obj_name, obj_info in self.all_objects.items()
+        }
+        self.graph.set_critical_path_priorities(
+            {step: self.predict_runtime(step) for step in self.all_steps}
+        )
 
-        # Load object if the preceding object is not the same
-        if not self.current_object or self.current_object.name != self.current_obj_name:
-            if self.current_type == "FSMRI":
-                self.current_object = FSMRI(self.current_obj_name, self.ct)
-                self.loaded_fsmri = self.current_object
-
-            elif self.current_type == "MEEG":
-                # Avoid reloading of same MRI-Subject for multiple files
-                # (with the same MRI-Subject)
-                if (
-                    self.current_obj_name in self.ct.pr.meeg_to_fsmri
-                    and self.loaded_fsmri
-                    and self.loaded_fsmri.name
-                    == self.ct.pr.meeg_to_fsmri[self.current_obj_name]
-                ):
-                    self.current_object = MEEG(
-                        self.current_obj_name, self.ct, fsmri=self.loaded_fsmri
-                    )
+    def predict_runtime(self, step):
+        obj_name, func_name = step
+        runtime = self.runtime_history.predict(func_name, self.obj_sizes[obj_name])
+        if runtime is None:
+            runtime = self.default_runtime
+
+        return runtime
+
+    def record_runtime(self, step, result):
+        start_time = self.start_times.pop(step, None)
+        if start_time is None or isinstance(result, ExceptionTuple):
+            return
+        obj_name, func_name = step
+        self.runtime_history.add(
+            func_name, self.obj_sizes[obj_name], time.perf_counter() - start_time
+        )
+        self.runtime_history.save()
+
+    def get_runtime_summary(self):
+        """Get the runtime-history of the functions
+        with the predicted runtime for the current run."""
+        summary = self.runtime_history.get_summary()
+        predicted = dict()
+        for step in self.all_steps:
+            predicted[step[1]] = predicted.get(step[1], 0) + self.predict_runtime(step)
+        for func_name, runtime in predicted.items():
+            summary.loc[func_name, "this run [s]"] = round(runtime, 2)
+
+        return summary
+
+    def get_input_size(self, step):
+        """Get the size (in bytes) of the data loaded by a step."""
+        if step in self.input_sizes:
+            return self.input_sizes[step]
+        obj_name, func_name = step
+        func_io = self.graph.func_ios.get(func_name)
+        obj_type = self.all_objects[obj_name]["type"]
+        size = 0
+        if func_io is not None and obj_type != "Other":
+            try:
+                if self.current_object and self.current_object.name == obj_name:
+                    obj = self.current_object
                 else:
-                    self.current_object = MEEG(self.current_obj_name, self.ct)
-                self.loaded_fsmri = self.current_object.fsmri
-
-            elif self.current_type == "Group":
-                self.current_object = Group(self.current_obj_name, self.ct)
-
-            elif self.current_type == "Other":
-                self.current_object = BaseLoading(self.current_obj_name, self.ct)
-
-    def process_finished(self, result):
-        # ToDo: tqdm-progressbar for headless-mode
-        self.prog_count += 1
-        self.start()
+                    obj = self.load_object(obj_name, obj_type)
+                role_objects = {"self": [obj], "fsmri": [getattr(obj, "fsmri", None)]}
+                if obj_type == "Group":
+                    role_objects["members"] = [
+                        MEEG(meeg_name, self.ct) for meeg_name in obj.group_list
+                    ]
+                for role, role_objs in role_objects.items():
+                    for role_obj in [o for o in role_objs if o is not None]:
+                        # Only a small part of subsets is read
+                        data_types = func_io[role]["load"] - func_io[role]["subset"]
+                        for data_type in data_types:
+                            if data_type in role_obj.io_dict:
+                                size += role_obj.get_data_size(data_type)
+            except Exception as err:
+                logging.debug(f"Input-size of {func_name} for {obj_name}: {err}")
+        self.input_sizes[step] = size
+
+        return size
+
+    def estimate_memory(self, step):
+        """Estimate the memory (in bytes) needed by a step
+        from the size of its inputs."""
+        return self.memory_history.predict(step[1], self.get_input_size(step))
+
+    def record_memory(self, step, step_result):
+        if step_result.peak_memory is None or step not in self.input_sizes:
+            return
+        if isinstance(step_result.result, ExceptionTuple):
+            return
+        self.memory_history.add(
+            step[1], self.input_sizes[step], step_result.peak_memory
+        )
+        self.memory_history.save()
+
+    def mark_completed(self):
+        """Mark the steps completed in the journal as finished."""
+        for step in [s for s in self.all_steps if s in self.journal.completed]:
+            self.graph.mark_finished(step)
+            # Not the overridden method, the views may not exist yet
+            RunController.mark_items(self, *step, 0)
+            self.prog_count += 1
+        logging.info(
+            f"Resuming run from {self.journal.path} "
+            f"({self.prog_count}/{len(self.all_steps)} steps completed)"
+        )
+        self.journal.write("resume")
+
+    def init_graph(self):
+        """Build the dependency-graph of all steps"""
+        # Get one object of each type to map the load-/save-methods
+        # to the data-types of their io_dict
+        objects = dict()
+        for obj_name, obj_info in self.all_objects.items():
+            obj_type = obj_info["type"]
+            if obj_type not in objects and obj_type != "Other":
+                objects[obj_type] = self.load_object(obj_name, obj_type)
+        # The methods of the FSMRI associated with a MEEG-file
+        if "FSMRI" not in objects and getattr(objects.get("MEEG"), "fsmri", None):
+            objects["FSMRI"] = objects["MEEG"].fsmri
+        self.graph = build_step_graph(
+            self.ct, self.all_steps, self.all_objects, objects=objects
+        )
 
-    def finished(self):
-        pass
-
-    def prepare_start(self):
-        # Take first step of all_steps until there are no steps left.
-        if len(self.all_steps) > 0:
-            # Getting information as encoded in init_lists
-            self.current_obj_name, self.current_func = self.all_steps.pop(0)
-            logging.debug(
-                f"Running {self.current_func} for " f"{self.current_obj_name}"
-            )
-            # Get current object
-            self.get_object()
+    def mark_items(self, obj_name, func_name, status):
+        # Mark function with status
+        self.all_objects[obj_name]["functions"][func_name] = status
+        # Mark object with status depending on the status of its functions
+        func_states = self.all_objects[obj_name]["functions"].values()
+        if any([s == 2 for s in func_states]):
+            obj_status = 2
+        elif all([s == 0 for s in func_states]):
+            obj_status = 0
+        else:
+            obj_status = 1
+        self.all_objects[obj_name]["status"] = obj_status
 
-            # Mark current object and current function
-            self.mark_current_items(2)
+    def load_object(self, obj_name, obj_type):
+        if obj_type == "FSMRI":
+            obj = get_fsmri(obj_name, self.ct)
 
-            # Run function in Multiprocessing-Pool
-            kwds = dict()
-            kwds["func"] = get_func(self.current_func, self.current_object)
-            kwds["keywargs"] = get_arguments(kwds["func"], self.current_object)
+        elif obj_type == "MEEG":
+            # The FSMRI-object is shared by the registry
+            obj = MEEG(obj_name, self.ct)
 
-            return kwds
+        elif obj_type == "Group":
+            obj = Group(obj_name, self.ct)
 
         else:
-            self.finished()
-
-    def start(self):
-        kwds = self.prepare_start()
-        if kwds is not None:
-            run_func(**kwds)
-            # ToDo: MP
-            # self.pool.apply_async(func=run_func, kwds=kwds,
-            #                       callback=self.process_finished)
-            self.process_finished(None)
-
-
-class QRunController(RunController):
-    def __init__(self, run_dialog, controller):
-        super().__init__(controller)
-        self.rd = run_dialog
-        self.errors = dict()
-        self.error_count = 0
-        self.is_prog_text = False
-        self.paused = False
+            obj = BaseLoading(obj_name, self.ct)
 
-    def mark_current_items(self, status):
-        super().mark_current_items(status)
-        obj_idx = list(self.all_objects.keys()).index(self.current_object.name)
-        func_idx = list(
-            self.all_objects[self.current_object.name]["functions"].keys()
-        ).index(self.current_func)
-        # Notify Object-Model of change
-        self.rd.object_model.layoutChanged.emit()
-        # Scroll to current object
-        self.rd.object_view.scrollTo(
-            self.rd.object_model.createIndex(obj_idx, 0),
-            QAbstractItemView.PositionAtCenter,
-        )
-        # Notify Function-Model of change
-        self.rd.func_model.layoutChanged.emit()
-        # Scroll to current function
-        self.rd.func_view.scrollTo(
-            self.rd.func_model.createIndex(func_idx, 0),
-            QAbstractItemView.PositionAtCenter,
-        )
+        return obj
 
     def get_object(self):
-        old_obj_name = self.current_obj_name
-        super().get_object()
-        # Print Headline for object if new
-        if old_obj_name != self.current_obj_name:
-            self.rd.console_widget.write_html(
-                f"<br><h1>{self.current_obj_name}</h1><br>"
+        self.current_type = self.all_objects[self.current_obj_name]["type"]
+
+        # Load object if the preceding object is not the same
+        if not self.current_object or self.current_object.name != self.current_obj_name:
+            self.current_object = self.load_object(
+                self.current_obj_name, self.current_type
             )
-        # Load functions for object into func_model
-        # (which displays functions in func_view)
-        self.current_all_funcs = self.all_objects[self.current_obj_name]["functions"]
-        self.rd.func_model._data = self.current_all_funcs
-        self.rd.func_model.layoutChanged.emit()
 
-        # Print Headline for function
-        self.rd.console_widget.write_html(f"<h2>{self.current_func}</h2><br>")
+    def init_pgbar(self):
+        """Show the progress on the command-line"""
+        self.pgbar = tqdm(
+            total=len(self.all_steps), initial=self.prog_count, unit="step"
+        )
 
-    def process_finished(self, result):
+    def finish_step(self, step, result):
+        """Record the result of a step and mark it as finished."""
+        if step not in self.skipped:
+            self.journal.write_result(step, result)
+            self.record_runtime(step, result)
+        self.memory_budget.release(step)
         self.prog_count += 1
-        self.rd.pgbar.setValue(self.prog_count)
-        self.mark_current_items(0)
-        # Process
-        if self.paused:
-            self.rd.console_widget.write_html("<b><big>Paused</big></b><br>")
-            # Enable/Disable Buttons
-            self.rd.continue_bt.setEnabled(True)
-            self.rd.pause_bt.setEnabled(False)
-            self.rd.restart_bt.setEnabled(True)
-            self.rd.close_bt.setEnabled(True)
-        else:
+        self.graph.mark_finished(step)
+        self.mark_items(*step, 0)
+
+    def process_finished(self, step, result):
+        with self.lock:
+            self.finish_step(step, result)
             if isinstance(result, ExceptionTuple):
-                error_cause = (
-                    f"{self.error_count}: "
-                    f"{self.current_object.name} "
-                    f"<- {self.current_func}"
-                )
-                self.errors[error_cause] = (result, self.error_count)
-                # Update Error-Widget
-                self.rd.error_widget.replace_data(list(self.errors.keys()))
-
-                # Insert Error-Number into console-widget as an anchor
-                # for later inspection
-                self.rd.console_widget.write_html(
-                    f'<a name="{self.error_count}" href={self.error_count}>'
-                    f"<i>Error No.{self.error_count}</i><br></a>"
-                )
-                # Increase Error-Count by one
-                self.error_count += 1
-
-            # Continue with next object
-            self.start()
+                self.errors[step] = result
+            if self.pgbar is not None:
+                self.pgbar.set_postfix(errors=len(self.errors), refresh=False)
+                self.pgbar.update()
+        self.start()
 
     def finished(self):
-        self.rd.console_widget.write_html("<b><big>Finished</big></b><br>")
-        # Enable/Disable Buttons
-        self.rd.continue_bt.setEnabled(False)
-        self.rd.pause_bt.setEnabled(False)
-        self.rd.restart_bt.setEnabled(True)
-        self.rd.close_bt.setEnabled(True)
+        self.journal.write("end")
+        if self.pgbar is not None:
+            self.pgbar.close()
+        self.finished_event.set()
 
-        if self.ct.get_setting("shutdown"):
-            self.ct.save()
-            shutdown()
+    def n_slots(self):
+        """The maximum number of steps running at the same time"""
+        if self.pool is None:
+            return 1
 
-    def start(self):
-        kwds = self.prepare_start()
-        if kwds:
-            # Plot functions with interactive plots currently can't
-            # run in a separate thread, so they
-            #  excuted in the main thread
-            ismayavi = self.ct.pd_funcs.loc[self.current_func, "mayavi"]
-            ismpl = self.ct.pd_funcs.loc[self.current_func, "matplotlib"]
-            show_plots = self.ct.get_setting("show_plots")
-            use_qthread = QS().value("use_qthread")
-            if (
-                ismayavi
-                or (ismpl and show_plots and use_qthread)
-                or (ismpl and not show_plots and use_qthread and ismac)
-            ):
-                logging.info("Starting in Main-Thread.")
-                result = run_func(**kwds)
-                self.process_finished(result)
-
-            elif QS().value("use_qthread"):
-                logging.info("Starting in separate Thread.")
-                worker = Worker(function=run_func, **kwds)
-                worker.signals.error.connect(self.process_finished)
-                worker.signals.finished.connect(self.process_finished)
-                QThreadPool.globalInstance().start(worker)
+        return self.pool.n_processes
 
+    def get_next_step(self):
+        """Get the next step, which is ready to run,
+        if there is a free slot."""
+        if self.paused:
+            return None
+        if len(self.graph.running_steps()) >= self.n_slots():
+            return None
+        ready_steps = self.graph.ready_steps()
+        if len(ready_steps) == 0:
+            return None
+        step = ready_steps[0]
+        # Wait for running steps to finish, if the memory would not suffice
+        if self.n_slots() > 1:
+            estimate = self.estimate_memory(step)
+            if not self.memory_budget.fits(estimate):
+                return None
+            self.memory_budget.reserve(step, estimate)
+        self.graph.mark_running(step)
+
+        return step
+
+    def prepare_start(self, step):
+        # Getting information as encoded in init_lists
+        self.current_obj_name, self.current_func = step
+        logging.debug(f"Running {self.current_func} for {self.current_obj_name}")
+        # Get current object
+        self.get_object()
+
+        # Mark current object and current function
+        self.mark_items(*step, 2)
+
+        if self.is_up_to_date(step):
+            return None
+
+        kwds = dict()
+        kwds["func"] = get_func(self.current_func, self.current_object)
+        kwds["keywargs"] = get_arguments(kwds["func"], self.current_object)
+        if "n_jobs" in kwds["keywargs"]:
+            if self.n_jobs is not None:
+                kwds["keywargs"]["n_jobs"] = self.n_jobs
+            kwds["keywargs"]["n_jobs"] = self.cpu_budget.get_n_jobs(
+                kwds["keywargs"]["n_jobs"]
+            )
+        kwds["n_threads"] = self.cpu_budget.n_per_worker
+
+        return kwds
+
+    def is_up_to_date(self, step):
+        """Check if the outputs of a step exist and were saved
+        from unchanged inputs with the same parameters."""
+        if not isinstance(self.current_object, (MEEG, FSMRI, Group)):
+            return False
+        func_io = self.graph.func_ios.get(step[1])
+        # Only steps saving exclusively to their own object can be skipped
+        if func_io is None or any(
+            len(func_io[role]["save"]) > 0 for role in ["fsmri", "members"]
+        ):
+            return False
+        # File-parameters may have been changed by a worker-process
+        self.current_object.load_file_parameter_file()
+        data_types = func_io["self"]["save"] - {"file_parameters"}
+
+        return check_up_to_date(self.current_object, step[1], data_types)
+
+    def skip_step(self, step):
+        logging.info(f"Skipping {step[1]} for {step[0]} (up to date)")
+        self.skipped.append(step)
+        self.journal.write("skip", step)
+        self.process_finished(step, None)
+
+    def process_step_result(self, step, step_result):
+        """Transfer the changes to the project
+        from a step run in a worker-process"""
+        with self.lock:
+            apply_project_changes(self.ct.pr, step_result.project_changes)
+            self.record_memory(step, step_result)
+        self.process_finished(step, step_result.result)
+
+    def get_step_spec(self, step, kwds):
+        return StepSpec(
+            step[1], self.current_object, kwds["keywargs"], kwds["n_threads"]
+        )
+
+    def run_step(self, step, kwds):
+        if self.pool is None:
+            result = run_func(**kwds)
+            self.process_finished(step, result)
+        else:
+            self.pool.apply_async(
+                func=run_step_spec,
+                args=(self.get_step_spec(step, kwds),),
+                callback=partial(self.process_step_result, step),
+                error_callback=lambda err: self.process_step_result(
+                    step, get_error_result(err)
+                ),
+            )
+
+    def start(self):
+        """Start all steps which are ready (their dependencies are finished)
+        until all slots are occupied."""
+        with self.lock:
+            # Steps are already dispatched in another call of start
+            # (e.g. when finishing synchronously in serial mode)
+            if self._dispatching:
+                return
+            self._dispatching = True
+        while True:
+            with self.lock:
+                step = self.get_next_step()
+                if step is None:
+                    self._dispatching = False
+                    is_finished = self.graph.is_finished() and not self._is_finished
+                    if is_finished:
+                        self._is_finished = True
+                    break
+                kwds = self.prepare_start(step)
+            if kwds is None:
+                self.skip_step(step)
             else:
-                logging.info("Starting in process from multiprocessing.")
-                recv_pipe, send_pipe = Pipe(False)
-                kwds["pipe"] = send_pipe
-                stream_rcv = StreamReceiver(recv_pipe)
-                stream_rcv.signals.stdout_received.connect(
-                    self.rd.console_widget.write_stdout
-                )
-                stream_rcv.signals.stderr_received.connect(
-                    self.rd.console_widget.write_stderr
-                )
-                stream_rcv.signals.progress_received.connect(
-                    self.rd.console_widget.write_progress
-                )
-                QThreadPool.globalInstance().start(stream_rcv)
-                # ToDO: MP
-                self.pool.apply_async(
-                    func=run_func, kwds=kwds, callback=self.process_finished
-                )
+                self.journal.write("start", step)
+                self.start_times[step] = time.perf_counter()
+                self.run_step(step, kwds)
+
+        if is_finished:
+            self.finished()
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Authors: Martin Schulz <dev@mgschulz.de>
+License: BSD 3-Clause
+Github: https://github.com/marsipu/mne-pipeline-hd
+
+Run the pipeline from the command-line without PyQt5
+(e.g. on batch-nodes without a display):
+
+    python -m mne_pipeline_hd run --home <home_path> --project <project>
+        --preset <parameter-preset> --functions filter_data epoch_raw
+"""
+
+import argparse
+import logging
+import sys
+from os.path import isdir, join
+
+from mne_pipeline_hd.pipeline.controller import Controller
+from mne_pipeline_hd.pipeline.function_utils import RunController
+from mne_pipeline_hd.pipeline.journal import get_resumable_journal
+from mne_pipeline_hd.pipeline.parallel import close_mp_pool, init_mp_pool
+from mne_pipeline_hd.pipeline.pipeline_utils import QS
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m mne_pipeline_hd run",
+        description="Run the pipeline without the graphical user-interface.",
+    )
+    parser.add_argument(
+        "--home",
+        help="The home-path of the pipeline (default: the last used home-path).",
+    )
+    parser.add_argument(
+        "--project",
+        help="The name of the project (default: the last selected project).",
+    )
+    parser.add_argument(
+        "--preset",
+        help="The parameter-preset to use (default: the selected preset).",
+    )
+    parser.add_argument(
+        "--functions",
+        nargs="+",
+        help="The functions to run (default: the selected functions).",
+    )
+    parser.add_argument(
+        "--meeg", nargs="+", help="The MEEG-files (default: the selected files)."
+    )
+    parser.add_argument(
+        "--fsmri",
+        nargs="+",
+        help="The FSMRI-subjects (default: the selected subjects).",
+    )
+    parser.add_argument(
+        "--groups", nargs="+", help="The groups (default: the selected groups)."
+    )
+    parser.add_argument(
+        "--n-jobs",
+        type=int,
+        help="The total number of cores to use (-1 for all cores).",
+    )
+    parser.add_argument(
+        "--n-parallel",
+        type=int,
+        help="The number of steps to run simultaneously in separate processes.",
+    )
+    parser.add_argument(
+        "--ram-budget",
+        type=float,
+        help="The memory (in GB) available for the steps running simultaneously "
+        "(0 for 80%% of the available memory).",
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Run also the steps, whose outputs are up to date.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume the last run of the project if it was interrupted "
+        "(the selection is taken from the interrupted run).",
+    )
+
+    return parser
+
+
+def _check_selection(parser, selection, available, kind):
+    not_available = [s for s in selection if s not in available]
+    if len(not_available) > 0:
+        parser.error(f"{kind} not found: {not_available}")
+
+
+def run_pipeline(ct, n_parallel=1, n_jobs=None, resume=False, ram_budget=None):
+    """Run the selected functions for the selected objects of the project.
+
+    Parameters
+    ----------
+    ct : Controller
+        The Controller with the project to run.
+    n_parallel : int
+        The number of steps to run simultaneously in separate processes.
+    n_jobs : int | None
+        The total number of cores to use. If None, the QSetting "n_jobs"
+        is used.
+    resume : bool
+        If True, the last run is resumed and the steps completed
+        in this run are skipped.
+    ram_budget : float | None
+        The memory in GB available for the steps running simultaneously.
+        If None, the QSetting "ram_budget" is used.
+
+    Returns
+    -------
+    errors : dict
+        The steps which raised an error with their ExceptionTuple.
+    """
+    if n_parallel > 1:
+        pool = init_mp_pool(n_parallel, ct)
+    else:
+        pool = None
+    try:
+        rc = RunController(
+            ct, pool=pool, n_jobs=n_jobs, resume=resume, ram_budget=ram_budget
+        )
+        rc.init_pgbar()
+        rc.start()
+        rc.finished_event.wait()
+    finally:
+        if pool is not None:
+            close_mp_pool()
+
+    for (obj_name, func_name), exc_tuple in rc.errors.items():
+        logging.error(f"{obj_name} <- {func_name}:\n{exc_tuple[2]}")
+
+    return rc.errors
+
+
+def main(argv=None):
+    """Run the pipeline from the command-line.
+
+    Returns
+    -------
+    exit_code : int
+        0 if all steps were successful, 1 if any step raised an error.
+    """
+    parser = get_parser()
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        format="%(asctime)s: %(message)s",
+        datefmt="%Y/%m/%d %H:%M:%S",
+        level=QS().value("log_level", defaultValue=logging.INFO),
+    )
+    n_parallel = args.n_parallel or QS().value("n_parallel", defaultValue=1)
+
+    if args.home is not None and args.project is not None:
+        if not isdir(join(args.home, "projects", args.project)):
+            parser.error(f"Project {args.project} not found in {args.home}!")
+    try:
+        ct = Controller(args.home, args.project)
+    except RuntimeError as err:
+        parser.error(str(err))
+    if ct.pr is None:
+        parser.error("No project found, please specify one with --project!")
+
+    # The selection from the command-line is not saved to the project
+    selection = {
+        attr: getattr(ct.pr, attr)
+        for attr in ["p_preset", "sel_functions", "sel_meeg", "sel_fsmri", "sel_groups"]
+    }
+    if args.preset is not None:
+        if args.preset not in ct.pr.parameters:
+            parser.error(f"Parameter-Preset {args.preset} not found!")
+        ct.pr.p_preset = args.preset
+    if args.functions is not None:
+        _check_selection(parser, args.functions, ct.pd_funcs.index, "Functions")
+        ct.pr.sel_functions = args.functions
+    if args.meeg is not None:
+        _check_selection(parser, args.meeg, ct.pr.all_meeg, "MEEG")
+        ct.pr.sel_meeg = args.meeg
+    if args.fsmri is not None:
+        _check_selection(parser, args.fsmri, ct.pr.all_fsmri, "FSMRI")
+        ct.pr.sel_fsmri = args.fsmri
+    if args.groups is not None:
+        _check_selection(parser, args.groups, ct.pr.all_groups, "Groups")
+        ct.pr.sel_groups = args.groups
+    if args.resume and get_resumable_journal(ct.pr) is None:
+        parser.error("There is no interrupted run to resume!")
+    if args.overwrite:
+        ct.settings["overwrite"] = True
+
+    errors = run_pipeline(
+        ct,
+        n_parallel=n_parallel,
+        n_jobs=args.n_jobs,
+        resume=args.resume,
+        ram_budget=args.ram_budget,
+    )
+
+    # Save the changes to the project (e.g. bad-channels)
+    for attr, value in selection.items():
+        setattr(ct.pr, attr, value)
+    ct.pr.save()
+
+    if len(errors) > 0:
+        print(f"{len(errors)} step(s) failed!", file=sys.stderr)
+        return 1
+
+    return 0
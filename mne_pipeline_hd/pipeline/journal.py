@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Authors: Martin Schulz <dev@mgschulz.de>
+License: BSD 3-Clause
+Github: https://github.com/marsipu/mne-pipeline-hd
+"""
+
+import json
+import logging
+import os
+from datetime import datetime
+from os import listdir, makedirs
+from os.path import isdir, isfile, join
+
+from mne_pipeline_hd.pipeline.pipeline_utils import ExceptionTuple
+
+# The number of journals kept for each project
+max_journals = 20
+
+
+def get_journals_path(pr):
+    return join(pr.pscripts_path, "run_journals")
+
+
+def get_journal_paths(pr):
+    """Get the paths of all run-journals of a project (the oldest first)."""
+    journals_path = get_journals_path(pr)
+    if not isdir(journals_path):
+        return list()
+
+    return [
+        join(journals_path, file_name)
+        for file_name in sorted(listdir(journals_path))
+        if file_name.endswith(".jsonl")
+    ]
+
+
+class RunJournal:
+    """A journal of a run, which records the start, finish and failure of
+    each step in a file (one JSON-entry per line). It is written
+    immediately, so that an interrupted run can be resumed later.
+
+    Parameters
+    ----------
+    path : str
+        The path of the journal-file. If the file exists,
+        its entries are read.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.p_preset = None
+        # The steps of the run as (object-name, function-name)
+        self.steps = list()
+        self.obj_types = dict()
+        self.started = set()
+        self.completed = set()
+        self.failed = dict()
+        self.is_finished = False
+
+        if isfile(self.path):
+            self.read()
+
+    def _process_entry(self, entry):
+        event = entry["event"]
+        if "object" in entry:
+            step = (entry["object"], entry["function"])
+        else:
+            step = None
+
+        if event == "run":
+            self.p_preset = entry["p_preset"]
+            for obj_name, obj_type, func_name in entry["steps"]:
+                self.steps.append((obj_name, func_name))
+                self.obj_types[obj_name] = obj_type
+        elif event == "start":
+            self.started.add(step)
+        elif event in ["finish", "skip"]:
+            self.completed.add(step)
+            self.failed.pop(step, None)
+        elif event == "fail":
+            self.failed[step] = entry.get("error", "")
+        elif event == "resume":
+            self.is_finished = False
+        elif event == "end":
+            self.is_finished = True
+
+    def read(self):
+        with open(self.path, "r") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line may be incomplete after a crash
+                    logging.warning(f"Skipping incomplete entry in {self.path}")
+                    continue
+                self._process_entry(entry)
+
+    def write(self, event, step=None, **kwargs):
+        """Append an entry to the journal.
+
+        Parameters
+        ----------
+        event : str
+            The event (run, start, finish, skip, fail, resume or end).
+        step : tuple | None
+            The step (object-name, function-name) of the event.
+        kwargs
+            Additional information to store with the event.
+        """
+        entry = {"event": event, "time": str(datetime.now())}
+        if step is not None:
+            entry["object"], entry["function"] = step
+        entry.update(kwargs)
+        with open(self.path, "a") as file:
+            file.write(json.dumps(entry) + "\n")
+            # Make sure the entry is on disk if the machine crashes
+            file.flush()
+            os.fsync(file.fileno())
+        self._process_entry(entry)
+
+    def write_result(self, step, result):
+        """Record the finish or failure of a step from its result."""
+        if isinstance(result, ExceptionTuple):
+            self.write("fail", step, error=str(result[1]))
+        else:
+            self.write("finish", step)
+
+    def remaining_steps(self):
+        return [step for step in self.steps if step not in self.completed]
+
+    def is_resumable(self):
+        """True, if the run was interrupted before all steps were run."""
+        return not self.is_finished and len(self.remaining_steps()) > 0
+
+
+def new_journal(pr, all_steps, all_objects):
+    """Create the journal for a new run and remove the oldest journals.
+
+    Parameters
+    ----------
+    pr : Project
+        The project of the run.
+    all_steps : list
+        The steps (object-name, function-name) of the run.
+    all_objects : dict
+        The objects of the run with their type.
+
+    Returns
+    -------
+    journal : RunJournal
+        The journal of the new run.
+    """
+    journals_path = get_journals_path(pr)
+    makedirs(journals_path, exist_ok=True)
+    for old_path in get_journal_paths(pr)[: -max_journals + 1]:
+        os.remove(old_path)
+    time_str = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    journal = RunJournal(join(journals_path, f"run_{time_str}.jsonl"))
+    journal.write(
+        "run",
+        p_preset=pr.p_preset,
+        steps=[
+            [obj_name, all_objects[obj_name]["type"], func_name]
+            for obj_name, func_name in all_steps
+        ],
+    )
+
+    return journal
+
+
+def get_resumable_journal(pr):
+    """Get the journal of the last run of the project,
+    if it was interrupted (otherwise None)."""
+    journal_paths = get_journal_paths(pr)
+    if len(journal_paths) == 0:
+        return None
+    journal = RunJournal(journal_paths[-1])
+    if journal.is_resumable():
+        return journal
+
+    return None
@@ -8,6 +8,7 @@ Github: https://github.com/marsipu/mne-pipeline-hd
 from __future__ import print_function
 
 import functools
+import hashlib
 import inspect
 import itertools
 import json
@@ -15,6 +16,10 @@ import logging
 import os
 import pickle
 import shutil
+import tempfile
+import threading
+import weakref
+from contextlib import contextmanager
 from datetime import datetime
 from os import listdir, makedirs, remove
 from os.path import exists, getsize, isdir, isfile, join
@@ -23,13 +28,17 @@ from pathlib import Path
 import matplotlib.pyplot as plt
 import mne
 import numpy as np
+from scipy import sparse
 from tqdm import tqdm
 
+from mne_pipeline_hd.pipeline.data_cache import get_data_cache
 from mne_pipeline_hd.pipeline.pipeline_utils import (
     TypedJSONEncoder,
     type_json_hook,
     QS,
     _test_run,
+    get_fingerprint,
+    get_saved_paths,
 )
 
 sample_paths = {
@@ -55,6 +64,96 @@ def _get_data_type_from_func(self, func, method):
     return data_type
 
 
+# Keeps the inputs loaded by the function running in the current thread
+_input_recorder = threading.local()
+
+
+@contextmanager
+def record_inputs():
+    """Record the fingerprints of all files loaded inside this context,
+    they are stored with the file-parameters of the saved files."""
+    _input_recorder.inputs = dict()
+    try:
+        yield _input_recorder.inputs
+    finally:
+        _input_recorder.inputs = None
+
+
+def _get_recorded_inputs():
+    return getattr(_input_recorder, "inputs", None)
+
+
+# The ways to load raw-data (see MEEG.read_raw)
+load_policies = ["ram", "memmap", "lazy"]
+
+
+def get_memmap_path(name):
+    """Get a new file in the scratch-directory for memory-mapped data
+    (the QSetting "scratch_path" or the temporary directory)."""
+    scratch_path = QS().value("scratch_path", defaultValue="") or join(
+        tempfile.gettempdir(), "mne_pipeline_hd"
+    )
+    makedirs(scratch_path, exist_ok=True)
+    file, path = tempfile.mkstemp(suffix=".dat", prefix=f"{name}_", dir=scratch_path)
+    os.close(file)
+
+    return path
+
+
+def create_memmap(name, shape, dtype=np.float64):
+    """Create an array in a memory-mapped file in the scratch-directory,
+    which is removed with the array."""
+    path = get_memmap_path(name)
+    memmap = np.memmap(path, dtype=dtype, mode="w+", shape=shape)
+    weakref.finalize(memmap, _remove_memmap, path)
+
+    return memmap
+
+
+def _remove_memmap(path):
+    try:
+        os.remove(path)
+    except OSError:
+        logging.warning(f"Memory-mapped file {path} could not be removed")
+
+
+def get_key_hash(key):
+    """Get a short hash for the parameters in key (a dictionary),
+    which identify a file shared between data-objects."""
+    key_str = repr(sorted([(k, str(v)) for k, v in key.items()]))
+
+    return hashlib.sha1(key_str.encode()).hexdigest()[:16]
+
+
+def save_shared_file(shared_path, save_func):
+    """Save a shared file with save_func(path) to a temporary file first,
+    so that data-objects processed in parallel never link an incomplete file."""
+    base, suffix = shared_path.rsplit("-", 1)
+    tmp_path = f"{base}_{os.getpid()}tmp-{suffix}"
+    save_func(tmp_path)
+    os.replace(tmp_path, shared_path)
+
+
+def link_shared_file(shared_path, path):
+    """Link a shared file to path (copied, if the file-system
+    doesn't support links)."""
+    if isfile(path):
+        os.remove(path)
+    try:
+        os.link(shared_path, path)
+    except OSError:
+        shutil.copyfile(shared_path, path)
+
+
+def _record_input(self, data_type):
+    inputs = _get_recorded_inputs()
+    if inputs is None:
+        return
+    for path in [p for p in self._return_path_list(data_type) or list() if p]:
+        for saved_path in get_saved_paths(path):
+            inputs[saved_path] = get_fingerprint(saved_path)
+
+
 def load_decorator(load_func):
     @functools.wraps(load_func)
     def load_wrapper(self, *args, **kwargs):
@@ -62,9 +161,12 @@ def load_decorator(load_func):
         data_type = _get_data_type_from_func(self, load_func, "load")
         print(f"Loading {data_type} for {self.name}")
 
-        if data_type in self.data_dict:
-            data = self.data_dict[data_type]
-        else:
+        # Loading-functions with arguments are not cached
+        cache = get_data_cache()
+        use_cache = cache.max_bytes > 0 and len(args) + len(kwargs) == 0
+        cache_key = self.get_cache_key(data_type) if use_cache else None
+        data = cache.get(cache_key) if cache_key is not None else None
+        if data is None:
             # Todo: Dependencies!
             try:
                 data = load_func(self, *args, **kwargs)
@@ -104,9 +206,13 @@ def load_decorator(load_func):
                 else:
                     raise err
 
-        # Save data in data-dict for machines with big RAM
-        if not QS().value("save_ram"):
-            self.data_dict[data_type] = data
+            # Keep the data in memory for the next functions
+            if use_cache:
+                cache_key = self.get_cache_key(data_type)
+                if cache_key is not None:
+                    cache.put(cache_key, data)
+
+        _record_input(self, data_type)
 
         return data
 
@@ -120,8 +226,8 @@ def save_decorator(save_func):
         data_type = _get_data_type_from_func(self, save_func, "save")
 
         # Get data-object
-        if len(args) > 1:
-            data = args[1]
+        if len(args) > 0:
+            data = args[0]
         elif len(kwargs) > 0:
             data = kwargs[list(kwargs.keys())[0]]
         else:
@@ -135,15 +241,19 @@ def save_decorator(save_func):
         print(f"Saving {data_type} for {self.name}")
         save_func(self, *args, **kwargs)
 
-        # Save data in data-dict for machines with big RAM
-        if not QS().value("save_ram"):
-            self.data_dict[data_type] = data
-
         # Save File-Parameters
         paths = self._return_path_list(data_type)
         for path in paths:
             self.save_file_params(path)
 
+        # Keep the data in memory for the next functions
+        # (saved data is handed over to the cache, it is copied when loaded)
+        cache = get_data_cache()
+        if cache.max_bytes > 0 and data is not None:
+            cache_key = self.get_cache_key(data_type)
+            if cache_key is not None:
+                cache.put(cache_key, data, copy=False)
+
     return save_wrapper
 
 
@@ -155,16 +265,8 @@ class BaseLoading:
         # Basic Attributes (partly taking parameters or main-win-attributes
         # for easier access)
         self.name = name
-        self.ct = controller
-        self.pr = controller.pr
-        self.p_preset = self.pr.p_preset
-        self.subjects_dir = self.ct.subjects_dir
-        self.save_plots = self.ct.get_setting("save_plots")
-        self.figures_path = self.pr.figures_path
-        self.img_format = self.ct.get_setting("img_format")
-        self.dpi = self.ct.get_setting("dpi")
+        self.set_controller(controller)
 
-        self.data_dict = dict()
         self.existing_paths = dict()
 
         if name is not None:
@@ -173,6 +275,17 @@ class BaseLoading:
             self.init_paths()
             self.load_file_parameter_file()
 
+    def set_controller(self, controller):
+        """Set the controller and the attributes taken from it."""
+        self.ct = controller
+        self.pr = controller.pr
+        self.p_preset = self.pr.p_preset
+        self.subjects_dir = self.ct.subjects_dir
+        self.save_plots = self.ct.get_setting("save_plots")
+        self.figures_path = self.pr.figures_path
+        self.img_format = self.ct.get_setting("img_format")
+        self.dpi = self.ct.get_setting("dpi")
+
     def init_parameters(self):
         self.pa = self.pr.parameters[self.p_preset]
 
@@ -225,6 +338,45 @@ class BaseLoading:
 
         return paths
 
+    def _get_cache_state(self, data_type):
+        """Get the attributes, which change the loaded data besides the files
+        (should be overridden in inherited classes)"""
+        return ()
+
+    def get_cache_key(self, data_type):
+        """Get the key for the data-cache from the paths and fingerprints
+        of the files of a data-type (None, if a file doesn't exist)"""
+        files = list()
+        for path in [p for p in self._return_path_list(data_type) or list() if p]:
+            saved_paths = get_saved_paths(path)
+            if len(saved_paths) == 0:
+                return None
+            for saved_path in saved_paths:
+                fingerprint = get_fingerprint(saved_path)
+                if fingerprint is None:
+                    return None
+                files.append((os.path.abspath(saved_path), tuple(fingerprint)))
+        if len(files) == 0:
+            return None
+
+        return (
+            data_type,
+            tuple(files),
+            self.p_preset,
+            self._get_cache_state(data_type),
+        )
+
+    def get_data_size(self, data_type):
+        """Get the size (in bytes) of the files of a data-type
+        (from the file-parameters if recorded)."""
+        size = 0
+        for path in [p for p in self._return_path_list(data_type) or list() if p]:
+            for saved_path in get_saved_paths(path):
+                file_params = self.file_parameters.get(Path(saved_path).name, dict())
+                size += file_params.get("SIZE", getsize(saved_path))
+
+        return size
+
     def load_file_parameter_file(self):
         self.file_parameters_path = join(
             self.save_dir, f"_{self.name}_file_parameters.json"
@@ -236,9 +388,12 @@ class BaseLoading:
             self.file_parameters = dict()
 
     def save_file_parameter_file(self):
-        # Save File-Parameters file
-        with open(self.file_parameters_path, "w") as file:
+        # Save File-Parameters file to a temporary file first to not leave
+        # a corrupted file when multiple processes write at the same time
+        tmp_path = f"{self.file_parameters_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as file:
             json.dump(self.file_parameters, file, cls=TypedJSONEncoder, indent=4)
+        os.replace(tmp_path, self.file_parameters_path)
 
     def save_file_params(self, path):
         # Check existence of path and append appendices for hemispheres
@@ -278,6 +433,13 @@ class BaseLoading:
 
             self.file_parameters[file_name]["P_PRESET"] = self.p_preset
 
+            # Add the inputs to check later if the file is up to date
+            inputs = _get_recorded_inputs()
+            if inputs is not None:
+                self.file_parameters[file_name]["INPUTS"] = {
+                    p: fp for p, fp in inputs.items() if p != path
+                }
+
         self.save_file_parameter_file()
 
     def clean_file_parameters(self):
@@ -308,7 +470,14 @@ class BaseLoading:
                 # Make sure there are no spaces left
                 critical_params_str = critical_params_str.replace(" ", "")
                 critical_params = critical_params_str.split(",")
-                critical_params += ["FUNCTION", "NAME", "TIME", "SIZE", "P_PRESET"]
+                critical_params += [
+                    "FUNCTION",
+                    "NAME",
+                    "TIME",
+                    "SIZE",
+                    "P_PRESET",
+                    "INPUTS",
+                ]
 
                 for param in self.file_parameters[file_name]:
                     if param not in critical_params:
@@ -559,6 +728,13 @@ class MEEG(BaseLoading):
 
     def init_attributes(self):
         """Initialize additional attributes for MEEG"""
+        # How the raw-data of each data-type is loaded (see read_raw)
+        default_policy = QS().value("raw_load_policy", defaultValue="ram") or "ram"
+        self.load_policies = {
+            data_type: default_policy
+            for data_type in ["raw", "raw_filtered", "erm", "erm_filtered"]
+        }
+
         # The assigned Empty-Room-Measurement if existing
         if self.name not in self.pr.meeg_to_erm:
             self.erm = None
@@ -579,9 +755,9 @@ class MEEG(BaseLoading):
             if self.fsmri and self.fsmri.name == self.pr.meeg_to_fsmri[self.name]:
                 pass
             else:
-                self.fsmri = FSMRI(self.pr.meeg_to_fsmri[self.name], self.ct)
+                self.fsmri = get_fsmri(self.pr.meeg_to_fsmri[self.name], self.ct)
         else:
-            self.fsmri = FSMRI(None, self.ct)
+            self.fsmri = get_fsmri(None, self.ct)
             if not self.suppress_warnings:
                 print(
                     f"No Freesurfer-MRI-Subject assigned for {self.name},"
@@ -689,11 +865,6 @@ class MEEG(BaseLoading):
         )
         self.trans_path = join(self.save_dir, f"{self.fsmri.name}-trans.fif")
         self.forward_path = join(self.save_dir, f"{self.name}_{self.p_preset}-fwd.fif")
-        self.source_morph_path = join(
-            self.save_dir,
-            f'{self.name}--to--{self.pa["morph_to"]}_'
-            f'{self.pa["src_spacing"]}-morph.h5',
-        )
         self.calm_cov_path = join(
             self.save_dir, f"{self.name}_{self.p_preset}-calm-cov.fif"
         )
@@ -831,11 +1002,6 @@ class MEEG(BaseLoading):
                 "load": self.load_forward,
                 "save": self.save_forward,
             },
-            "morph": {
-                "path": self.source_morph_path,
-                "load": self.load_source_morph,
-                "save": self.save_source_morph,
-            },
             "noise_cov": {
                 "path": self.noise_covariance_path,
                 "load": self.load_noise_covariance,
@@ -945,6 +1111,16 @@ class MEEG(BaseLoading):
         self.bad_channels = bad_channels
         self.pr.meeg_bad_channels[self.name] = self.bad_channels
 
+    def _get_cache_state(self, data_type):
+        # Bad channels, excluded ica-components and projections
+        # are applied when loading
+        return (
+            tuple(self.bad_channels),
+            tuple(self.pr.meeg_ica_exclude.get(self.name, list())),
+            self.pa.get("apply_proj"),
+            self.load_policies.get(data_type),
+        )
+
     def set_ica_exclude(self, ica_exclude):
         self.ica_exclude = ica_exclude
         self.pr.meeg_ica_exclude[self.name] = self.ica_exclude
@@ -956,21 +1132,73 @@ class MEEG(BaseLoading):
     def load_info(self):
         return mne.io.read_info(self.raw_path)
 
-    @load_decorator
-    def load_raw(self):
-        raw = mne.io.read_raw_fif(self.raw_path, preload=True)
-        raw.info["bads"] = [bc for bc in self.bad_channels if bc in raw.ch_names]
+    def read_raw(self, data_type, policy=None, picks=None, tmin=0, tmax=None):
+        """Read raw-data with a load-policy.
+
+        Parameters
+        ----------
+        data_type : str
+            The data-type of the raw-data (raw, raw_filtered, erm
+            or erm_filtered).
+        policy : str | None
+            How the data is loaded: into memory ("ram"), into a memory-mapped
+            file in the scratch-directory ("memmap") or not at all ("lazy").
+            If None, the policy from load_policies is used.
+        picks : str | list | None
+            Only read these channels (e.g. "stim").
+        tmin : float
+            Only read the data from this time on (in seconds).
+        tmax : float | None
+            Only read the data until this time (in seconds).
+
+        Returns
+        -------
+        raw : mne.io.Raw
+            The raw-data.
+
+        Notes
+        -----
+        A subset of the data (from picks, tmin or tmax) is loaded
+        into memory, unless the policy is "lazy".
+        """
+        if policy is None:
+            policy = self.load_policies.get(data_type, "ram")
+        if policy not in load_policies:
+            raise ValueError(
+                f"Invalid load-policy {policy}, use one of {load_policies}"
+            )
+        is_subset = picks is not None or tmin > 0 or tmax is not None
+        if policy == "memmap" and not is_subset:
+            preload = get_memmap_path(f"{self.name}_{data_type}")
+        else:
+            preload = policy == "ram" and not is_subset
+        raw = mne.io.read_raw_fif(self.io_dict[data_type]["path"], preload=preload)
+        if isinstance(preload, str):
+            # The memory-mapped file is removed with the data
+            weakref.finalize(raw, _remove_memmap, preload)
+        if data_type in ["raw", "raw_filtered"]:
+            raw.info["bads"] = [bc for bc in self.bad_channels if bc in raw.ch_names]
+        if is_subset:
+            if picks is not None:
+                raw.pick(picks)
+            if tmin > 0 or tmax is not None:
+                raw.crop(tmin, tmax)
+            if policy != "lazy":
+                raw.load_data()
+
         return raw
 
+    @load_decorator
+    def load_raw(self, policy=None, picks=None, tmin=0, tmax=None):
+        return self.read_raw("raw", policy, picks, tmin, tmax)
+
     @save_decorator
     def save_raw(self, raw):
         raw.save(self.raw_path, fmt=raw.orig_format, overwrite=True)
 
     @load_decorator
-    def load_filtered(self):
-        raw = mne.io.read_raw_fif(self.raw_filtered_path, preload=True)
-        raw.info["bads"] = [bc for bc in self.bad_channels if bc in raw.ch_names]
-        return raw
+    def load_filtered(self, policy=None, picks=None, tmin=0, tmax=None):
+        return self.read_raw("raw_filtered", policy, picks, tmin, tmax)
 
     @save_decorator
     def save_filtered(self, raw_filtered):
@@ -979,22 +1207,49 @@ class MEEG(BaseLoading):
         )
 
     @load_decorator
-    def load_erm(self):
-        erm_raw = mne.io.read_raw_fif(self.erm_path, preload=True)
-        return erm_raw
+    def load_erm(self, policy=None, picks=None, tmin=0, tmax=None):
+        return self.read_raw("erm", policy, picks, tmin, tmax)
 
     @load_decorator
-    def load_erm_processed(self):
+    def load_erm_processed(self, policy=None, picks=None, tmin=0, tmax=None):
         if isfile(self.old_erm_processed_path):
             os.remove(self.old_erm_processed_path)
-        return mne.io.read_raw_fif(self.erm_processed_path, preload=True)
+        return self.read_raw("erm_filtered", policy, picks, tmin, tmax)
 
     @save_decorator
     def save_erm_processed(self, erm_filtered):
+        # Don't overwrite the shared file, if this is a link to it
+        if isfile(self.erm_processed_path):
+            os.remove(self.erm_processed_path)
         erm_filtered.save(
             self.erm_processed_path, fmt=erm_filtered.orig_format, overwrite=True
         )
 
+    def get_erm_shared_path(self, erm_key):
+        """Get the path of the processed Empty-Room-Data, which is shared
+        by all MEEG-files with the same key.
+
+        Parameters
+        ----------
+        erm_key : dict
+            The parameters, which determine the processed Empty-Room-Data.
+
+        Returns
+        -------
+        shared_path : str
+            The path for the shared processed Empty-Room-Data.
+        """
+        return join(
+            self.pr.data_path,
+            self.erm,
+            f"{self.erm}_{get_key_hash(erm_key)}-processed-raw.fif",
+        )
+
+    def save_erm_link(self, shared_path):
+        """Link the shared processed Empty-Room-Data to this MEEG-file."""
+        link_shared_file(shared_path, self.erm_processed_path)
+        self.save_file_params(self.erm_processed_path)
+
     @load_decorator
     def load_events(self):
         return mne.read_events(self.events_path)
@@ -1114,15 +1369,36 @@ class MEEG(BaseLoading):
 
     @save_decorator
     def save_forward(self, forward):
+        # Don't overwrite the shared file, if this is a link to it
+        if isfile(self.forward_path):
+            os.remove(self.forward_path)
         mne.write_forward_solution(self.forward_path, forward, overwrite=True)
 
-    @load_decorator
-    def load_source_morph(self):
-        return mne.read_source_morph(self.source_morph_path)
+    def get_forward_shared_path(self, forward_key):
+        """Get the path of the forward-solution, which is shared
+        by all MEEG-files with the same key.
 
-    @save_decorator
-    def save_source_morph(self, source_morph):
-        source_morph.save(self.source_morph_path, overwrite=True)
+        Parameters
+        ----------
+        forward_key : dict
+            The sensor-geometry, transformation, BEM and source-space,
+            which determine the forward-solution.
+
+        Returns
+        -------
+        shared_path : str
+            The path for the shared forward-solution.
+        """
+        return join(
+            self.fsmri.save_dir,
+            "bem",
+            f"{self.fsmri.name}_{get_key_hash(forward_key)}-fwd.fif",
+        )
+
+    def save_forward_link(self, shared_path):
+        """Link the shared forward-solution to this MEEG-file."""
+        link_shared_file(shared_path, self.forward_path)
+        self.save_file_params(self.forward_path)
 
     @load_decorator
     def load_noise_covariance(self):
@@ -1143,6 +1419,65 @@ class MEEG(BaseLoading):
         mne.minimum_norm.write_inverse_operator(
             self.inverse_path, inverse, overwrite=True
         )
+        # The prepared inverse-operators are outdated now
+        for prepared_path in Path(self.save_dir).glob(
+            f"{self.name}_{self.p_preset}-*-prepared-inv.pkl"
+        ):
+            os.remove(prepared_path)
+
+    def get_prepared_inverse(self, nave, lambda2, method):
+        """Get the inverse-operator prepared for nave, lambda2 and method,
+        which can be applied with prepared=True.
+
+        The prepared inverse-operator is computed once, saved next to the
+        inverse-operator and kept in the data-cache.
+
+        Parameters
+        ----------
+        nave : int
+            The number of averages (1 for epochs).
+        lambda2 : float
+            The regularization parameter.
+        method : str
+            The inverse-method (MNE, dSPM, sLORETA or eLORETA).
+
+        Returns
+        -------
+        inverse_operator : mne.minimum_norm.InverseOperator
+            The prepared inverse-operator (not to be changed in place).
+        """
+        prepared_key = {
+            "inverse": (self.inverse_path, get_fingerprint(self.inverse_path)),
+            "nave": int(nave),
+            "lambda2": float(lambda2),
+            "method": method,
+        }
+        prepared_path = join(
+            self.save_dir,
+            f"{self.name}_{self.p_preset}-{get_key_hash(prepared_key)}"
+            f"-prepared-inv.pkl",
+        )
+        cache = get_data_cache()
+        cache_key = ("prepared_inverse", prepared_path)
+        inverse_operator = cache.get(cache_key, copy=False)
+        if inverse_operator is None:
+            if isfile(prepared_path):
+                with open(prepared_path, "rb") as file:
+                    inverse_operator = pickle.load(file)
+            else:
+                inverse_operator = mne.minimum_norm.prepare_inverse_operator(
+                    self.load_inverse_operator(), nave, lambda2, method
+                )
+
+                def _save_prepared(path):
+                    with open(path, "wb") as file:
+                        pickle.dump(inverse_operator, file)
+
+                save_shared_file(prepared_path, _save_prepared)
+            cache.put(cache_key, inverse_operator, copy=False)
+        _record_input(self, "inverse")
+
+        return inverse_operator
 
     @load_decorator
     def load_source_estimates(self):
@@ -1282,6 +1617,19 @@ class MEEG(BaseLoading):
                 np.save(self.con_paths[trial][con_method], con_dict[trial][con_method])
 
 
+def _get_sign_flip(normals):
+    """Get the sign-flips of the vertices of a label from their normals
+    relative to their dominant direction (as mne.label_sign_flip)."""
+    _, _, vh = np.linalg.svd(normals, full_matrices=False)
+    # The sign of the first right singular vector is ambiguous,
+    # so it is aligned to the mean direction of the normals
+    dots = normals @ vh[0]
+    if np.mean(dots) < 0:
+        dots *= -1
+
+    return np.sign(dots)
+
+
 class FSMRI(BaseLoading):
     def __init__(self, name, controller, load_labels=False):
         if name == "fsaverage" and not isfile(
@@ -1308,6 +1656,11 @@ class FSMRI(BaseLoading):
         self.fs_path = QS().value("fs_path")
         self.mne_path = QS().value("mne_path")
 
+        # The loaded source-morphs by path with the fingerprint of their file
+        self.source_morphs = dict()
+        # The index of all labels (from _get_label_index)
+        self.label_index = None
+
         # Initialize Parcellations and Labels
         if self.load_labels:
             self.parcellations = self._get_available_parc()
@@ -1335,6 +1688,12 @@ class FSMRI(BaseLoading):
         self.vol_src_path = join(
             self.save_dir, "bem", f"{self.name}_{self.p_preset}-vol-src.fif"
         )
+        self.source_morph_path = join(
+            self.save_dir,
+            "bem",
+            f'{self.name}--to--{self.pa["morph_to"]}_{self.p_preset}_'
+            f'{self.pa["src_spacing"]}-morph.h5',
+        )
 
         # This dictionary contains entries for each data-type
         # which is loaded to/saved from disk
@@ -1359,6 +1718,11 @@ class FSMRI(BaseLoading):
                 "load": self.load_volume_source_space,
                 "save": self.save_volume_source_space,
             },
+            "morph": {
+                "path": self.source_morph_path,
+                "load": self.load_source_morph,
+                "save": self.save_source_morph,
+            },
         }
 
         self.deprecated_paths = {
@@ -1380,7 +1744,7 @@ class FSMRI(BaseLoading):
 
         return annotations
 
-    def _get_available_labels(self):
+    def _read_labels(self):
         labels = dict()
         labels["Other"] = list()
         label_dir = join(self.subjects_dir, self.name, "label")
@@ -1414,16 +1778,236 @@ class FSMRI(BaseLoading):
 
         return labels
 
+    def _get_label_files(self):
+        """Get the names, sizes and modification-times of the label- and
+        annotation-files, which determine if the label-index is up to date."""
+        label_dir = join(self.subjects_dir, self.name, "label")
+        try:
+            return sorted(
+                [
+                    (entry.name, entry.stat().st_size, entry.stat().st_mtime_ns)
+                    for entry in os.scandir(label_dir)
+                    if entry.name.endswith((".label", ".annot"))
+                ]
+            )
+        except FileNotFoundError:
+            return list()
+
+    def _get_label_index(self):
+        """Get the index of all labels and parcellations of this subject
+        (names, hemispheres, colors and vertices), which is saved to a binary
+        file and only rebuilt when the files in the label-directory change.
+
+        Returns
+        -------
+        label_index : dict
+            The arrays of the label-index with the offsets of the vertices
+            of each label ("indptr").
+        """
+        files_hash = get_key_hash({"label_files": self._get_label_files()})
+        if (
+            self.label_index is not None
+            and self.label_index["files_hash"] == files_hash
+        ):
+            return self.label_index
+
+        label_index_path = join(
+            self.subjects_dir, self.name, "bem", f"{self.name}-labels.npz"
+        )
+        label_index = None
+        if isfile(label_index_path):
+            with np.load(label_index_path) as index_file:
+                label_index = dict(index_file)
+            if label_index["files_hash"] != files_hash:
+                label_index = None
+
+        if label_index is None:
+            labels = self._read_labels()
+            label_list = [(parc, label) for parc in labels for label in labels[parc]]
+            label_index = {
+                "files_hash": np.array(files_hash),
+                "loaded_parcs": np.array(list(labels), dtype=str),
+                "parcs": np.array([parc for parc, _ in label_list], dtype=str),
+                "names": np.array([lb.name for _, lb in label_list], dtype=str),
+                "hemis": np.array([lb.hemi for _, lb in label_list], dtype=str),
+                "comments": np.array([lb.comment for _, lb in label_list], dtype=str),
+                "colors": np.array(
+                    [
+                        np.full(4, np.nan) if lb.color is None else lb.color
+                        for _, lb in label_list
+                    ]
+                ).reshape(-1, 4),
+                "indptr": np.cumsum([0] + [len(lb.vertices) for _, lb in label_list]),
+            }
+            for key in ["vertices", "pos", "values"]:
+                arrays = [getattr(lb, key) for _, lb in label_list]
+                label_index[key] = (
+                    np.concatenate(arrays) if len(arrays) > 0 else np.array([])
+                )
+            makedirs(join(self.subjects_dir, self.name, "bem"), exist_ok=True)
+            save_shared_file(
+                label_index_path, lambda path: np.savez(path, **label_index)
+            )
+        self.label_index = label_index
+
+        return label_index
+
+    def _get_indexed_label(self, label_index, idx):
+        """Create a label from the label-index."""
+        start, stop = label_index["indptr"][idx : idx + 2]
+        color = label_index["colors"][idx]
+
+        return mne.Label(
+            vertices=label_index["vertices"][start:stop],
+            pos=label_index["pos"][start:stop],
+            values=label_index["values"][start:stop],
+            hemi=str(label_index["hemis"][idx]),
+            comment=str(label_index["comments"][idx]),
+            name=str(label_index["names"][idx]),
+            subject=self.name,
+            color=None if np.any(np.isnan(color)) else tuple(color),
+        )
+
+    def _get_available_labels(self):
+        label_index = self._get_label_index()
+        labels = {str(parc): list() for parc in label_index["loaded_parcs"]}
+        for idx, parc in enumerate(label_index["parcs"]):
+            labels[str(parc)].append(self._get_indexed_label(label_index, idx))
+
+        return labels
+
     def get_labels(self, target_labels):
         labels = list()
         if target_labels is not None:
-            if self.labels is None:
-                self.labels = self._get_available_labels()
-            for label_list in self.labels.values():
-                labels += [lb for lb in label_list if lb.name in target_labels]
+            if self.labels is not None:
+                for label_list in self.labels.values():
+                    labels += [lb for lb in label_list if lb.name in target_labels]
+            else:
+                # Only the requested labels are created from the label-index
+                label_index = self._get_label_index()
+                labels = [
+                    self._get_indexed_label(label_index, idx)
+                    for idx, name in enumerate(label_index["names"])
+                    if name in target_labels
+                ]
 
         return labels
 
+    def get_label_index(self, labels, vertices):
+        """Get the index to extract labels from source-estimates with
+        the given vertices, which is saved next to the source-space
+        and kept in the data-cache.
+
+        Parameters
+        ----------
+        labels : list of mne.Label | mne.BiHemiLabel
+            The surface-labels.
+        vertices : list of np.ndarray
+            The vertices of the source-estimates (left and right hemisphere).
+
+        Returns
+        -------
+        label_index : dict
+            The positions of the vertices of each label in the data of the
+            source-estimates ("indices" with the offsets "indptr"), their
+            sign-flips ("flip") and the sparse aggregation-matrices
+            (n_labels x n_vertices) for "mean" and "mean_flip".
+        """
+        sub_labels = [
+            [label.lh, label.rh] if label.hemi == "both" else [label]
+            for label in labels
+        ]
+        index_key = {
+            "src": (self.src_path, get_fingerprint(self.src_path)),
+            "vertices": [hashlib.sha1(vn.tobytes()).hexdigest() for vn in vertices],
+            "labels": [
+                (
+                    label.name,
+                    [
+                        (sl.hemi, hashlib.sha1(sl.vertices.tobytes()).hexdigest())
+                        for sl in sub_label
+                    ],
+                )
+                for label, sub_label in zip(labels, sub_labels)
+            ],
+        }
+        index_path = join(
+            self.save_dir,
+            "bem",
+            f"{self.name}_{self.p_preset}-{get_key_hash(index_key)}-label-index.npz",
+        )
+        cache = get_data_cache()
+        cache_key = ("label_index", index_path)
+        label_index = cache.get(cache_key, copy=False)
+        if label_index is None:
+            if isfile(index_path):
+                with np.load(index_path) as index_file:
+                    label_index = dict(index_file)
+            else:
+                src = self.load_source_space()
+                indices = list()
+                flips = list()
+                for label, sub_label in zip(labels, sub_labels):
+                    vertidx = list()
+                    normals = list()
+                    offset = 0
+                    for vertno, hemi_src, hemi in zip(vertices, src, ["lh", "rh"]):
+                        for sl in [sl for sl in sub_label if sl.hemi == hemi]:
+                            label_vertices = np.intersect1d(vertno, sl.vertices)
+                            vertidx.append(
+                                offset + np.searchsorted(vertno, label_vertices)
+                            )
+                            normals.append(hemi_src["nn"][label_vertices])
+                        offset += len(vertno)
+                    vertidx = np.concatenate(vertidx)
+                    if len(vertidx) == 0:
+                        raise ValueError(
+                            f"The source-space does not contain any vertices "
+                            f"of {label.name}."
+                        )
+                    indices.append(vertidx)
+                    flips.append(_get_sign_flip(np.concatenate(normals)))
+                label_index = {
+                    "indices": np.concatenate(indices),
+                    "indptr": np.cumsum([0] + [len(idx) for idx in indices]),
+                    "flip": np.concatenate(flips),
+                    "n_vertices": np.array(sum([len(vn) for vn in vertices])),
+                }
+                save_shared_file(index_path, lambda path: np.savez(path, **label_index))
+            n_label_vertices = np.diff(label_index["indptr"])
+            weights = 1 / np.repeat(n_label_vertices, n_label_vertices)
+            shape = (len(n_label_vertices), int(label_index["n_vertices"]))
+            for mode, mode_weights in [
+                ("mean", weights),
+                ("mean_flip", weights * label_index["flip"]),
+            ]:
+                label_index[mode] = sparse.csr_matrix(
+                    (mode_weights, label_index["indices"], label_index["indptr"]),
+                    shape=shape,
+                )
+            cache.put(cache_key, label_index, copy=False)
+        _record_input(self, "src")
+
+        return label_index
+
+    def get_source_morph(self):
+        """Get the source-morph to morph_to, which is kept in memory
+        for all MEEG-files of this subject (reloaded if its file changed)."""
+        fingerprint = get_fingerprint(self.source_morph_path)
+        fingerprint_morph = self.source_morphs.get(self.source_morph_path)
+        if (
+            fingerprint is None
+            or fingerprint_morph is None
+            or (fingerprint_morph[0] != fingerprint)
+        ):
+            morph = self.load_source_morph()
+            self.source_morphs[self.source_morph_path] = (fingerprint, morph)
+        else:
+            morph = fingerprint_morph[1]
+            _record_input(self, "morph")
+
+        return morph
+
     ###########################################################################
     # Load- & Save-Methods
     ###########################################################################
@@ -1459,6 +2043,89 @@ class FSMRI(BaseLoading):
     def save_volume_source_space(self, vol_src):
         vol_src.save(self.vol_src_path, overwrite=True)
 
+    @load_decorator
+    def load_source_morph(self):
+        return mne.read_source_morph(self.source_morph_path)
+
+    @save_decorator
+    def save_source_morph(self, source_morph):
+        # The source-morph is shared by the MEEG-files processed in parallel
+        save_shared_file(
+            self.source_morph_path,
+            lambda path: source_morph.save(path, overwrite=True),
+        )
+
+
+# The FSMRI-objects shared in this process by (subjects_dir, name, project,
+# p_preset, parameters), also by the controllers of the steps in a worker
+_fsmri_registry = dict()
+_fsmri_lock = threading.Lock()
+
+
+def get_fsmri(name, controller, load_labels=False):
+    """Get the FSMRI-object of a subject shared by all MEEG- and Group-objects
+    of this process, so that its labels and source-morphs are only loaded once.
+
+    Parameters
+    ----------
+    name : str | None
+        The name of the Freesurfer-subject.
+    controller : Controller
+        The controller of the current project.
+    load_labels : bool
+        If the labels should be loaded.
+
+    Returns
+    -------
+    fsmri : FSMRI
+        The shared FSMRI-object.
+    """
+    pr = controller.pr
+    key = (
+        controller.subjects_dir,
+        name,
+        pr.project_path,
+        pr.p_preset,
+        get_key_hash(pr.parameters.get(pr.p_preset, dict())),
+    )
+    with _fsmri_lock:
+        fsmri = _fsmri_registry.get(key)
+        if fsmri is None:
+            fsmri = FSMRI(name, controller)
+            # The labels and source-morphs don't depend on the parameters
+            previous = [
+                fs
+                for k, fs in _fsmri_registry.items()
+                if k[:2] == (controller.subjects_dir, name)
+            ]
+            if len(previous) > 0:
+                fsmri.parcellations = previous[-1].parcellations
+                fsmri.labels = previous[-1].labels
+                fsmri.source_morphs = previous[-1].source_morphs
+                fsmri.label_index = previous[-1].label_index
+            _fsmri_registry[key] = fsmri
+        elif fsmri.pr is not pr:
+            # Another controller of the same project (e.g. the snapshot
+            # of each step in a worker-process) has to receive the changes
+            # to its project (e.g. of plot_files)
+            fsmri.set_controller(controller)
+            if name is not None:
+                fsmri.init_parameters()
+                # Other processes may have saved to the FSMRI meanwhile
+                fsmri.load_file_parameter_file()
+        if load_labels and fsmri.labels is None:
+            fsmri.parcellations = fsmri._get_available_parc()
+            fsmri.labels = fsmri._get_available_labels()
+
+    return fsmri
+
+
+def clear_fsmri_registry():
+    """Remove all shared FSMRI-objects (e.g. after the project, the
+    parameter-preset or the parameters were changed)."""
+    with _fsmri_lock:
+        _fsmri_registry.clear()
+
 
 class Group(BaseLoading):
     def __init__(self, name, controller, suppress_warnings=True):
@@ -1491,7 +2158,7 @@ class Group(BaseLoading):
             self.sel_trials = self.sel_trials | set(self.ct.pr.sel_event_id[group_item])
 
         # The fsmri where all group members are morphed to
-        self.fsmri = FSMRI(self.pa["morph_to"], self.ct)
+        self.fsmri = get_fsmri(self.pa["morph_to"], self.ct)
 
     def init_paths(self):
         # Main Path
@@ -1588,7 +2255,7 @@ class Group(BaseLoading):
             if obj_type == "MEEG":
                 obj = MEEG(obj_name, self.ct)
             elif obj_type == "FSMRI":
-                obj = FSMRI(obj_name, self.ct)
+                obj = get_fsmri(obj_name, self.ct)
             else:
                 logging.error(f"The object-type {obj_type} is not valid!")
                 continue
@@ -5,19 +5,506 @@ License: BSD 3-Clause
 Github: https://github.com/marsipu/mne-pipeline-hd
 """
 
-from multiprocessing import Pool
+import itertools
+import logging
+import queue
+import threading
+import traceback
+from collections import deque
+from copy import deepcopy
+from importlib import import_module
+from multiprocessing import get_context
+from multiprocessing.pool import ExceptionWithTraceback
+from multiprocessing.reduction import ForkingPickler
+
+import psutil
+
+from mne_pipeline_hd.pipeline.loading import BaseLoading, Group, MEEG, get_fsmri
+from mne_pipeline_hd.pipeline.pipeline_utils import ExceptionTuple, QS
 
 mp_pool = None
 
+# Attributes of the project which may be changed by pipeline-functions
+# and thus have to be transferred back from the worker-processes
+project_attributes = [
+    "meeg_bad_channels",
+    "meeg_event_id",
+    "meeg_ica_exclude",
+    "meeg_to_erm",
+    "all_erm",
+    "plot_files",
+]
+
+
+def _worker_main(worker_id, task_queue, result_queue, modules, max_tasks, max_memory):
+    """The loop of a worker-process, which runs the tasks from its queue
+    until it receives None or has to be recycled."""
+    # Import the modules once instead of for the first step
+    for module_name in modules:
+        try:
+            import_module(module_name)
+        except Exception as err:
+            logging.warning(f"{module_name} could not be preloaded: {err}")
+    process = psutil.Process()
+    start_memory = process.memory_info().rss
+    n_tasks = 0
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        task_id, func, args = task
+        try:
+            result = func(*args)
+            success = True
+        except Exception as err:
+            result = ExceptionWithTraceback(err, err.__traceback__)
+            success = False
+        # Pickle here, errors in the feeder-thread of the queue would get lost
+        try:
+            payload = bytes(ForkingPickler.dumps(result))
+        except Exception as err:
+            success = False
+            payload = bytes(
+                ForkingPickler.dumps(RuntimeError(f"Result not picklable: {err}"))
+            )
+        n_tasks += 1
+        memory_growth = process.memory_info().rss - start_memory
+        recycle = (max_tasks > 0 and n_tasks >= max_tasks) or (
+            max_memory > 0 and memory_growth > max_memory
+        )
+        result_queue.put((worker_id, task_id, success, payload, recycle))
+        if recycle:
+            break
+
+
+class WorkerPool:
+    """A pool of persistent worker-processes, which import the modules
+    once and receive the tasks through a queue.
+
+    Parameters
+    ----------
+    n_processes : int
+        The number of worker-processes.
+    max_tasks : int
+        The number of tasks after which a worker-process is replaced
+        by a new one (0 for never).
+    max_memory : int
+        The growth of memory (in bytes) after which a worker-process
+        is replaced by a new one (0 for never).
+    modules : list | None
+        The names of the modules to import in each worker-process.
+
+    Notes
+    -----
+    The interface is a subset of multiprocessing.Pool (apply_async, close,
+    join and terminate). The callbacks are called from a separate thread.
+    Tasks are assigned to idle worker-processes, so the task of a
+    worker-process which dies (e.g. killed by the OS because of low memory)
+    is reported as an error instead of blocking the pool.
+    """
+
+    def __init__(self, n_processes, max_tasks=0, max_memory=0, modules=None):
+        self.n_processes = max(int(n_processes), 1)
+        self.max_tasks = int(max_tasks or 0)
+        self.max_memory = int(max_memory or 0)
+        self.modules = modules or list()
+
+        # Spawn new processes to avoid copying the state of the GUI
+        # (forking a process with running threads from Qt is unsafe)
+        self._ctx = get_context("spawn")
+        self._result_queue = self._ctx.Queue()
+        self._lock = threading.RLock()
+        # The tasks waiting for an idle worker-process
+        self._pending = deque()
+        self._callbacks = dict()
+        # Worker-processes with their task-queue
+        self._workers = dict()
+        self._idle = list()
+        # The task currently running in each worker-process
+        self._running = dict()
+        self._task_counter = itertools.count()
+        self._worker_counter = itertools.count()
+        self._closed = False
+        self._terminated = False
+
+        for _ in range(self.n_processes):
+            self._start_worker()
+        self._result_thread = threading.Thread(target=self._handle_results, daemon=True)
+        self._result_thread.start()
+
+    def _start_worker(self):
+        worker_id = next(self._worker_counter)
+        task_queue = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(
+                worker_id,
+                task_queue,
+                self._result_queue,
+                self.modules,
+                self.max_tasks,
+                self.max_memory,
+            ),
+            daemon=True,
+        )
+        process.start()
+        self._workers[worker_id] = (process, task_queue)
+        self._idle.append(worker_id)
+
+    def _dispatch(self):
+        """Assign pending tasks to idle worker-processes."""
+        with self._lock:
+            while len(self._pending) > 0 and len(self._idle) > 0:
+                worker_id = self._idle.pop(0)
+                task = self._pending.popleft()
+                self._running[worker_id] = task[0]
+                self._workers[worker_id][1].put(task)
+            # Stop the idle worker-processes when the pool is closed
+            if self._closed and len(self._pending) == 0:
+                for worker_id in self._idle:
+                    self._workers[worker_id][1].put(None)
+                self._idle.clear()
+
+    def apply_async(self, func, args=(), callback=None, error_callback=None):
+        """Run func(*args) in a worker-process, callback is called
+        with the result or error_callback with the raised exception."""
+        if self._closed:
+            raise ValueError("The pool is not running!")
+        with self._lock:
+            task_id = next(self._task_counter)
+            self._callbacks[task_id] = (callback, error_callback)
+            self._pending.append((task_id, func, args))
+            self._dispatch()
+
+    def _finish_task(self, task_id, success, value):
+        with self._lock:
+            callback, error_callback = self._callbacks.pop(task_id, (None, None))
+        try:
+            if success and callback is not None:
+                callback(value)
+            elif not success and error_callback is not None:
+                error_callback(value)
+        except Exception:
+            logging.error(traceback.format_exc())
+
+    def _check_workers(self):
+        """Replace worker-processes, which died unexpectedly."""
+        failed_tasks = list()
+        with self._lock:
+            for worker_id, (process, _) in list(self._workers.items()):
+                if process.is_alive():
+                    continue
+                # Processes exiting normally were stopped or recycled
+                if process.exitcode == 0:
+                    if worker_id not in self._running:
+                        self._workers.pop(worker_id)
+                    continue
+                self._workers.pop(worker_id)
+                if worker_id in self._idle:
+                    self._idle.remove(worker_id)
+                task_id = self._running.pop(worker_id, None)
+                if self._terminated:
+                    continue
+                logging.error(
+                    f"Worker-process {worker_id} died "
+                    f"with exitcode {process.exitcode}"
+                )
+                self._start_worker()
+                if task_id is not None:
+                    failed_tasks.append((task_id, process.exitcode))
+            self._dispatch()
+        for task_id, exitcode in failed_tasks:
+            self._finish_task(
+                task_id,
+                False,
+                RuntimeError(
+                    f"The worker-process died with exitcode {exitcode} "
+                    f"(e.g. because of low memory)"
+                ),
+            )
+
+    def _handle_results(self):
+        while True:
+            try:
+                message = self._result_queue.get(timeout=0.5)
+            except queue.Empty:
+                message = None
+            if message is not None:
+                worker_id, task_id, success, payload, recycle = message
+                with self._lock:
+                    self._running.pop(worker_id, None)
+                    if recycle:
+                        logging.info(f"Recycling worker-process {worker_id}")
+                        self._workers.pop(worker_id)[0].join()
+                        self._start_worker()
+                    else:
+                        self._idle.append(worker_id)
+                    self._dispatch()
+                try:
+                    value = ForkingPickler.loads(payload)
+                except Exception as err:
+                    success, value = False, err
+                self._finish_task(task_id, success, value)
+            self._check_workers()
+            if self._terminated or (self._closed and len(self._workers) == 0):
+                break
+
+    def close(self):
+        """Stop the worker-processes after all pending tasks are finished."""
+        self._closed = True
+        self._dispatch()
+
+    def join(self):
+        self._result_thread.join()
+
+    def terminate(self):
+        with self._lock:
+            self._closed = True
+            self._terminated = True
+            for process, _ in self._workers.values():
+                process.terminate()
+        self._result_thread.join()
+
+
+def get_preload_modules(controller=None):
+    """Get the modules to import in the worker-processes
+    (the modules of the pipeline-functions)."""
+    modules = ["mne_pipeline_hd.pipeline.function_utils"]
+    if controller is not None:
+        for pkg_modules in controller.all_modules.values():
+            modules += pkg_modules
+
+    return modules
+
+
+def _get_recycle_settings():
+    max_tasks = int(QS().value("worker_max_tasks", defaultValue=0) or 0)
+    max_memory = float(QS().value("worker_max_memory", defaultValue=0) or 0)
+
+    return max_tasks, int(max_memory * 1024**3)
+
 
 def close_mp_pool():
+    global mp_pool
+
     if mp_pool is not None:
         mp_pool.close()
         mp_pool.join()
+        mp_pool = None
 
 
-def init_mp_pool():
+def init_mp_pool(n_parallel=None, controller=None):
+    """Initialize the pool of worker-processes
+
+    Parameters
+    ----------
+    n_parallel : int | None
+        The number of worker-processes. If None,
+        the QSetting "n_parallel" is used.
+    controller : Controller | None
+        The Controller to get the function-modules, which are imported
+        in the worker-processes.
+    """
     global mp_pool
 
     close_mp_pool()
-    mp_pool = Pool(1)
+    if n_parallel is None:
+        n_parallel = QS().value("n_parallel", defaultValue=1)
+    max_tasks, max_memory = _get_recycle_settings()
+    mp_pool = WorkerPool(
+        n_parallel,
+        max_tasks=max_tasks,
+        max_memory=max_memory,
+        modules=get_preload_modules(controller),
+    )
+    logging.info(f"Started pool with {mp_pool.n_processes} processes")
+
+    return mp_pool
+
+
+def get_mp_pool(controller=None):
+    """Get the pool of worker-processes, (re)initialized if the settings
+    for n_parallel or the recycling of worker-processes changed"""
+    n_parallel = max(int(QS().value("n_parallel", defaultValue=1)), 1)
+    if (
+        mp_pool is None
+        or mp_pool.n_processes != n_parallel
+        or (mp_pool.max_tasks, mp_pool.max_memory) != _get_recycle_settings()
+    ):
+        init_mp_pool(n_parallel, controller)
+
+    return mp_pool
+
+
+class StepSpec:
+    """A picklable description of a pipeline-step to run it in another process.
+
+    Parameters
+    ----------
+    func_name : str
+        The name of the pipeline-function.
+    obj : MEEG | FSMRI | Group | BaseLoading
+        The data-object the function is applied to.
+    keywargs : dict
+        The keyword-arguments for the function (as from get_arguments).
+        The parameter-values are frozen, the data-objects are rebuilt
+        in the worker-process.
+    n_threads : int | None
+        The maximum number of threads for BLAS/OpenMP in this step.
+    """
+
+    def __init__(self, func_name, obj, keywargs, n_threads=None):
+        self.func_name = func_name
+        self.n_threads = n_threads
+        self.obj_name = obj.name
+        self.obj_type = type(obj).__name__
+        self.p_preset = obj.p_preset
+        # Data-objects are not transferred, they are set again in the worker
+        self.keywargs = dict()
+        for arg_name, value in keywargs.items():
+            if isinstance(value, BaseLoading) or value is obj.ct or value is obj.pr:
+                self.keywargs[arg_name] = None
+            else:
+                self.keywargs[arg_name] = value
+        # The Controller holds a snapshot of the Project
+        # from the time the step is started
+        self.ct = obj.ct
+
+    def load_object(self):
+        """Rebuild the data-object in the worker-process"""
+        if self.obj_type == "MEEG":
+            obj = MEEG(self.obj_name, self.ct)
+        elif self.obj_type == "FSMRI":
+            obj = get_fsmri(self.obj_name, self.ct)
+        elif self.obj_type == "Group":
+            obj = Group(self.obj_name, self.ct)
+        else:
+            obj = BaseLoading(self.obj_name, self.ct)
+
+        return obj
+
+
+class StepResult:
+    """The result of a step run in a worker-process.
+
+    Parameters
+    ----------
+    result : object | ExceptionTuple
+        The return-value of the function
+        or an ExceptionTuple if an error occured.
+    project_changes : list
+        The changes to the project-attributes by the function
+        as tuples of (attribute_name, keys, value).
+    peak_memory : int | None
+        The additional memory (in bytes) the function needed at its peak
+        (None if it couldn't be measured).
+    """
+
+    def __init__(self, result, project_changes, peak_memory=None):
+        self.result = result
+        self.project_changes = project_changes
+        self.peak_memory = peak_memory
+
+
+def get_project_state(project):
+    """Get copies of the project-attributes,
+    which may be changed by pipeline-functions"""
+    return {
+        attr_name: deepcopy(getattr(project, attr_name))
+        for attr_name in project_attributes
+        if hasattr(project, attr_name)
+    }
+
+
+class _DeletedKey:
+    """The value of a change for a key deleted from a dictionary
+    (keeps its identity when pickled)."""
+
+    def __reduce__(self):
+        return "DELETED"
+
+    def __repr__(self):
+        return "DELETED"
+
+
+DELETED = _DeletedKey()
+
+
+def _get_changes(before, after, keys=()):
+    """Get the changed leaves from nested dictionaries
+    (with DELETED as value for deleted keys)."""
+    changes = list()
+    for key, value in after.items():
+        if key not in before:
+            changes.append((keys + (key,), value))
+        elif isinstance(value, dict) and isinstance(before[key], dict):
+            changes += _get_changes(before[key], value, keys + (key,))
+        elif value != before[key]:
+            changes.append((keys + (key,), value))
+    for key in [k for k in before if k not in after]:
+        changes.append((keys + (key,), DELETED))
+
+    return changes
+
+
+def get_project_changes(before, project):
+    """Compare project-attributes with their state before running a step.
+
+    Parameters
+    ----------
+    before : dict
+        Copies of the project-attributes before running the step
+        (from get_project_state).
+    project : Project
+        The project after running the step.
+
+    Returns
+    -------
+    project_changes : list
+        The changes as tuples of (attribute_name, keys, value).
+        If keys is empty, the whole attribute is replaced,
+        if value is DELETED, the key is removed.
+    """
+    project_changes = list()
+    for attr_name, old_value in before.items():
+        new_value = getattr(project, attr_name)
+        if isinstance(new_value, dict) and isinstance(old_value, dict):
+            for keys, value in _get_changes(old_value, new_value):
+                project_changes.append((attr_name, keys, value))
+        elif new_value != old_value:
+            project_changes.append((attr_name, (), new_value))
+
+    return project_changes
+
+
+def apply_project_changes(project, project_changes):
+    """Apply the changes from a worker-process to the project
+    (CAVE: project is changed in place)."""
+    for attr_name, keys, value in project_changes:
+        if len(keys) == 0:
+            setattr(project, attr_name, value)
+            continue
+        attribute = getattr(project, attr_name)
+        if value is DELETED:
+            for key in keys[:-1]:
+                attribute = attribute.get(key)
+                if not isinstance(attribute, dict):
+                    attribute = dict()
+            attribute.pop(keys[-1], None)
+            continue
+        for key in keys[:-1]:
+            if not isinstance(attribute.get(key), dict):
+                attribute[key] = dict()
+            attribute = attribute[key]
+        attribute[keys[-1]] = value
+
+
+def get_error_result(error):
+    """Convert an exception raised by the pool
+    (e.g. when pickling fails) into a StepResult"""
+    traceback_str = "".join(
+        traceback.format_exception(type(error), error, error.__traceback__)
+    )
+    logging.error(f"{type(error)}: {error}")
+
+    return StepResult(ExceptionTuple(type(error), error, traceback_str), list())
@@ -11,11 +11,12 @@ import logging
 import multiprocessing
 import os
 import sys
+import traceback
 from ast import literal_eval
 from copy import deepcopy
 from datetime import datetime
 from importlib import resources
-from os.path import join, isfile
+from os.path import isfile, join
 from pathlib import Path
 
 import numpy as np
@@ -40,6 +41,35 @@ def get_n_jobs(n_jobs):
     return n_cores
 
 
+class ExceptionTuple(object):
+    def __init__(self, *args):
+        self._data = [*args]
+
+    def __getitem__(self, idx):
+        return self._data[idx]
+
+    def __setitem__(self, idx, value):
+        self._data[idx] = value
+
+    def __str__(self):
+        return self._data[2]
+
+
+def get_exception_tuple(is_mp=False):
+    traceback.print_exc()
+    exctype, value = sys.exc_info()[:2]
+    traceback_str = traceback.format_exc(limit=-10)
+    # ToDo: Is this doing what it's supposed to do?
+    if is_mp:
+        logger = multiprocessing.get_logger()
+    else:
+        logger = logging.getLogger()
+    logger.error(f"{exctype}: {value}")
+    exc_tuple = ExceptionTuple(exctype, value, traceback_str)
+
+    return exc_tuple
+
+
 def encode_tuples(input_dict):
     """Encode tuples in a dictionary, because JSON does not recognize them
     (CAVE: input_dict is changed in place)"""
@@ -170,6 +200,94 @@ def compare_filep(obj, path, target_parameters=None, verbose=True):
     return result_dict
 
 
+def get_saved_paths(path):
+    """Get the existing files for a path from io_dict
+    (source-estimates are saved with an appendix for each hemisphere)"""
+    if isfile(path):
+        return [path]
+    elif isfile(path + "-lh.stc"):
+        return [path + "-lh.stc", path + "-rh.stc"]
+    else:
+        return list()
+
+
+def get_fingerprint(path):
+    """Get a fingerprint (size, modification-time) of a file
+    to recognize changes (None if the file doesn't exist)"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def get_critical_params(pd_funcs, func_name):
+    """Get the parameters which are crucial for the outcome of a function
+    (from the func_args-column of the functions)"""
+    try:
+        critical_params_str = pd_funcs.loc[func_name, "func_args"]
+    except KeyError:
+        return list()
+    if not isinstance(critical_params_str, str):
+        return list()
+
+    return [p for p in critical_params_str.replace(" ", "").split(",") if p != ""]
+
+
+def check_up_to_date(obj, func_name, data_types):
+    """Check if the outputs of a function are up to date, which means
+    the parameters and the input-files didn't change since they were saved.
+
+    Parameters
+    ----------
+    obj : MEEG | FSMRI | Group
+        The data-object the function is applied to.
+    func_name : str
+        The name of the function.
+    data_types : set
+        The data-types (from io_dict) possibly saved by the function.
+
+    Returns
+    -------
+    up_to_date : bool
+        True, if all outputs exist and the ones saved by the function
+        were saved with the same parameters from the same inputs.
+    """
+    if obj.ct.get_setting("overwrite"):
+        return False
+    critical_params = get_critical_params(obj.ct.pd_funcs, func_name)
+    n_outputs = 0
+    for data_type in [dt for dt in data_types if dt in obj.io_dict]:
+        # Paths are None if the data-type doesn't apply (e.g. no erm)
+        paths = [p for p in obj._return_path_list(data_type) or list() if p]
+        for path in paths:
+            saved_paths = get_saved_paths(path)
+            if len(saved_paths) == 0:
+                return False
+            for saved_path in saved_paths:
+                file_params = obj.file_parameters.get(Path(saved_path).name)
+                # Files saved by other functions (e.g. the inputs) are ignored
+                if file_params is None or file_params.get("FUNCTION") != func_name:
+                    continue
+                # Without recorded inputs the output can't be verified
+                if "INPUTS" not in file_params:
+                    return False
+                if file_params.get("SIZE") != os.path.getsize(saved_path):
+                    return False
+                for param in [p for p in critical_params if p in obj.pa]:
+                    if param not in file_params:
+                        return False
+                    if str(file_params[param]) != str(obj.pa[param]):
+                        return False
+                for input_path, fingerprint in file_params["INPUTS"].items():
+                    if get_fingerprint(input_path) != list(fingerprint):
+                        return False
+                n_outputs += 1
+
+    return n_outputs > 0
+
+
 def check_kwargs(kwargs, function):
     kwargs = kwargs.copy()
 
@@ -257,15 +375,31 @@ class QSettingsDummy(BaseSettings):
         self.settings_path = join(Path.home(), ".mnephd_settings.json")
 
     def _load_settings(self):
-        if isfile(self.settings_path):
+        try:
             with open(self.settings_path, "r") as file:
                 self.settings = json.load(file)
-        else:
+        except (FileNotFoundError, json.JSONDecodeError):
             self.settings = deepcopy(self.default_qsettings)
 
     def _write_settings(self):
-        with open(self.settings_path, "w") as file:
+        # Write to a temporary file first to not leave a corrupted file
+        # when multiple processes write at the same time
+        tmp_path = f"{self.settings_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as file:
             json.dump(self.settings, file)
+        os.replace(tmp_path, self.settings_path)
+
+    def childKeys(self):
+        self._load_settings()
+        return list(self.settings.keys())
+
+    def remove(self, setting):
+        self._load_settings()
+        self.settings.pop(setting, None)
+        self._write_settings()
+
+    def sync(self):
+        pass
 
     def value(self, setting, defaultValue=None):
         self._load_settings()
@@ -283,8 +417,16 @@ class QSettingsDummy(BaseSettings):
         self._write_settings()
 
 
+def _headless():
+    """Check if running without PyQt5 (the environment-variable
+    has to be set before importing this module)"""
+    return os.environ.get("MNEPHD_HEADLESS") == "True"
+
+
 # Import QSettings or provide Dummy-Class to be independent from PyQt/PySide
 try:
+    if _headless():
+        raise ImportError("PyQt5 is not used in headless-mode")
     from PyQt5.QtCore import QSettings
 
     class ModQSettings(QSettings, BaseSettings):
@@ -7,8 +7,6 @@ Github: https://github.com/marsipu/mne-pipeline-hd
 
 import functools
 
-from mne_pipeline_hd.gui.plot_widgets import show_plot_manager
-
 
 def pipeline_plot(plot_func):
     @functools.wraps(plot_func)
@@ -25,6 +23,9 @@ def pipeline_plot(plot_func):
         if use_plot_manager and plot is not None:
             if not isinstance(plot, list):
                 plot = [plot]
+            # Imported here to run plot-functions without PyQt5 in headless-mode
+            from mne_pipeline_hd.gui.plot_widgets import show_plot_manager
+
             plot_manager = show_plot_manager()
             plot_manager.add_plot(plot, obj.name, plot_func.__name__)
 
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Authors: Martin Schulz <dev@mgschulz.de>
+License: BSD 3-Clause
+Github: https://github.com/marsipu/mne-pipeline-hd
+"""
+
+import logging
+import multiprocessing
+import os
+from contextlib import contextmanager
+
+import psutil
+
+from mne_pipeline_hd.pipeline.pipeline_utils import QS, get_n_jobs
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+
+def get_available_cores():
+    """Get the number of CPU-cores available for this process
+    (respects restrictions of the CPU-affinity e.g. on cluster-nodes)"""
+    try:
+        n_cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        n_cores = multiprocessing.cpu_count()
+
+    return n_cores
+
+
+@contextmanager
+def limit_threads(n_threads):
+    """Limit the threads of BLAS/OpenMP-libraries while running a step.
+
+    Parameters
+    ----------
+    n_threads : int | None
+        The maximum number of threads. If None, nothing is limited.
+    """
+    if n_threads is None or threadpool_limits is None:
+        yield
+    else:
+        with threadpool_limits(limits=n_threads):
+            yield
+
+
+class CPUBudget:
+    """Split the CPU-cores among the steps running at the same time.
+
+    Parameters
+    ----------
+    n_workers : int
+        The number of steps running at the same time.
+    n_jobs : int | str | None
+        The total number of cores to use for the pipeline
+        (-1 for all available cores). If None, the QSetting "n_jobs" is used.
+    """
+
+    def __init__(self, n_workers, n_jobs=None):
+        self.n_workers = max(int(n_workers), 1)
+        if n_jobs is None:
+            n_jobs = QS().value("n_jobs", defaultValue=-1)
+        self.n_cores = get_available_cores()
+        if n_jobs == -1 or n_jobs in ["auto", "max"]:
+            self.n_total = self.n_cores
+        else:
+            self.n_total = get_n_jobs(n_jobs)
+        self.n_per_worker = max(self.n_total // self.n_workers, 1)
+
+        self.check_oversubscription()
+
+    def check_oversubscription(self):
+        """Report, if more threads would run than cores are available.
+
+        Returns
+        -------
+        oversubscribed : bool
+            True, if the cores are oversubscribed.
+        """
+        n_threads = self.n_per_worker * self.n_workers
+        oversubscribed = n_threads > self.n_cores
+        if oversubscribed:
+            logging.warning(
+                f"{self.n_workers} parallel steps with {self.n_per_worker} "
+                f"jobs each would use {n_threads} threads, "
+                f"but only {self.n_cores} cores are available."
+            )
+
+        return oversubscribed
+
+    def get_n_jobs(self, n_jobs):
+        """Get the n_jobs for a single step within its share of the cores.
+
+        Parameters
+        ----------
+        n_jobs : int | str | None
+            The n_jobs requested for the step.
+
+        Returns
+        -------
+        n_jobs : int | str | None
+            The n_jobs limited to the share of the step.
+            Values other than numbers (e.g. "cuda") are returned unchanged.
+        """
+        if n_jobs is None or n_jobs == -1 or n_jobs in ["auto", "max"]:
+            return self.n_per_worker
+        try:
+            requested = int(n_jobs)
+        except (TypeError, ValueError):
+            return n_jobs
+        if requested > self.n_per_worker:
+            logging.debug(
+                f"n_jobs={requested} is reduced to {self.n_per_worker} "
+                f"for {self.n_workers} parallel steps."
+            )
+
+        return min(requested, self.n_per_worker)
+
+
+def reset_peak_memory():
+    """Reset the peak-memory of this process to the current memory
+    (only supported on Linux)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        return False
+
+    return True
+
+
+def get_peak_memory():
+    """Get the peak-memory (in bytes) of this process
+    (since the last call of reset_peak_memory on Linux)."""
+    try:
+        with open("/proc/self/status", "r") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    memory_info = psutil.Process().memory_info()
+
+    # peak_wset only exists on Windows
+    return getattr(memory_info, "peak_wset", memory_info.rss)
+
+
+def get_current_memory():
+    """Get the current memory (in bytes) of this process."""
+    return psutil.Process().memory_info().rss
+
+
+class MemoryBudget:
+    """Admit steps to run at the same time only,
+    if their estimated memory fits into the RAM-budget.
+
+    Parameters
+    ----------
+    ram_budget : float | None
+        The memory in GB available for the steps running at the same time.
+        0 means 80 % of the available memory. If None,
+        the QSetting "ram_budget" is used.
+    """
+
+    def __init__(self, ram_budget=None):
+        if ram_budget is None:
+            ram_budget = QS().value("ram_budget", defaultValue=0)
+        if not ram_budget:
+            self.budget = int(psutil.virtual_memory().available * 0.8)
+        else:
+            self.budget = int(float(ram_budget) * 1024**3)
+        # The estimated memory of the running steps
+        self.reserved = dict()
+
+    def fits(self, estimate):
+        """Check if a step with the estimated memory (in bytes) fits
+        into the budget. A step always fits, if no other step is running,
+        so steps exceeding the budget run alone."""
+        if len(self.reserved) == 0:
+            return True
+
+        return sum(self.reserved.values()) + estimate <= self.budget
+
+    def reserve(self, step, estimate):
+        if estimate > self.budget:
+            logging.warning(
+                f"{step[1]} for {step[0]} needs an estimated "
+                f"{estimate / 1024**3:.1f} GB, which exceeds the RAM-budget "
+                f"of {self.budget / 1024**3:.1f} GB, it is run alone."
+            )
+        self.reserved[step] = estimate
+
+    def release(self, step):
+        self.reserved.pop(step, None)
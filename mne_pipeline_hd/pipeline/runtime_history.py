@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Authors: Martin Schulz <dev@mgschulz.de>
+License: BSD 3-Clause
+Github: https://github.com/marsipu/mne-pipeline-hd
+"""
+
+import json
+from os.path import getsize, isfile, join
+
+import numpy as np
+import pandas as pd
+
+# The number of runtimes kept for each function
+max_entries = 100
+
+
+def get_object_size(pr, obj_name, obj_type):
+    """Get the size of an object (in bytes) to scale the runtime
+    of its functions (the size of the raw-data)."""
+    if obj_type == "MEEG":
+        raw_path = join(pr.data_path, obj_name, f"{obj_name}-raw.fif")
+        if isfile(raw_path):
+            return getsize(raw_path)
+    elif obj_type == "Group":
+        return sum(
+            [
+                get_object_size(pr, meeg_name, "MEEG")
+                for meeg_name in pr.all_groups.get(obj_name, list())
+            ]
+        )
+
+    return 0
+
+
+class RuntimeHistory:
+    """The runtimes of the functions from previous runs of a project,
+    which are used to predict the runtime of steps.
+
+    Parameters
+    ----------
+    pr : Project
+        The project, for which the runtimes are stored.
+    """
+
+    kind = "runtime"
+
+    def __init__(self, pr):
+        self.path = join(pr.pscripts_path, f"{self.kind}_history_{pr.name}.json")
+        # Function-names with a list of [object-size, runtime in s]
+        self.history = dict()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as file:
+                self.history = json.load(file)
+        except (json.JSONDecodeError, FileNotFoundError):
+            self.history = dict()
+
+    def save(self):
+        with open(self.path, "w") as file:
+            json.dump(self.history, file, indent=4)
+
+    def add(self, func_name, size, runtime):
+        """Add the runtime of a function for an object of size."""
+        entries = self.history.setdefault(func_name, list())
+        entries.append([size, runtime])
+        del entries[:-max_entries]
+
+    def predict(self, func_name, size):
+        """Predict the runtime of a function for an object of size.
+
+        Parameters
+        ----------
+        func_name : str
+            The name of the function.
+        size : int
+            The size of the object (see get_object_size).
+
+        Returns
+        -------
+        runtime : float | None
+            The predicted runtime in seconds or None,
+            if the function has not been run yet.
+        """
+        entries = self.history.get(func_name)
+        if not entries:
+            return None
+        sized_entries = [e for e in entries if e[0] > 0]
+        # Scale the runtime linearly with the size of the object
+        if size > 0 and len(sized_entries) > 0:
+            rate = np.median([runtime / sz for sz, runtime in sized_entries])
+            return float(rate * size)
+
+        return float(np.median([runtime for sz, runtime in entries]))
+
+    def default_runtime(self):
+        """The runtime assumed for functions without history."""
+        medians = [
+            np.median([runtime for sz, runtime in entries])
+            for entries in self.history.values()
+            if len(entries) > 0
+        ]
+        if len(medians) == 0:
+            return 1.0
+
+        return float(np.median(medians))
+
+    def get_summary(self):
+        """Get a summary of the runtimes for each function.
+
+        Returns
+        -------
+        summary : pandas.DataFrame
+            The number of runs and the median, maximum and last runtime
+            (in seconds) for each function.
+        """
+        summary = pd.DataFrame(
+            columns=["runs", "median [s]", "max [s]", "last [s]"], dtype=float
+        )
+        for func_name, entries in self.history.items():
+            if len(entries) == 0:
+                continue
+            runtimes = [runtime for sz, runtime in entries]
+            summary.loc[func_name] = [
+                len(runtimes),
+                round(float(np.median(runtimes)), 2),
+                round(max(runtimes), 2),
+                round(runtimes[-1], 2),
+            ]
+
+        return summary
+
+
+class MemoryHistory(RuntimeHistory):
+    """The peak-memory of the functions from previous runs of a project
+    in relation to the size of their inputs (in bytes), which is used
+    to predict the memory needed by a step.
+
+    Parameters
+    ----------
+    pr : Project
+        The project, for which the memory-usage is stored.
+    """
+
+    kind = "memory"
+
+    # The memory assumed per byte of input for functions without history
+    default_factor = 3
+
+    def predict(self, func_name, size):
+        memory = super().predict(func_name, size)
+        if memory is None:
+            memory = self.default_factor * size
+
+        return memory
@@ -0,0 +1,547 @@
+# -*- coding: utf-8 -*-
+"""
+Authors: Martin Schulz <dev@mgschulz.de>
+License: BSD 3-Clause
+Github: https://github.com/marsipu/mne-pipeline-hd
+"""
+
+import ast
+import inspect
+import logging
+import re
+import textwrap
+from ast import literal_eval
+from collections import OrderedDict
+from importlib import import_module
+
+import pandas as pd
+
+# Loading-/Saving-methods which are not in io_dict,
+# but read/write data of a data-type
+io_aliases = {
+    "load_info": "raw",
+    "save_erm_link": "erm_filtered",
+    "save_forward_link": "forward",
+}
+
+# Methods of the data-objects, which return (possibly cached) data of a data-type
+io_getters = {
+    "get_labels": "labels",
+    "get_source_morph": "morph",
+    "get_prepared_inverse": "inverse",
+    "get_label_index": "src",
+}
+
+# Names of the variables used for the data-objects in the pipeline-functions
+obj_arg_names = {"MEEG": "meeg", "FSMRI": "fsmri", "Group": "group"}
+
+load_save_pattern = re.compile(r"^(load|save)_(\w+)$")
+# Keywords of load-methods, which read only a subset of the data
+subset_keywords = ["picks", "tmin", "tmax"]
+
+
+def get_io_map(obj):
+    """Get a mapping of the names of the load-/save-methods
+    to the data-types in io_dict of a data-object.
+
+    Parameters
+    ----------
+    obj : MEEG | FSMRI | Group | None
+        A Data-Object to get the io_dict from.
+
+    Returns
+    -------
+    io_map : dict
+        A dictionary with the method-names as keys
+        and the data-types as values.
+    """
+    io_map = dict()
+    if obj is None or getattr(obj, "name", None) is None:
+        return io_map
+    for data_type, io in obj.io_dict.items():
+        for method in ["load", "save"]:
+            method_name = getattr(io[method], "__name__", None)
+            if method_name is not None:
+                io_map[method_name] = data_type
+
+    return io_map
+
+
+def _get_func_ast(func):
+    try:
+        source = textwrap.dedent(inspect.getsource(func))
+        return ast.parse(source)
+    except (OSError, TypeError, SyntaxError):
+        logging.warning(f"Source of {func.__name__} could not be parsed!")
+        return None
+
+
+def _get_receiver(node):
+    """Get the name of the object and if it is the associated FSMRI
+    (e.g. meeg.fsmri.load_source_space())"""
+    if isinstance(node, ast.Name):
+        return node.id, False
+    elif (
+        isinstance(node, ast.Attribute)
+        and node.attr == "fsmri"
+        and isinstance(node.value, ast.Name)
+    ):
+        return node.value.id, True
+
+    return None, False
+
+
+def _get_role(receiver, is_fsmri, target):
+    """Get the role of the receiver relative to the target of the function:
+    self, fsmri (the associated FSMRI) or members (the MEEG of a Group)"""
+    if receiver is None:
+        return None
+    if is_fsmri or (receiver == "fsmri" and target != "FSMRI"):
+        return "fsmri"
+    if receiver == obj_arg_names.get(target):
+        return "self"
+    if receiver == "meeg" and target == "Group":
+        return "members"
+
+    return None
+
+
+def _resolve_arg(node, parameters):
+    """Resolve an argument, which is either a string
+    or the name of a parameter"""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    elif isinstance(node, ast.Name):
+        value = parameters.get(node.id)
+        if isinstance(value, str):
+            return value
+
+    return None
+
+
+def get_func_io(func, target, parameters, io_maps, _visited=None):
+    """Get the data-types a function loads and saves.
+
+    The data-types are inferred from the calls of load-/save-methods
+    of the data-objects in the source-code of the function
+    and of the functions of the same module it passes the data-object to.
+
+    Parameters
+    ----------
+    func : function
+        The pipeline-function.
+    target : str
+        The target of the function (MEEG, FSMRI, Group or Other).
+    parameters : dict
+        The parameters of the current Parameter-Preset, which are used to
+        resolve data-types given as parameters (e.g. filter_target).
+    io_maps : dict
+        The mappings from get_io_map for each object-type.
+
+    Returns
+    -------
+    func_io : dict
+        A dictionary with the roles (self, fsmri, members) as keys and
+        a dictionary with the sets for "load" and "save" as values.
+        The set for "subset" contains the loaded data-types, of which only
+        a subset is read (e.g. meeg.load_raw(picks="stim")).
+    """
+    func_io = {
+        role: {"load": set(), "save": set(), "subset": set()}
+        for role in ["self", "fsmri", "members"]
+    }
+    full_loads = {role: set() for role in func_io}
+    tree = _get_func_ast(func)
+    if tree is None:
+        return func_io
+
+    role_types = {"self": target, "fsmri": "FSMRI", "members": "MEEG"}
+    if _visited is None:
+        _visited = set()
+    _visited.add(func)
+
+    def _add(role, method, data_type):
+        if role is not None and data_type is not None:
+            func_io[role][method].add(data_type)
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+            attr = node.func.attr
+            receiver, is_fsmri = _get_receiver(node.func.value)
+            role = _get_role(receiver, is_fsmri, target)
+            if role is None:
+                continue
+            io_map = io_maps.get(role_types[role], dict())
+            match = load_save_pattern.match(attr)
+            # e.g. meeg.load_filtered()
+            if match:
+                method, name = match.groups()
+                data_type = io_map.get(attr, io_aliases.get(attr, name))
+                _add(role, method, data_type)
+                if method == "load":
+                    is_subset = attr in io_aliases or any(
+                        [kw.arg in subset_keywords for kw in node.keywords]
+                    )
+                    if is_subset:
+                        _add(role, "subset", data_type)
+                    elif data_type is not None:
+                        full_loads[role].add(data_type)
+            # e.g. meeg.load("raw")
+            elif attr in ["load", "save"] and len(node.args) > 0:
+                _add(role, attr, _resolve_arg(node.args[0], parameters))
+            # e.g. fsmri.get_labels(target_labels)
+            elif attr in io_getters:
+                _add(role, "load", io_getters[attr])
+
+        # e.g. label_kernel_time_course(meeg, ...)
+        elif (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Name)
+            and any(
+                [
+                    isinstance(arg, ast.Name) and arg.id == obj_arg_names.get(target)
+                    for arg in node.args
+                ]
+            )
+        ):
+            called_func = getattr(func, "__globals__", dict()).get(node.func.id)
+            if (
+                inspect.isfunction(called_func)
+                and called_func.__module__ == func.__module__
+                and called_func not in _visited
+            ):
+                called_io = get_func_io(
+                    called_func, target, parameters, io_maps, _visited
+                )
+                for role in func_io:
+                    for method in func_io[role]:
+                        func_io[role][method] |= called_io[role][method]
+                    full_loads[role] |= (
+                        called_io[role]["load"] - called_io[role]["subset"]
+                    )
+
+        # e.g. meeg.io_dict[filter_target]["load"]
+        elif (
+            isinstance(node, ast.Subscript)
+            and isinstance(node.value, ast.Subscript)
+            and isinstance(node.value.value, ast.Attribute)
+            and node.value.value.attr == "io_dict"
+        ):
+            receiver, is_fsmri = _get_receiver(node.value.value.value)
+            role = _get_role(receiver, is_fsmri, target)
+            method = _resolve_arg(node.slice, dict())
+            if method in ["load", "save"]:
+                data_type = _resolve_arg(node.value.slice, parameters)
+                _add(role, method, data_type)
+                if method == "load" and data_type is not None:
+                    full_loads[role].add(data_type)
+
+    # Data-types, which are also loaded completely
+    for role in func_io:
+        func_io[role]["subset"] -= full_loads[role]
+
+    return func_io
+
+
+def get_declared_dependencies(pd_funcs, func_name):
+    """Get the dependencies declared in the dependencies-column
+    of functions.csv (e.g. "['filter_data']")."""
+    if "dependencies" not in pd_funcs.columns:
+        return list()
+    value = pd_funcs.loc[func_name, "dependencies"]
+    if pd.isna(value) or value == "":
+        return list()
+    try:
+        dependencies = literal_eval(str(value))
+    except (SyntaxError, ValueError):
+        # Allow also comma-separated function-names
+        dependencies = [d.strip() for d in str(value).split(",")]
+    if isinstance(dependencies, str):
+        dependencies = [dependencies]
+
+    return [d for d in dependencies if d]
+
+
+class StepGraph:
+    """A directed acyclic graph of pipeline-steps (object-name, function-name).
+
+    Steps become ready, when all the steps they depend on are finished.
+    Ready steps are returned in the order of their priority
+    (by default the order in which they were added).
+    """
+
+    def __init__(self, steps=None):
+        self.steps = list()
+        self.parents = OrderedDict()
+        self.children = OrderedDict()
+        self.priorities = dict()
+        # Step-States:
+        # 0 = Finished
+        # 1 = Pending
+        # 2 = Currently Running
+        self.states = dict()
+        # The data-types each function loads and saves (from build_step_graph)
+        self.func_ios = dict()
+        for step in steps or list():
+            self.add_step(step)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __contains__(self, step):
+        return step in self.parents
+
+    def add_step(self, step):
+        if step in self.parents:
+            return
+        self.steps.append(step)
+        self.parents[step] = set()
+        self.children[step] = set()
+        self.priorities[step] = -len(self.steps)
+        self.states[step] = 1
+
+    def add_dependency(self, step, dependency):
+        """Let step depend on dependency"""
+        if step == dependency:
+            return
+        self.parents[step].add(dependency)
+        self.children[dependency].add(step)
+
+    def topological_order(self):
+        """Get the steps ordered so that each step comes after
+        its dependencies (raises a RuntimeError for cyclic dependencies)."""
+        in_degree = {step: len(self.parents[step]) for step in self.steps}
+        queue = [step for step in self.steps if in_degree[step] == 0]
+        order = list()
+        while len(queue) > 0:
+            step = queue.pop()
+            order.append(step)
+            for child in self.children[step]:
+                in_degree[child] -= 1
+                if in_degree[child] == 0:
+                    queue.append(child)
+        if len(order) != len(self.steps):
+            cyclic = [step for step in self.steps if in_degree[step] > 0]
+            raise RuntimeError(f"Cyclic dependencies between steps: {cyclic}")
+
+        return order
+
+    def check_cycles(self):
+        """Raise a RuntimeError if there are cyclic dependencies."""
+        self.topological_order()
+
+    def set_critical_path_priorities(self, costs):
+        """Prioritize the steps by the cost of the longest chain of steps
+        depending on them (including themselves), so that the longest
+        chains are started first.
+
+        Parameters
+        ----------
+        costs : dict
+            The predicted cost (e.g. the runtime) of each step.
+        """
+        path_costs = dict()
+        for step in reversed(self.topological_order()):
+            child_costs = [path_costs[child] for child in self.children[step]]
+            path_costs[step] = costs.get(step, 0) + max(child_costs, default=0)
+        self.priorities.update(path_costs)
+
+    def is_ready(self, step):
+        return self.states[step] == 1 and all(
+            [self.states[p] == 0 for p in self.parents[step]]
+        )
+
+    def ready_steps(self):
+        """Get all steps which are pending and whose dependencies are
+        finished, sorted by priority (highest first)."""
+        ready = [step for step in self.steps if self.is_ready(step)]
+        ready.sort(key=lambda s: self.priorities[s], reverse=True)
+
+        return ready
+
+    def running_steps(self):
+        return [step for step in self.steps if self.states[step] == 2]
+
+    def pending_steps(self):
+        return [step for step in self.steps if self.states[step] == 1]
+
+    def mark_running(self, step):
+        self.states[step] = 2
+
+    def mark_finished(self, step):
+        self.states[step] = 0
+
+    def mark_pending(self, step):
+        self.states[step] = 1
+
+    def is_finished(self):
+        return all([state == 0 for state in self.states.values()])
+
+
+def build_step_graph(controller, all_steps, all_objects, objects=None):
+    """Build the dependency-graph for the steps of a pipeline-run.
+
+    A step depends on another step, if it is declared
+    in the dependencies-column of the functions
+    or if they access the same data-types (from io_dict) and
+    the order of both steps matters (read after write, write after read
+    and write after write). Data-types of the associated FSMRI and
+    of the MEEG-members of a Group are considered too, as well as
+    steps of different objects saving to the same FSMRI.
+
+    Parameters
+    ----------
+    controller : Controller
+        The controller of the current session.
+    all_steps : list of tuple
+        All steps (object-name, function-name) in their serial order.
+    all_objects : dict
+        The objects of the run with their type (as in RunController).
+    objects : dict | None
+        Representative data-objects for each object-type to get the
+        data-types from their io_dict.
+
+    Returns
+    -------
+    graph : StepGraph
+        The dependency-graph.
+    """
+    pr = controller.pr
+    pd_funcs = controller.pd_funcs
+    parameters = pr.parameters[pr.p_preset]
+    io_maps = {
+        obj_type: get_io_map(obj) for obj_type, obj in (objects or dict()).items()
+    }
+
+    graph = StepGraph(all_steps)
+
+    # Get the inputs and outputs of each function
+    func_ios = dict()
+    for func_name in set([step[1] for step in all_steps]):
+        target = pd_funcs.loc[func_name, "target"]
+        try:
+            module = import_module(pd_funcs.loc[func_name, "module"])
+            func = getattr(module, func_name)
+        except (ImportError, AttributeError, KeyError):
+            logging.warning(f"{func_name} could not be imported for scheduling!")
+            func_io = None
+        else:
+            func_io = get_func_io(func, target, parameters, io_maps)
+            # Every function, which saves something also writes
+            # to the file-parameters of the object
+            for role in ["self", "fsmri"]:
+                if len(func_io[role]["save"]) > 0:
+                    func_io[role]["save"].add("file_parameters")
+        func_ios[func_name] = func_io
+    graph.func_ios = func_ios
+
+    def _related_objects(obj_name, obj_type, role):
+        if role == "self":
+            return [obj_name]
+        elif role == "fsmri":
+            if obj_type == "MEEG":
+                return [pr.meeg_to_fsmri.get(obj_name)]
+            elif obj_type == "Group":
+                return [parameters.get("morph_to")]
+        elif role == "members" and obj_type == "Group":
+            return pr.all_groups.get(obj_name, list())
+
+        return list()
+
+    def _fsmri_saves(obj_name, func_io):
+        """Get the data-types a step saves to each FSMRI."""
+        obj_type = all_objects[obj_name]["type"]
+        if obj_type == "FSMRI":
+            return {obj_name: func_io["self"]["save"]}
+        return {
+            fsmri_name: func_io["fsmri"]["save"]
+            for fsmri_name in _related_objects(obj_name, obj_type, "fsmri")
+            if fsmri_name is not None
+        }
+
+    # Steps ordered by object
+    obj_steps = OrderedDict()
+    for step in all_steps:
+        obj_steps.setdefault(step[0], list()).append(step)
+
+    barriers = list()
+    for idx, step in enumerate(all_steps):
+        obj_name, func_name = step
+        obj_type = all_objects[obj_name]["type"]
+        func_io = func_ios[func_name]
+
+        # Functions for "Other" and functions, which can't be analyzed,
+        # are treated as barriers (wait for all preceding steps)
+        if obj_type == "Other" or func_io is None:
+            for prev_step in all_steps[:idx]:
+                graph.add_dependency(step, prev_step)
+            barriers.append(step)
+            continue
+
+        # Wait for barriers, which come before
+        for barrier in barriers:
+            graph.add_dependency(step, barrier)
+
+        # Declared dependencies
+        for dependency in get_declared_dependencies(pd_funcs, func_name):
+            if dependency not in pd_funcs.index:
+                continue
+            dpd_type = pd_funcs.loc[dependency, "target"]
+            if dpd_type == obj_type:
+                dpd_objs = [obj_name]
+            elif dpd_type == "FSMRI":
+                dpd_objs = _related_objects(obj_name, obj_type, "fsmri")
+            elif dpd_type == "MEEG" and obj_type == "Group":
+                dpd_objs = _related_objects(obj_name, obj_type, "members")
+            else:
+                dpd_objs = list(obj_steps.keys())
+            for dpd_obj in dpd_objs:
+                if (dpd_obj, dependency) in graph:
+                    graph.add_dependency(step, (dpd_obj, dependency))
+
+        # Dependencies from data-types (also of the associated FSMRI)
+        for prev_step in obj_steps[obj_name]:
+            if prev_step == step:
+                break
+            prev_io = func_ios[prev_step[1]]
+            if prev_io is None:
+                continue
+            for role in ["self", "fsmri"]:
+                loads = func_io[role]["load"]
+                saves = func_io[role]["save"]
+                prev_loads = prev_io[role]["load"]
+                prev_saves = prev_io[role]["save"]
+                # Read after write, write after write and write after read
+                if loads & prev_saves or saves & prev_saves or saves & prev_loads:
+                    graph.add_dependency(step, prev_step)
+                    break
+
+        # Dependencies on data of other objects
+        for role in ["fsmri", "members"]:
+            role_loads = func_io[role]["load"]
+            if len(role_loads) == 0:
+                continue
+            for other_obj in _related_objects(obj_name, obj_type, role):
+                for other_step in obj_steps.get(other_obj, list()):
+                    other_io = func_ios[other_step[1]]
+                    if other_io is None or role_loads & other_io["self"]["save"]:
+                        graph.add_dependency(step, other_step)
+
+        # Write after write to a FSMRI shared with other objects
+        # (e.g. the source-morph is only computed by the first MEEG-file)
+        fsmri_saves = _fsmri_saves(obj_name, func_io)
+        if any(len(saves) > 0 for saves in fsmri_saves.values()):
+            for prev_step in all_steps[:idx]:
+                prev_io = func_ios[prev_step[1]]
+                if prev_step[0] == obj_name or prev_io is None:
+                    continue
+                prev_fsmri_saves = _fsmri_saves(prev_step[0], prev_io)
+                if any(
+                    saves & prev_fsmri_saves.get(fsmri_name, set())
+                    for fsmri_name, saves in fsmri_saves.items()
+                ):
+                    graph.add_dependency(step, prev_step)
+
+    graph.check_cycles()
+
+    return graph
@@ -4,8 +4,35 @@ Authors: Martin Schulz <dev@mgschulz.de>
 License: BSD 3-Clause
 Github: https://github.com/marsipu/mne-pipeline-hd
 """
+import os
+from pathlib import Path
+
+import mne
+import mne_connectivity
+import numpy as np
+import pytest
+from mne.bem import _surfaces_to_bem
+from mne.io.constants import FIFF
+from mne.surface import _get_ico_surface
+from scipy import sparse
+
+from mne_pipeline_hd.functions.operations import (
+    _apply_label_kernel,
+    _decode_binary_events,
+    _filter_raw_blocks,
+    _make_label_kernel,
+    _morph_stcs,
+    create_forward_solution,
+    filter_data,
+    label_time_course,
+    morph_fsmri,
+    source_estimate,
+    src_connectivity,
+)
+from mne_pipeline_hd.pipeline.function_utils import RunController
+from mne_pipeline_hd.pipeline.loading import FSMRI, MEEG, get_fsmri
+
 # from mne_pipeline_hd.pipeline.function_utils import RunController
-# from mne_pipeline_hd.pipeline.loading import MEEG
 #
 #
 # def test_all_functions(controller):
@@ -31,3 +58,523 @@ Github: https://github.com/marsipu/mne-pipeline-hd
 #     meeg = MEEG('_sample_', controller)
 #     epochs = meeg.load_epochs()
 #     assert epochs.data.shape[1] == 37
+
+
+def test_decode_binary_events():
+    channel_onsets = [
+        np.array([100, 500, 900]),
+        np.array([101, 899]),
+        np.array([], dtype=int),
+        np.array([100, 700, 701]),
+        np.array([]),
+        np.array([500]),
+    ]
+    events = _decode_binary_events(channel_onsets)
+    assert events.tolist() == [
+        [100, 0, 1 + 2 + 8],
+        [500, 0, 1 + 32],
+        [701, 0, 8],
+        [899, 0, 1 + 2],
+    ]
+
+
+@pytest.mark.parametrize("method", ["fir", "iir"])
+def test_filter_raw_blocks(tmp_path, method):
+    info = mne.create_info(
+        ["EEG 001", "EEG 002", "STI 001"], 200, ["eeg"] * 2 + ["stim"]
+    )
+    data = np.random.default_rng(42).standard_normal((3, 200 * 120))
+    raw = mne.io.RawArray(data, info, first_samp=100)
+    raw.set_annotations(mne.Annotations([30, 50], [0, 5], ["edge", "bad_acq_skip"]))
+    raw_path = tmp_path / "test-raw.fif"
+    raw.save(raw_path)
+
+    filter_kwargs = dict(
+        filter_length="auto",
+        l_trans_bandwidth="auto",
+        h_trans_bandwidth="auto",
+        method=method,
+        iir_params=None,
+        phase="zero",
+        fir_window="hamming",
+        fir_design="firwin",
+        pad="reflect_limited",
+    )
+    skip = ["edge", "bad_acq_skip"]
+    raw_mem = mne.io.read_raw_fif(raw_path, preload=True)
+    raw_mem.filter(1, 40, skip_by_annotation=skip, **filter_kwargs)
+    raw_blocks = _filter_raw_blocks(
+        mne.io.read_raw_fif(raw_path),
+        10,
+        skip,
+        l_freq=1,
+        h_freq=40,
+        n_jobs=None,
+        **filter_kwargs,
+    )
+    assert isinstance(raw_blocks._data, np.memmap)
+    assert raw_blocks.info["highpass"] == raw_mem.info["highpass"]
+    assert raw_blocks.info["lowpass"] == raw_mem.info["lowpass"]
+    assert raw_blocks.first_samp == raw_mem.first_samp
+    np.testing.assert_allclose(
+        raw_blocks.get_data(), raw_mem.get_data(), rtol=0, atol=1e-10
+    )
+
+
+def test_erm_shared(controller):
+    info = mne.create_info(["EEG 001", "EEG 002"], 100, "eeg")
+    data = np.random.default_rng(42).standard_normal((2, 6000))
+    controller.pr.add_meeg("erm", is_erm=True).save_raw(mne.io.RawArray(data, info))
+    meegs = list()
+    for name in ["meeg1", "meeg2"]:
+        controller.pr.add_meeg(name).save_raw(mne.io.RawArray(data, info))
+        controller.pr.meeg_to_erm[name] = "erm"
+        meegs.append(MEEG(name, controller))
+
+    kwargs = {
+        p: meegs[0].pa.get(p)
+        for p in controller.pd_funcs.loc["filter_data", "func_args"].split(",")
+        if p != "meeg"
+    }
+    kwargs.update(
+        filter_target="raw", highpass=1, lowpass=40, n_jobs=1, enable_cuda=False
+    )
+    for meeg in meegs:
+        filter_data(meeg, **kwargs)
+
+    # The Empty-Room-Data is only processed once
+    erm_dir = Path(meegs[0].erm_processed_path).parent
+    assert len(list(erm_dir.glob("erm_*-processed-raw.fif"))) == 1
+    assert os.path.samefile(meegs[0].erm_processed_path, meegs[1].erm_processed_path)
+    erm_processed = meegs[1].load_erm_processed()
+    assert erm_processed.info["highpass"] == 1
+
+    # Saving for one MEEG-file doesn't change the shared file
+    erm_processed._data[:] = 0
+    meegs[1].save_erm_processed(erm_processed)
+    assert not os.path.samefile(
+        meegs[0].erm_processed_path, meegs[1].erm_processed_path
+    )
+    assert np.any(meegs[0].load_erm_processed().get_data() != 0)
+
+
+def _make_sphere_fsmri(controller):
+    controller.pr.all_fsmri.append("fsmri")
+    fsmri = get_fsmri("fsmri", controller)
+    os.makedirs(Path(fsmri.bem_solution_path).parent)
+    # A BEM from 3 concentric spheres
+    ico = _get_ico_surface(3)
+    surfs = _surfaces_to_bem(
+        [dict(rr=ico["rr"] * radius, tris=ico["tris"]) for radius in [80, 85, 90]],
+        [
+            FIFF.FIFFV_BEM_SURF_ID_BRAIN,
+            FIFF.FIFFV_BEM_SURF_ID_SKULL,
+            FIFF.FIFFV_BEM_SURF_ID_HEAD,
+        ],
+        [0.3, 0.006, 0.3],
+    )
+    bem = mne.make_bem_solution(surfs)
+    fsmri.save_bem_solution(bem)
+    fsmri.save_source_space(mne.setup_volume_source_space(pos=30.0, bem=bem))
+
+    return fsmri
+
+
+def test_forward_shared(controller):
+    fsmri = _make_sphere_fsmri(controller)
+    info = mne.create_info(["Fz", "Cz", "Pz", "Oz"], 100, "eeg")
+    info.set_montage("standard_1020")
+    meegs = list()
+    for name in ["meeg1", "meeg2", "meeg3"]:
+        meeg = controller.pr.add_meeg(name)
+        controller.pr.meeg_to_fsmri[name] = "fsmri"
+        meeg = MEEG(name, controller)
+        # The last file has a different sensor-geometry
+        if name == "meeg3":
+            info = info.copy()
+            info["chs"][0]["loc"][:3] += 0.01
+        meeg.save_raw(mne.io.RawArray(np.zeros((4, 100)), info))
+        mne.write_trans(meeg.trans_path, mne.transforms.Transform("head", "mri"))
+        create_forward_solution(meeg, n_jobs=1, ch_types=["eeg"])
+        meegs.append(meeg)
+
+    assert len(list(Path(fsmri.save_dir, "bem").glob("fsmri_*-fwd.fif"))) == 2
+    assert os.path.samefile(meegs[0].forward_path, meegs[1].forward_path)
+    assert not os.path.samefile(meegs[0].forward_path, meegs[2].forward_path)
+    assert meegs[1].load_forward()["nsource"] > 0
+
+
+def test_morph_stcs():
+    rng = np.random.default_rng(42)
+    vertices = [np.arange(10), np.arange(8)]
+    vertices_to = [np.arange(12), np.arange(12)]
+    morph = mne.SourceMorph(
+        subject_from="fsmri",
+        subject_to="fsaverage",
+        kind="surface",
+        zooms=None,
+        niter_affine=None,
+        niter_sdr=None,
+        spacing=None,
+        smooth=None,
+        xhemi=False,
+        morph_mat=sparse.random(24, 18, density=0.2, format="csr", random_state=42),
+        vertices_to=vertices_to,
+        shape=None,
+        affine=None,
+        pre_affine=None,
+        sdr_morph=None,
+        src_data=dict(vertices_from=vertices),
+        vol_morph_mat=None,
+    )
+    stcs = {
+        "trial1": mne.SourceEstimate(
+            rng.standard_normal((18, 5)), vertices, 0, 0.01, subject="fsmri"
+        ),
+        "trial2": mne.SourceEstimate(rng.standard_normal((18, 7)), vertices, -1, 0.1),
+        "trial3": mne.VectorSourceEstimate(
+            rng.standard_normal((18, 3, 4)), vertices, 0, 0.01
+        ),
+    }
+    morphed_stcs = _morph_stcs(morph, stcs)
+    assert list(morphed_stcs) == list(stcs)
+    for trial, stc in stcs.items():
+        expected = morph.apply(stc)
+        morphed = morphed_stcs[trial]
+        assert type(morphed) is type(expected)
+        assert morphed.subject == "fsaverage"
+        assert morphed.tmin == expected.tmin
+        assert morphed.tstep == expected.tstep
+        np.testing.assert_allclose(morphed.data, expected.data)
+
+    # Source-estimates with other vertices are rejected by mne
+    with pytest.raises(ValueError, match="vertices do not match"):
+        _morph_stcs(
+            morph,
+            {"trial": mne.SourceEstimate(np.ones((4, 1)), [np.arange(2)] * 2, 0, 1)},
+        )
+
+
+def test_prepared_inverse(controller, data_cache):
+    _make_sphere_fsmri(controller)
+    controller.pr.add_meeg("meeg1")
+    controller.pr.meeg_to_fsmri["meeg1"] = "fsmri"
+    controller.pr.sel_event_id["meeg1"] = ["trial1", "trial2"]
+    meeg = MEEG("meeg1", controller)
+    info = mne.create_info(["Fz", "Cz", "Pz", "Oz", "C3", "C4"], 100, "eeg")
+    info.set_montage("standard_1020")
+    raw = mne.io.RawArray(np.zeros((6, 100)), info)
+    raw.set_eeg_reference(projection=True)
+    meeg.save_raw(raw)
+    mne.write_trans(meeg.trans_path, mne.transforms.Transform("head", "mri"))
+    create_forward_solution(meeg, n_jobs=1, ch_types=["eeg"])
+    inverse_operator = mne.minimum_norm.make_inverse_operator(
+        raw.info, meeg.load_forward(), mne.make_ad_hoc_cov(raw.info)
+    )
+    meeg.save_inverse_operator(inverse_operator)
+    rng = np.random.default_rng(42)
+    evokeds = [
+        mne.EvokedArray(rng.standard_normal((6, 10)), raw.info, nave=10, comment=t)
+        for t in meeg.sel_trials
+    ]
+    meeg.save_evokeds(evokeds)
+
+    # Volume source-estimates aren't saved by the pipeline
+    stcs = dict()
+    meeg.save_source_estimates = stcs.update
+    source_estimate(meeg, "dSPM", None, 1 / 9)
+    for evoked in evokeds:
+        expected = mne.minimum_norm.apply_inverse(
+            evoked, inverse_operator, 1 / 9, method="dSPM"
+        )
+        np.testing.assert_allclose(stcs[evoked.comment].data, expected.data)
+
+    # Both trials share the prepared inverse-operator, which is saved to a file
+    prepared_paths = list(Path(meeg.save_dir).glob("*-prepared-inv.pkl"))
+    assert len(prepared_paths) == 1
+    prepared = meeg.get_prepared_inverse(10, 1 / 9, "dSPM")
+    assert meeg.get_prepared_inverse(10, 1 / 9, "dSPM") is prepared
+    data_cache.clear()
+    assert meeg.get_prepared_inverse(10, 1 / 9, "dSPM")["nave"] == 10
+
+    # A new inverse-operator removes the prepared ones
+    meeg.save_inverse_operator(inverse_operator)
+    assert not prepared_paths[0].is_file()
+
+
+def _make_surface_src(subjects_dir):
+    # A surface source-space from two spheres (inside the spherical BEM)
+    os.makedirs(Path(subjects_dir, "fsmri", "surf"))
+    ico = _get_ico_surface(2)
+    for hemi, x in [("lh", -35), ("rh", 35)]:
+        mne.write_surface(
+            Path(subjects_dir, "fsmri", "surf", f"{hemi}.white"),
+            ico["rr"] * 30 + [x, 0, 0],
+            ico["tris"],
+        )
+
+    return mne.setup_source_space(
+        "fsmri", spacing="all", subjects_dir=subjects_dir, add_dist=False
+    )
+
+
+def test_label_kernel(tmp_path):
+    src = _make_surface_src(tmp_path)
+    ico = _get_ico_surface(2)
+    surfs = _surfaces_to_bem(
+        [dict(rr=ico["rr"] * radius, tris=ico["tris"]) for radius in [80, 85, 90]],
+        [
+            FIFF.FIFFV_BEM_SURF_ID_BRAIN,
+            FIFF.FIFFV_BEM_SURF_ID_SKULL,
+            FIFF.FIFFV_BEM_SURF_ID_HEAD,
+        ],
+        [0.3, 0.006, 0.3],
+    )
+    montage = mne.channels.make_standard_montage("standard_1020")
+    info = mne.create_info(montage.ch_names[:40], 100, "eeg")
+    info.set_montage(montage)
+    forward = mne.make_forward_solution(
+        info,
+        mne.transforms.Transform("head", "mri"),
+        src,
+        mne.make_bem_solution(surfs),
+    )
+    rng = np.random.default_rng(42)
+    evoked = mne.EvokedArray(rng.standard_normal((40, 50)) * 1e-6, info, nave=10)
+    evoked.set_eeg_reference(projection=True)
+    epochs = mne.EpochsArray(rng.standard_normal((3, 40, 50)) * 1e-6, info)
+    epochs.set_eeg_reference(projection=True)
+    labels = [
+        mne.Label(np.arange(40), hemi="lh", subject="fsmri", name="a-lh"),
+        mne.Label(np.arange(20, 80), hemi="rh", subject="fsmri", name="b-rh"),
+    ]
+
+    for loose, pick_ori in [(0.2, None), (0.2, "normal"), (0, None)]:
+        inverse_operator = mne.minimum_norm.make_inverse_operator(
+            info, forward, mne.make_ad_hoc_cov(info), loose=loose
+        )
+        for method in ["MNE", "dSPM", "sLORETA", "eLORETA"]:
+            prepared = mne.minimum_norm.prepare_inverse_operator(
+                inverse_operator, evoked.nave, 1 / 9, method
+            )
+            stc = mne.minimum_norm.apply_inverse(
+                evoked, prepared, 1 / 9, method, pick_ori, prepared=True
+            )
+            for mode in ["mean", "mean_flip", "pca_flip", "max"]:
+                label_kernel = _make_label_kernel(
+                    prepared, labels, evoked.ch_names, method, pick_ori, mode
+                )
+                # Linear extraction-modes are folded into one projection
+                is_linear = pick_ori == "normal" or loose == 0
+                assert (label_kernel["kernel"] is not None) == (
+                    is_linear and mode in ["mean", "mean_flip"]
+                )
+                np.testing.assert_allclose(
+                    _apply_label_kernel(label_kernel, evoked.data),
+                    mne.extract_label_time_course(stc, labels, src, mode=mode),
+                    rtol=1e-6,
+                )
+
+        # All epochs are projected at once
+        prepared = mne.minimum_norm.prepare_inverse_operator(
+            inverse_operator, 1, 1 / 9, "dSPM"
+        )
+        stcs = mne.minimum_norm.apply_inverse_epochs(
+            epochs, prepared, 1 / 9, "dSPM", pick_ori=pick_ori, prepared=True
+        )
+        label_kernel = _make_label_kernel(
+            prepared, labels, epochs.ch_names, "dSPM", pick_ori, "mean_flip"
+        )
+        np.testing.assert_allclose(
+            _apply_label_kernel(label_kernel, epochs.get_data()),
+            mne.extract_label_time_course(stcs, labels, src, mode="mean_flip"),
+            rtol=1e-6,
+        )
+
+
+def test_src_connectivity(controller, monkeypatch):
+    controller.pr.add_meeg("meeg1")
+    controller.pr.sel_event_id["meeg1"] = ["a", "x", "b/x"]
+    meeg = MEEG("meeg1", controller)
+    info = mne.create_info(["Fz", "Cz", "Pz"], 100, "eeg")
+    rng = np.random.default_rng(42)
+    events = np.array([[i * 100, 0, [1, 2, 3][i % 3]] for i in range(12)])
+    epochs = mne.EpochsArray(
+        rng.standard_normal((12, 3, 200)),
+        info,
+        events,
+        event_id={"a/x": 1, "a/y": 2, "b/x": 3},
+    )
+    meeg.save_epochs(epochs)
+    label_ts = rng.standard_normal((12, 4, 200))
+    projections = list()
+
+    def _get_epochs_label_ts(*args):
+        projections.append(args)
+        return label_ts
+
+    monkeypatch.setattr(
+        "mne_pipeline_hd.functions.operations._get_epochs_label_ts",
+        _get_epochs_label_ts,
+    )
+    src_connectivity(meeg, None, "dSPM", 1 / 9, ["coh"], 10, 30, 2, "kernel")
+
+    # All conditions are computed from one projection of the epochs
+    assert len(projections) == 1
+    con_dict = meeg.load_connectivity()
+    for trial, selection in [
+        ("a", [0, 1, 3, 4, 6, 7, 9, 10]),
+        ("x", [0, 2, 3, 5, 6, 8, 9, 11]),
+        ("b/x", [2, 5, 8, 11]),
+    ]:
+        expected = mne_connectivity.spectral_connectivity_epochs(
+            label_ts[selection],
+            method="coh",
+            mode="multitaper",
+            sfreq=100,
+            fmin=10,
+            fmax=30,
+            faverage=True,
+            mt_adaptive=True,
+        )
+        np.testing.assert_allclose(
+            con_dict[trial]["coh"], expected.get_data(output="dense")[:, :, 0]
+        )
+
+
+def test_label_index(controller, data_cache):
+    controller.pr.all_fsmri.append("fsmri")
+    src = _make_surface_src(controller.subjects_dir)
+    fsmri = get_fsmri("fsmri", controller)
+    os.makedirs(Path(fsmri.src_path).parent)
+    fsmri.save_source_space(src)
+    os.makedirs(Path(fsmri.save_dir, "label"))
+    labels = [
+        mne.Label(np.arange(40), hemi="lh", subject="fsmri", name="a"),
+        mne.Label(np.arange(20, 80), hemi="rh", subject="fsmri", name="b"),
+    ]
+    for label in labels:
+        label.save(Path(fsmri.save_dir, "label", f"{label.name}-{label.hemi}.label"))
+    labels = fsmri.get_labels(["a-lh", "b-rh"])
+    controller.pr.add_meeg("meeg1")
+    controller.pr.meeg_to_fsmri["meeg1"] = "fsmri"
+    controller.pr.sel_event_id["meeg1"] = ["trial1", "trial2"]
+    meeg = MEEG("meeg1", controller)
+    rng = np.random.default_rng(42)
+    vertices = [s["vertno"] for s in src]
+    stcs = {
+        trial: mne.SourceEstimate(
+            rng.standard_normal((len(src[0]["vertno"]) * 2, 20)), vertices, 0, 0.01
+        )
+        for trial in meeg.sel_trials
+    }
+    meeg.load_source_estimates = lambda: stcs
+    ltcs = dict()
+    meeg.save_ltc = ltcs.update
+
+    for mode in ["mean", "mean_flip", "pca_flip", "max"]:
+        label_time_course(meeg, ["a-lh", "b-rh"], mode, "stc", None, None, None)
+        for trial, stc in stcs.items():
+            expected = mne.extract_label_time_course(stc, labels, src, mode=mode)
+            for label, ltc in zip(labels, expected):
+                np.testing.assert_allclose(ltcs[trial][label.name][0], ltc)
+
+    # The label-index is computed once for all modes and trials
+    index_paths = list(Path(fsmri.save_dir, "bem").glob("*-label-index.npz"))
+    assert len(index_paths) == 1
+    label_index = fsmri.get_label_index(labels, vertices)
+    assert fsmri.get_label_index(labels, vertices) is label_index
+    data_cache.clear()
+    assert (
+        label_index["mean_flip"] != fsmri.get_label_index(labels, vertices)["mean_flip"]
+    ).nnz == 0
+
+
+def _patch_source_morph(monkeypatch):
+    """Replace the computation of the source-morph by a cheap identity-morph
+    and return the list of morph-destinations it was computed for."""
+    morphs = list()
+
+    def _compute_source_morph(src, subject_from, subject_to, subjects_dir):
+        vertices = [np.array([0, 1]), np.array([0, 1])]
+        morphs.append(subject_to)
+        return mne.SourceMorph(
+            subject_from=subject_from,
+            subject_to=subject_to,
+            kind="surface",
+            zooms=None,
+            niter_affine=None,
+            niter_sdr=None,
+            spacing=None,
+            smooth=None,
+            xhemi=False,
+            morph_mat=sparse.eye(4, format="csr"),
+            vertices_to=vertices,
+            shape=None,
+            affine=None,
+            pre_affine=None,
+            sdr_morph=None,
+            src_data=dict(vertices_from=vertices),
+            vol_morph_mat=None,
+        )
+
+    monkeypatch.setattr(mne, "compute_source_morph", _compute_source_morph)
+    monkeypatch.setattr(FSMRI, "load_source_space", lambda self: None)
+
+    return morphs
+
+
+def test_morph_fsmri_parameters(controller, monkeypatch):
+    controller.pr.add_fsmri("fsmri1")
+    controller.pr.add_meeg("meeg1")
+    controller.pr.meeg_to_fsmri["meeg1"] = "fsmri1"
+    fsmri = get_fsmri("fsmri1", controller)
+    os.makedirs(Path(fsmri.src_path).parent)
+    Path(fsmri.src_path).touch()
+    morphs = _patch_source_morph(monkeypatch)
+    morph_fsmri(MEEG("meeg1", controller), "fsaverage")
+    morph_fsmri(MEEG("meeg1", controller), "fsaverage")
+    assert morphs == ["fsaverage"]
+
+    # A changed morph-destination in the same session is computed to a new path
+    controller.pr.parameters[controller.pr.p_preset]["morph_to"] = "other"
+    meeg = MEEG("meeg1", controller)
+    assert meeg.fsmri.source_morph_path != fsmri.source_morph_path
+    morph_fsmri(meeg, "other")
+    assert morphs == ["fsaverage", "other"]
+    assert meeg.fsmri.get_source_morph().subject_to == "other"
+
+    # A morph with another destination at the path is outdated
+    os.replace(fsmri.source_morph_path, meeg.fsmri.source_morph_path)
+    morph_fsmri(meeg, "other")
+    assert morphs == ["fsaverage", "other", "other"]
+
+
+def test_morph_fsmri_shared(controller, monkeypatch):
+    controller.pr.add_fsmri("fsmri1")
+    for name in ["meeg1", "meeg2"]:
+        controller.pr.add_meeg(name)
+        controller.pr.meeg_to_fsmri[name] = "fsmri1"
+    controller.pr.sel_meeg = ["meeg1", "meeg2"]
+    controller.pr.sel_functions = ["morph_fsmri"]
+    fsmri = get_fsmri("fsmri1", controller)
+    os.makedirs(Path(fsmri.src_path).parent)
+    Path(fsmri.src_path).touch()
+    morphs = _patch_source_morph(monkeypatch)
+
+    # The MEEG-files sharing the FSMRI are not morphed concurrently
+    graph = RunController(controller).graph
+    finished = list()
+    while not graph.is_finished():
+        ready_steps = graph.ready_steps()
+        assert len(ready_steps) == 1
+        step = ready_steps[0]
+        graph.mark_running(step)
+        morph_fsmri(MEEG(step[0], controller), "fsaverage")
+        graph.mark_finished(step)
+        finished.append(step)
+    assert finished == [("meeg1", "morph_fsmri"), ("meeg2", "morph_fsmri")]
+    # The source-morph of the first MEEG-file is reused by the second
+    assert morphs == ["fsaverage"]
+    file_params = get_fsmri("fsmri1", controller).file_parameters
+    assert Path(fsmri.source_morph_path).name in file_params
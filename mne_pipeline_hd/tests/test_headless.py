@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Authors: Martin Schulz <dev@mgschulz.de>
+License: BSD 3-Clause
+Github: https://github.com/marsipu/mne-pipeline-hd
+"""
+import os
+import subprocess
+import sys
+
+# Runs the headless-mode and checks that PyQt5 was not imported
+run_script = """
+import sys
+from mne_pipeline_hd.__main__ import main_headless
+exit_code = main_headless(sys.argv[1:])
+assert not any(["PyQt5" in m for m in sys.modules])
+sys.exit(exit_code)
+"""
+
+
+def _run_headless(controller, tmpdir, *args):
+    env = os.environ.copy()
+    # Use separate settings for the QSettingsDummy
+    env["HOME"] = str(tmpdir)
+    env["USERPROFILE"] = str(tmpdir)
+    command = [
+        sys.executable,
+        "-c",
+        run_script,
+        "--home",
+        controller.home_path,
+        "--project",
+        controller.pr.name,
+        *args,
+    ]
+    process = subprocess.run(command, env=env, capture_output=True, text=True)
+
+    return process
+
+
+def test_headless(controller, tmpdir):
+    controller.pr.add_meeg("meeg1")
+    controller.pr.sel_meeg = ["meeg1"]
+    controller.pr.save()
+
+    # The data is missing, so the step has to fail
+    process = _run_headless(controller, tmpdir, "--functions", "filter_data")
+    assert process.returncode == 1, process.stderr
+    assert "1 step(s) failed!" in process.stderr
+
+    # Nothing to run (no FSMRI selected)
+    process = _run_headless(controller, tmpdir, "--functions", "prepare_bem")
+    assert process.returncode == 0, process.stderr
+
+    # The last run was not interrupted
+    process = _run_headless(controller, tmpdir, "--resume")
+    assert process.returncode == 2
+
+    # Invalid function
+    process = _run_headless(controller, tmpdir, "--functions", "no_function")
+    assert process.returncode == 2
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Authors: Martin Schulz <dev@mgschulz.de>
+License: BSD 3-Clause
+Github: https://github.com/marsipu/mne-pipeline-hd
+"""
+import pytest
+
+from mne_pipeline_hd.pipeline.function_utils import RunController
+from mne_pipeline_hd.pipeline.journal import RunJournal, get_resumable_journal
+
+
+def test_resume(controller):
+    for name in ["meeg1", "meeg2"]:
+        controller.pr.add_meeg(name)
+    controller.pr.sel_meeg = ["meeg1", "meeg2"]
+    controller.pr.sel_functions = ["filter_data"]
+    assert get_resumable_journal(controller.pr) is None
+    with pytest.raises(RuntimeError):
+        RunController(controller, resume=True)
+
+    # Simulate a run, which was interrupted after the first step
+    rc = RunController(controller)
+    all_steps = rc.all_steps
+    rc.journal.write("start", all_steps[0])
+    rc.journal.write("finish", all_steps[0])
+    rc.journal.write("start", all_steps[1])
+    # The last entry may be incomplete after a crash
+    with open(rc.journal.path, "a") as file:
+        file.write('{"event": "fin')
+    assert RunJournal(rc.journal.path).remaining_steps() == all_steps[1:]
+
+    # The steps are restored from the journal, not from the selection
+    controller.pr.sel_meeg = list()
+    journal = get_resumable_journal(controller.pr)
+    assert journal.path == rc.journal.path
+    rc = RunController(controller, resume=True)
+    assert rc.all_steps == all_steps
+    assert rc.prog_count == 1
+    assert rc.graph.ready_steps() == all_steps[1:]
+
+    rc.start()
+    rc.finished_event.wait(60)
+    # The data is missing, so the resumed step fails
+    assert list(rc.errors.keys()) == all_steps[1:]
+    journal = RunJournal(rc.journal.path)
+    assert list(journal.failed.keys()) == all_steps[1:]
+    assert get_resumable_journal(controller.pr) is None
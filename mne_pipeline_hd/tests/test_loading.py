@@ -4,6 +4,18 @@ Authors: Martin Schulz <dev@mgschulz.de>
 License: BSD 3-Clause
 Github: https://github.com/marsipu/mne-pipeline-hd
 """
+import os
+import pickle
+from pathlib import Path
+
+import mne
+import numpy as np
+from scipy import sparse
+
+from mne_pipeline_hd.pipeline import data_cache as data_cache_module
+from mne_pipeline_hd.pipeline.data_cache import get_nbytes
+from mne_pipeline_hd.pipeline.loading import FSMRI, MEEG, get_fsmri, record_inputs
+from mne_pipeline_hd.pipeline.pipeline_utils import check_up_to_date
 
 
 def test_meeg(controller):
@@ -12,3 +24,239 @@ def test_meeg(controller):
 
 def test_fsmri(controller):
     controller.pr.add_fsmri("fsaverage")
+
+
+def test_up_to_date(controller):
+    controller.pr.add_meeg("meeg1")
+    meeg = MEEG("meeg1", controller)
+    info = mne.create_info(["EEG 001", "EEG 002"], 100, "eeg")
+    meeg.save_raw(mne.io.RawArray(np.zeros((2, 100)), info))
+
+    # Named after the pipeline-function to be recorded in the file-parameters
+    def filter_data(meeg):
+        raw = meeg.load_raw()
+        meeg.save_filtered(raw)
+
+    assert not check_up_to_date(meeg, "filter_data", {"raw_filtered"})
+    with record_inputs():
+        filter_data(meeg)
+    file_params = meeg.file_parameters[Path(meeg.raw_filtered_path).name]
+    assert meeg.raw_path in file_params["INPUTS"]
+    assert check_up_to_date(meeg, "filter_data", {"raw_filtered"})
+
+    # Changed parameter
+    old_highpass = meeg.pa["highpass"]
+    meeg.pa["highpass"] = old_highpass + 1
+    assert not check_up_to_date(meeg, "filter_data", {"raw_filtered"})
+    meeg.pa["highpass"] = old_highpass
+    assert check_up_to_date(meeg, "filter_data", {"raw_filtered"})
+
+    # Overwrite forces the function to run
+    controller.settings["overwrite"] = True
+    assert not check_up_to_date(meeg, "filter_data", {"raw_filtered"})
+    controller.settings["overwrite"] = False
+
+    # Changed input
+    stat = os.stat(meeg.raw_path)
+    os.utime(meeg.raw_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert not check_up_to_date(meeg, "filter_data", {"raw_filtered"})
+
+
+def test_data_cache(controller, data_cache, monkeypatch):
+    cache = data_cache
+    controller.pr.add_meeg("meeg1")
+    meeg = MEEG("meeg1", controller)
+    info = mne.create_info(["EEG 001", "EEG 002"], 100, "eeg")
+    raw = mne.io.RawArray(np.zeros((2, 100)), info)
+    meeg.save_raw(raw)
+    assert cache.n_bytes >= 2 * 100 * 8
+    # Saved data is cached without a copy
+    assert list(cache.entries.values())[0][0] is raw
+
+    # Changes in place don't affect the cached data
+    raw = meeg.load_raw()
+    raw._data += 1
+    hits = cache.hits
+    assert np.all(meeg.load_raw().get_data() == 0)
+    assert cache.hits == hits + 1
+
+    # The bad channels are applied when loading
+    meeg.set_bad_channels(["EEG 001"])
+    assert meeg.load_raw().info["bads"] == ["EEG 001"]
+
+    # The least recently used data is removed first
+    assert len(cache.entries) == 2
+    cache.set_max_bytes(get_nbytes(raw))
+    meeg.save_filtered(raw)
+    assert len(cache.entries) == 1
+    assert list(cache.entries)[0][0] == "raw_filtered"
+    assert get_nbytes(np.zeros(100)) == 800
+
+    # Older data is removed before new data is copied into the cache
+    copy_sizes = list()
+
+    def _copy_data(data):
+        copy_sizes.append(cache.n_bytes)
+        return data
+
+    monkeypatch.setattr(data_cache_module, "copy_data", _copy_data)
+    cache.set_max_bytes(get_nbytes(raw))
+    cache.put(("other",), raw)
+    assert copy_sizes == [0]
+    assert list(cache.entries)[0][0] == "other"
+
+
+def test_fsmri_registry(controller):
+    controller.pr.add_fsmri("fsmri1")
+    for name in ["meeg1", "meeg2"]:
+        controller.pr.add_meeg(name)
+        controller.pr.meeg_to_fsmri[name] = "fsmri1"
+    meeg1 = MEEG("meeg1", controller)
+    meeg2 = MEEG("meeg2", controller)
+    assert meeg1.fsmri is meeg2.fsmri
+    assert get_fsmri("fsmri1", controller) is meeg1.fsmri
+
+    # A new controller of the same project reuses the FSMRI-object
+    meeg1.fsmri.labels = {"Other": list()}
+    other_ct = pickle.loads(pickle.dumps(controller))
+    other_fsmri = get_fsmri("fsmri1", other_ct)
+    assert other_fsmri is meeg1.fsmri
+    assert other_fsmri.ct is other_ct
+    assert other_fsmri.plot_files is other_ct.pr.plot_files["fsmri1"]["Default"]
+
+    # Changed parameters determine new paths
+    fsmri = get_fsmri("fsmri1", controller)
+    controller.pr.parameters[controller.pr.p_preset]["src_spacing"] = "oct6"
+    new_fsmri = get_fsmri("fsmri1", controller)
+    assert new_fsmri is not fsmri
+    assert "oct6" in new_fsmri.src_path and "oct6" not in fsmri.src_path
+    assert new_fsmri.labels is fsmri.labels
+
+    # The FSMRI-objects of the previous project aren't reused
+    controller.change_project("other")
+    assert get_fsmri("fsmri1", controller).pr is controller.pr
+
+
+def test_load_policy(controller):
+    controller.pr.add_meeg("meeg1")
+    meeg = MEEG("meeg1", controller)
+    info = mne.create_info(
+        ["EEG 001", "EEG 002", "STI 001"], 100, ["eeg"] * 2 + ["stim"]
+    )
+    meeg.save_raw(mne.io.RawArray(np.ones((3, 1000)), info))
+
+    assert not meeg.load_raw(policy="lazy").preload
+    raw = meeg.load_raw(policy="memmap")
+    assert isinstance(raw._data, np.memmap)
+    memmap_path = raw._data.filename
+    assert os.path.isfile(memmap_path)
+    del raw
+    assert not os.path.isfile(memmap_path)
+
+    # Only a subset is read
+    raw = meeg.load_raw(picks="stim", tmin=1, tmax=5)
+    assert raw.preload
+    assert raw.ch_names == ["STI 001"]
+    assert raw.times[-1] == 4
+    meeg.load_policies["raw"] = "lazy"
+    assert not meeg.load_raw().preload
+
+
+def test_source_morph(controller):
+    controller.pr.add_fsmri("fsmri1")
+    for name in ["meeg1", "meeg2"]:
+        controller.pr.add_meeg(name)
+        controller.pr.meeg_to_fsmri[name] = "fsmri1"
+    fsmri = get_fsmri("fsmri1", controller)
+    os.makedirs(Path(fsmri.source_morph_path).parent, exist_ok=True)
+
+    vertices = [np.array([0, 1]), np.array([0, 1])]
+    morph_kwargs = dict(
+        subject_from="fsmri1",
+        subject_to="fsaverage",
+        kind="surface",
+        zooms=None,
+        niter_affine=None,
+        niter_sdr=None,
+        spacing=None,
+        smooth=None,
+        xhemi=False,
+        vertices_to=vertices,
+        shape=None,
+        affine=None,
+        pre_affine=None,
+        sdr_morph=None,
+        src_data=dict(vertices_from=vertices),
+        vol_morph_mat=None,
+    )
+    fsmri.save_source_morph(
+        mne.SourceMorph(morph_mat=sparse.eye(4, format="csr"), **morph_kwargs)
+    )
+
+    # The source-morph is loaded once for all MEEG-files of the FSMRI
+    morph = MEEG("meeg1", controller).fsmri.get_source_morph()
+    assert MEEG("meeg2", controller).fsmri.get_source_morph() is morph
+
+    # The source-morph is reloaded if its file changed
+    fsmri.save_source_morph(
+        mne.SourceMorph(morph_mat=2 * sparse.eye(4, format="csr"), **morph_kwargs)
+    )
+    stc = mne.SourceEstimate(np.ones((4, 1)), vertices, 0, 1, subject="fsmri1")
+    assert np.all(fsmri.get_source_morph().apply(stc).data == 2)
+
+
+def test_label_cache(controller, monkeypatch):
+    controller.pr.add_fsmri("fsmri1")
+    fsmri = get_fsmri("fsmri1", controller)
+    label_dir = Path(fsmri.save_dir, "label")
+    os.makedirs(label_dir)
+    os.makedirs(Path(fsmri.save_dir, "surf"))
+    ico = mne.surface._get_ico_surface(2)
+    for hemi in ["lh", "rh"]:
+        mne.write_surface(
+            Path(fsmri.save_dir, "surf", f"{hemi}.white"), ico["rr"], ico["tris"]
+        )
+    rng = np.random.default_rng(42)
+    for name, hemi in [("a", "lh"), ("b", "rh")]:
+        vertices = np.sort(rng.choice(162, 20, replace=False))
+        mne.Label(vertices, ico["rr"][vertices], hemi=hemi).save(
+            label_dir / f"{name}-{hemi}.label"
+        )
+    annot_labels = [
+        mne.Label(np.arange(10), hemi=hemi, name=f"c-{hemi}", color=(1, 0, 0, 1))
+        for hemi in ["lh", "rh"]
+    ]
+    mne.write_labels_to_annot(
+        annot_labels, "fsmri1", "test", subjects_dir=controller.subjects_dir
+    )
+
+    labels = fsmri.get_labels(["a-lh", "c-rh"])
+    expected = [
+        mne.read_label(label_dir / "a-lh.label", "fsmri1"),
+        mne.read_labels_from_annot(
+            "fsmri1", "test", "rh", subjects_dir=controller.subjects_dir
+        )[0],
+    ]
+    for label, expected_label in zip(labels, expected):
+        assert label.name == expected_label.name
+        assert label.hemi == expected_label.hemi
+        np.testing.assert_array_equal(label.vertices, expected_label.vertices)
+        np.testing.assert_allclose(label.pos, expected_label.pos)
+    assert labels[0].color is None
+    np.testing.assert_allclose(labels[1].color, (1, 0, 0, 1))
+
+    # A new FSMRI-object reads the requested labels from the saved index
+    def _read_label(*args, **kwargs):
+        raise AssertionError("Labels are parsed again")
+
+    monkeypatch.setattr(mne, "read_label", _read_label)
+    new_fsmri = FSMRI("fsmri1", controller)
+    assert [lb.name for lb in new_fsmri.get_labels(["b-rh"])] == ["b-rh"]
+    monkeypatch.undo()
+
+    # The index is rebuilt if the label-directory changed
+    mne.Label(np.arange(5), hemi="lh").save(label_dir / "d-lh.label")
+    assert len(new_fsmri.get_labels(["d-lh"])) == 1
+    all_labels = get_fsmri("fsmri1", controller, load_labels=True).labels
+    assert {lb.name for lb in all_labels["Other"]} == {"a-lh", "b-rh", "d-lh"}
+    assert {"c-lh", "c-rh"} <= {lb.name for lb in all_labels["test"]}
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Authors: Martin Schulz <dev@mgschulz.de>
+License: BSD 3-Clause
+Github: https://github.com/marsipu/mne-pipeline-hd
+"""
+import os
+import pickle
+import time
+from multiprocessing import Pipe
+
+from mne_pipeline_hd.pipeline.function_utils import (
+    RunController,
+    StreamManager,
+    get_arguments,
+    get_func,
+    receive_stream,
+    run_step_spec,
+)
+from mne_pipeline_hd.pipeline.loading import MEEG
+from mne_pipeline_hd.pipeline.parallel import (
+    StepSpec,
+    WorkerPool,
+    apply_project_changes,
+    close_mp_pool,
+    get_project_changes,
+    get_project_state,
+    init_mp_pool,
+)
+from mne_pipeline_hd.pipeline.pipeline_utils import ExceptionTuple
+
+
+def test_project_changes(controller):
+    pr = controller.pr
+    before = get_project_state(pr)
+    pr.meeg_bad_channels["meeg1"] = ["MEG 0111"]
+    pr.plot_files["meeg1"] = {"Default": {"plot_raw": ["a.png"]}}
+    pr.all_erm.append("erm1")
+    changes = get_project_changes(before, pr)
+
+    # Apply changes to the project of another process
+    other_pr = pickle.loads(pickle.dumps(controller)).pr
+    for attr_name, old_value in before.items():
+        setattr(other_pr, attr_name, old_value)
+    other_pr.plot_files["meeg2"] = {"Default": {"plot_raw": ["b.png"]}}
+    apply_project_changes(other_pr, changes)
+    assert other_pr.meeg_bad_channels["meeg1"] == ["MEG 0111"]
+    assert other_pr.plot_files["meeg1"]["Default"]["plot_raw"] == ["a.png"]
+    assert other_pr.plot_files["meeg2"]["Default"]["plot_raw"] == ["b.png"]
+    assert other_pr.all_erm == ["erm1"]
+
+
+def _remove_project_keys(controller):
+    pr = controller.pr
+    before = get_project_state(pr)
+    pr.meeg_ica_exclude.pop("meeg1")
+    pr.plot_files["meeg1"]["Default"].pop("plot_raw")
+
+    return get_project_changes(before, pr)
+
+
+def test_project_deletions(controller):
+    pr = controller.pr
+    pr.meeg_ica_exclude["meeg1"] = [0, 1]
+    pr.meeg_ica_exclude["meeg2"] = [2]
+    pr.plot_files["meeg1"] = {"Default": {"plot_raw": ["a.png"], "plot_psd": []}}
+
+    # Keys removed in a worker-process are removed in the main-process too
+    pool = WorkerPool(1)
+    results = list()
+    try:
+        pool.apply_async(_remove_project_keys, (controller,), callback=results.append)
+        start_time = time.time()
+        while len(results) == 0 and time.time() - start_time < 120:
+            time.sleep(0.1)
+    finally:
+        pool.close()
+        pool.join()
+    assert len(results) == 1
+    apply_project_changes(pr, results[0])
+    assert pr.meeg_ica_exclude == {"meeg2": [2]}
+    assert pr.plot_files["meeg1"] == {"Default": {"plot_psd": []}}
+
+    # Deleting a key, which is already missing, doesn't fail
+    apply_project_changes(pr, results[0])
+    assert pr.meeg_ica_exclude == {"meeg2": [2]}
+
+
+def _count_fsmri_steps(spec):
+    fsmri = spec.load_object().fsmri
+    fsmri.n_steps = getattr(fsmri, "n_steps", 0) + 1
+
+    return fsmri.n_steps, fsmri.ct is spec.ct
+
+
+def test_worker_fsmri(controller):
+    controller.pr.add_fsmri("fsmri1")
+    for name in ["meeg1", "meeg2"]:
+        controller.pr.add_meeg(name)
+        controller.pr.meeg_to_fsmri[name] = "fsmri1"
+    specs = [
+        StepSpec("morph_fsmri", MEEG(name, controller), dict())
+        for name in ["meeg1", "meeg2"]
+    ]
+
+    # Each step receives its own controller, but they share the FSMRI-object
+    pool = WorkerPool(1)
+    results = list()
+    try:
+        for spec in specs:
+            pool.apply_async(_count_fsmri_steps, (spec,), callback=results.append)
+        start_time = time.time()
+        while len(results) < 2 and time.time() - start_time < 120:
+            time.sleep(0.1)
+    finally:
+        pool.close()
+        pool.join()
+    assert results == [(1, True), (2, True)]
+
+
+def test_step_spec(controller):
+    controller.pr.add_meeg("meeg1")
+    meeg = MEEG("meeg1", controller)
+    func = get_func("filter_data", meeg)
+    keywargs = get_arguments(func, meeg)
+    spec = pickle.loads(pickle.dumps(StepSpec("filter_data", meeg, keywargs)))
+    assert spec.obj_name == "meeg1"
+    assert spec.obj_type == "MEEG"
+    assert spec.keywargs["meeg"] is None
+    assert spec.keywargs["highpass"] == keywargs["highpass"]
+
+    # There is no data, so the error has to be returned
+    step_result = run_step_spec(spec)
+    assert isinstance(step_result.result, ExceptionTuple)
+
+
+def test_run_with_pool(controller):
+    for name in ["meeg1", "meeg2"]:
+        controller.pr.add_meeg(name)
+    controller.pr.sel_meeg = ["meeg1", "meeg2"]
+    controller.pr.sel_functions = ["filter_data", "epoch_raw"]
+    pool = init_mp_pool(2)
+    try:
+        rc = RunController(controller, pool=pool)
+        assert rc.n_slots() == 2
+        rc.start()
+        start_time = time.time()
+        while not rc.graph.is_finished() and time.time() - start_time < 120:
+            time.sleep(0.1)
+        assert rc.graph.is_finished()
+        assert rc.prog_count == len(rc.all_steps)
+    finally:
+        close_mp_pool()
+
+
+def test_worker_pool():
+    pool = WorkerPool(1, max_tasks=2)
+    results = list()
+    errors = list()
+    try:
+        # The worker-process is replaced after two tasks
+        for _ in range(4):
+            pool.apply_async(os.getpid, callback=results.append)
+        # A crashed worker-process returns an error and is replaced
+        pool.apply_async(os._exit, (3,), error_callback=errors.append)
+        pool.apply_async(int, ("x",), error_callback=errors.append)
+        pool.apply_async(os.getpid, callback=results.append)
+        start_time = time.time()
+        while len(results) + len(errors) < 7 and time.time() - start_time < 120:
+            time.sleep(0.1)
+        assert len(results) == 5
+        assert len(set(results[:4])) == 2
+        assert len(errors) == 2
+        assert any(isinstance(err, ValueError) for err in errors)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def test_stream_manager():
+    recv_pipe, send_pipe = Pipe(False)
+    manager = StreamManager(send_pipe, max_delay=60)
+    manager.stdout_sender.write("Filtering\n")
+    manager.stdout_sender.write("done\n")
+    for idx in range(1000):
+        manager.stderr_sender.write(f"\r{idx}/1000")
+    manager.stderr_sender.write("Warning\n")
+    manager.close()
+    send_pipe.close()
+    records = list(receive_stream(recv_pipe))
+    assert records == [
+        ("stdout", "Filtering\ndone\n"),
+        ("progress", "\r999/1000"),
+        ("stderr", "Warning\n"),
+    ]
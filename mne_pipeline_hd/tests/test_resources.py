@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Authors: Martin Schulz <dev@mgschulz.de>
+License: BSD 3-Clause
+Github: https://github.com/marsipu/mne-pipeline-hd
+"""
+import numpy as np
+
+from mne_pipeline_hd.pipeline.function_utils import RunController
+from mne_pipeline_hd.pipeline.resources import (
+    CPUBudget,
+    MemoryBudget,
+    get_available_cores,
+    get_current_memory,
+    get_peak_memory,
+    limit_threads,
+    reset_peak_memory,
+)
+from mne_pipeline_hd.pipeline.runtime_history import MemoryHistory
+
+
+def test_cpu_budget():
+    n_cores = get_available_cores()
+    budget = CPUBudget(n_workers=2, n_jobs=-1)
+    assert budget.n_per_worker == max(n_cores // 2, 1)
+    assert budget.get_n_jobs(-1) == budget.n_per_worker
+    assert budget.get_n_jobs(1) == 1
+    assert budget.get_n_jobs(n_cores * 2) == budget.n_per_worker
+    assert budget.get_n_jobs("cuda") == "cuda"
+
+    budget = CPUBudget(n_workers=4, n_jobs=8)
+    assert budget.n_per_worker == 2
+
+    # More workers than cores
+    budget = CPUBudget(n_workers=n_cores + 1, n_jobs=-1)
+    assert budget.n_per_worker == 1
+    assert budget.check_oversubscription()
+
+
+def test_limit_threads():
+    with limit_threads(1):
+        pass
+    with limit_threads(None):
+        pass
+
+
+def test_peak_memory():
+    memory_before = get_current_memory()
+    if reset_peak_memory():
+        np.ones(100 * 1024**2, dtype=np.uint8).sum()
+        assert get_peak_memory() - memory_before >= 50 * 1024**2
+    else:
+        assert get_peak_memory() > 0
+
+
+def test_memory_budget(controller):
+    budget = MemoryBudget(ram_budget=1)
+    gb = 1024**3
+    # The first step always fits (exceeding steps run alone)
+    assert budget.fits(2 * gb)
+    budget.reserve(("meeg1", "f1"), 0.6 * gb)
+    assert budget.fits(0.4 * gb)
+    assert not budget.fits(0.5 * gb)
+    budget.release(("meeg1", "f1"))
+    assert budget.fits(0.5 * gb)
+
+    history = MemoryHistory(controller.pr)
+    assert history.predict("filter_data", 100) == 300
+    history.add("filter_data", 100, 500)
+    assert history.predict("filter_data", 200) == 1000
+
+    # Steps wait, until the memory of the running steps is free
+    for name in ["meeg1", "meeg2"]:
+        controller.pr.add_meeg(name)
+    controller.pr.sel_meeg = ["meeg1", "meeg2"]
+    controller.pr.sel_functions = ["filter_data"]
+    rc = RunController(controller, ram_budget=1)
+    rc.n_slots = lambda: 2
+    rc.input_sizes = {step: 0.2 * gb for step in rc.all_steps}
+    first_step = rc.get_next_step()
+    assert rc.get_next_step() is None
+    rc.finish_step(first_step, None)
+    assert rc.get_next_step() is not None
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Authors: Martin Schulz <dev@mgschulz.de>
+License: BSD 3-Clause
+Github: https://github.com/marsipu/mne-pipeline-hd
+"""
+import mne
+import numpy as np
+import pytest
+
+from mne_pipeline_hd.pipeline.function_utils import RunController
+from mne_pipeline_hd.pipeline.loading import MEEG
+from mne_pipeline_hd.pipeline.runtime_history import RuntimeHistory
+from mne_pipeline_hd.pipeline.scheduling import StepGraph
+
+
+def _prepare_run(controller, functions):
+    for name in ["meeg1", "meeg2"]:
+        controller.pr.add_meeg(name)
+    controller.pr.sel_meeg = ["meeg1", "meeg2"]
+    controller.pr.sel_functions = functions
+
+    return RunController(controller)
+
+
+def test_step_graph():
+    graph = StepGraph([("a", "f1"), ("a", "f2"), ("b", "f1")])
+    graph.add_dependency(("a", "f2"), ("a", "f1"))
+    assert graph.ready_steps() == [("a", "f1"), ("b", "f1")]
+
+    graph.mark_running(("a", "f1"))
+    assert graph.ready_steps() == [("b", "f1")]
+    graph.mark_finished(("a", "f1"))
+    assert graph.ready_steps() == [("a", "f2"), ("b", "f1")]
+
+    graph.add_dependency(("a", "f1"), ("a", "f2"))
+    with pytest.raises(RuntimeError):
+        graph.check_cycles()
+
+
+def test_data_dependencies(controller):
+    rc = _prepare_run(
+        controller,
+        [
+            "filter_data",
+            "epoch_raw",
+            "get_evokeds",
+            "plot_evoked_topo",
+            "plot_evoked_butterfly",
+        ],
+    )
+    parents = rc.graph.parents
+    # Read after write
+    assert ("meeg1", "filter_data") in parents[("meeg1", "epoch_raw")]
+    assert ("meeg1", "epoch_raw") in parents[("meeg1", "get_evokeds")]
+    assert ("meeg1", "get_evokeds") in parents[("meeg1", "plot_evoked_topo")]
+    # Plots only reading the same data are independent
+    assert ("meeg1", "plot_evoked_topo") not in parents[
+        ("meeg1", "plot_evoked_butterfly")
+    ]
+    # Different MEEG-files are independent
+    assert all([p[0] == "meeg2" for p in parents[("meeg2", "epoch_raw")]])
+
+    # All first steps are ready at once
+    assert rc.graph.ready_steps() == [
+        ("meeg1", "filter_data"),
+        ("meeg2", "filter_data"),
+    ]
+
+
+def test_declared_dependencies(controller):
+    controller.pr.add_fsmri("fsmri1")
+    controller.pr.sel_fsmri = ["fsmri1"]
+    controller.pr.meeg_to_fsmri["meeg1"] = "fsmri1"
+    rc = _prepare_run(controller, ["morph_labels_from_fsaverage", "label_time_course"])
+    parents = rc.graph.parents
+    assert ("fsmri1", "morph_labels_from_fsaverage") in parents[
+        ("meeg1", "label_time_course")
+    ]
+    assert len(parents[("meeg2", "label_time_course")]) == 0
+
+
+def test_critical_path():
+    graph = StepGraph([("a", "f1"), ("b", "f1"), ("a", "f2"), ("a", "f3")])
+    graph.add_dependency(("a", "f2"), ("a", "f1"))
+    graph.add_dependency(("a", "f3"), ("a", "f2"))
+    # The step starting the longer chain comes first
+    graph.set_critical_path_priorities(
+        {("a", "f1"): 1, ("b", "f1"): 5, ("a", "f2"): 2, ("a", "f3"): 3}
+    )
+    assert graph.ready_steps() == [("a", "f1"), ("b", "f1")]
+    graph.set_critical_path_priorities(
+        {("a", "f1"): 1, ("b", "f1"): 10, ("a", "f2"): 2, ("a", "f3"): 3}
+    )
+    assert graph.ready_steps() == [("b", "f1"), ("a", "f1")]
+
+
+def test_runtime_history(controller):
+    history = RuntimeHistory(controller.pr)
+    assert history.predict("filter_data", 100) is None
+    assert history.default_runtime() == 1.0
+    history.add("filter_data", 100, 10)
+    history.add("filter_data", 200, 20)
+    history.add("plot_raw", 0, 2)
+    history.save()
+
+    history = RuntimeHistory(controller.pr)
+    # Scaled by the size of the object
+    assert history.predict("filter_data", 400) == 40
+    assert history.predict("plot_raw", 400) == 2
+    assert list(history.get_summary().index) == ["filter_data", "plot_raw"]
+
+    # The predictions are used for the priorities of the steps
+    rc = _prepare_run(controller, ["filter_data", "plot_raw"])
+    assert rc.predict_runtime(("meeg1", "plot_raw")) == 2
+    summary = rc.get_runtime_summary()
+    assert summary.loc["plot_raw", "this run [s]"] == 4
+
+
+def test_subset_loads(controller):
+    rc = _prepare_run(controller, ["find_events", "find_6ch_binary_events"])
+    for func_name in ["find_events", "find_6ch_binary_events"]:
+        func_io = rc.graph.func_ios[func_name]
+        assert func_io["self"]["subset"] == {"raw"}
+        assert "raw" in func_io["self"]["load"]
+
+    # Only the stim-channels are read, so the raw-data doesn't count
+    meeg = MEEG("meeg1", controller)
+    info = mne.create_info(["EEG 001", "STI 001"], 100, ["eeg", "stim"])
+    meeg.save_raw(mne.io.RawArray(np.zeros((2, 100)), info))
+    assert rc.get_input_size(("meeg1", "find_events")) == 0
+
+
+def test_fsmri_dependencies(controller):
+    controller.pr.add_fsmri("fsmri1")
+    for name in ["meeg1", "meeg2"]:
+        controller.pr.meeg_to_fsmri[name] = "fsmri1"
+    rc = _prepare_run(controller, ["morph_fsmri", "apply_morph"])
+    # The source-morph is saved to the FSMRI
+    assert rc.graph.func_ios["morph_fsmri"]["fsmri"]["save"] == {
+        "morph",
+        "file_parameters",
+    }
+    assert rc.graph.func_ios["apply_morph"]["fsmri"]["load"] == {"morph"}
+    assert ("meeg1", "morph_fsmri") in rc.graph.parents[("meeg1", "apply_morph")]
+    # Both MEEG-files save the source-morph of the same FSMRI (write after write)
+    assert ("meeg1", "morph_fsmri") in rc.graph.parents[("meeg2", "morph_fsmri")]
+    assert ("meeg1", "apply_morph") not in rc.graph.parents[("meeg2", "apply_morph")]
+
+
+def test_nested_function_io(controller):
+    rc = _prepare_run(controller, ["label_time_course", "label_kernel_time_course"])
+    # The data-types of label_kernel_time_course are included for its backend
+    func_ios = rc.graph.func_ios
+    assert {"evoked", "inverse"} <= func_ios["label_time_course"]["self"]["load"]
+    assert "labels" in func_ios["label_time_course"]["fsmri"]["load"]
+    assert "ltc" in func_ios["label_kernel_time_course"]["self"]["save"]